@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# A content-addressed cache of successful build results, shareable
+# between overlays and hosts.  A key covers the inputs we control: the
+# SRPM contents, the text of the mock config and the files it includes,
+# extra repositories and mock options, and the overlay packages it
+# builds against.  It does not cover the contents of the distribution
+# repositories the config points to, so a hit may have been built
+# against older versions of those.
+#
+# A cache is anything with lookup(key, destdir), which populates
+# @destdir with the cached result and returns True if @key is present,
+# and store(key, resultdir).  Use open_cache() to get one.  The cache
+# is optional: failing to reach it is logged, and treated as a miss.
+#
+# The HTTP server only accepts uploads from localhost, or, given a
+# secret, uploads signed with it (see upload_signature()), since
+# whoever can upload can put anything in everybody's builds.
+
+import os
+import re
+import json
+import hmac
+import socket
+import hashlib
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import urllib2
+import BaseHTTPServer
+
+from .utils import log, ensuredir, rmrf, hardlink_or_copy
+
+_key_re = re.compile(r'^[0-9a-f]{64}$')
+_include_re = re.compile(r'''^\s*include\(\s*['"]([^'"]+)['"]\s*\)''', re.MULTILINE)
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(65536)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+def srpm_content_digests(paths):
+    """Digest of the files inside each SRPM (spec, sources, patches),
+    returned as a dict keyed by path.  Unlike the digest of the .src.rpm
+    itself this doesn't vary with the time rpmbuild was run."""
+    if len(paths) == 0:
+        return {}
+    sentinel = '@@rdgo-end@@'
+    out = subprocess.check_output(['rpm', '-qp', '--nosignature',
+                                   '--qf', '[%{FILENAMES} %{FILEDIGESTS}\n]' + sentinel + '\n']
+                                  + list(paths))
+    chunks = out.split(sentinel + '\n')
+    assert len(chunks) == len(paths) + 1
+    result = {}
+    for path, chunk in zip(paths, chunks):
+        lines = sorted(l for l in chunk.split('\n') if l != '')
+        result[path] = hashlib.sha256('\n'.join(lines)).hexdigest()
+    return result
+
+def srpm_content_digest(path):
+    return srpm_content_digests([path])[path]
+
+def mock_config_digest(path, configdir):
+    """Digest of the mock config @path along with the files it
+    include()s, which like mock we look up relative to @configdir, and
+    the site defaults mock loads before it."""
+    h = hashlib.sha256()
+    seen = set()
+    queue = [path, configdir + '/site-defaults.cfg']
+    while queue:
+        cfg = queue.pop(0)
+        if cfg in seen:
+            continue
+        seen.add(cfg)
+        if cfg != path and not os.path.isfile(cfg):
+            # mock will complain about it; all that matters here is
+            # that it's missing
+            h.update('missing\n')
+            continue
+        with open(cfg) as f:
+            txt = f.read()
+        h.update(hashlib.sha256(txt).hexdigest() + '\n')
+        for name in _include_re.findall(txt):
+            if not os.path.isabs(name):
+                candidate = os.path.join(configdir, name)
+                if not os.path.isfile(candidate):
+                    candidate = os.path.join(os.path.dirname(cfg), name)
+                name = candidate
+            queue.append(name)
+    return h.hexdigest()
+
+def deps_digest(srpm_digests, names):
+    """Digest of the SRPM digests of the overlay components @names,
+    as found in the dict @srpm_digests."""
+    return hashlib.sha256('\n'.join(sorted(srpm_digests[n] for n in names))).hexdigest()
+
+def cache_key(srpm_digest, mockcfg_digest, repos_digest, addrepos=(), mock_options=()):
+    h = hashlib.sha256()
+    h.update('rdgo-buildcache-v0\n')
+    for v in [srpm_digest, mockcfg_digest, repos_digest]:
+        h.update(v + '\n')
+    if addrepos or mock_options:
+        h.update(json.dumps([sorted(addrepos), list(mock_options)]) + '\n')
+    return h.hexdigest()
+
+def _result_files(resultdir):
+    for name in sorted(os.listdir(resultdir)):
+        path = resultdir + '/' + name
+        if os.path.isfile(path) and not os.path.islink(path):
+            yield name, path
+
+def _fill_atomically(destdir, fill):
+    """Call @fill with a temporary directory next to @destdir; if it
+    returns True, the directory is renamed to @destdir, so an error
+    part way through never leaves a partial result behind."""
+    parent = os.path.dirname(os.path.abspath(destdir))
+    ensuredir(parent, with_parents=True)
+    tmpdir = tempfile.mkdtemp('.tmp', os.path.basename(destdir), parent)
+    try:
+        if not fill(tmpdir):
+            return False
+        os.chmod(tmpdir, 0o755)
+        os.rename(tmpdir, destdir)
+        return True
+    finally:
+        rmrf(tmpdir)
+
+class FilesystemBuildCache(object):
+    def __init__(self, path):
+        self.path = path
+        ensuredir(self.path)
+
+    def _keypath(self, key):
+        assert _key_re.match(key)
+        return self.path + '/' + key[0:2] + '/' + key
+
+    def lookup(self, key, destdir):
+        keypath = self._keypath(key)
+        if not os.path.isdir(keypath):
+            return False
+        def fill(tmpdir):
+            for name, path in _result_files(keypath):
+                hardlink_or_copy(path, tmpdir + '/' + name)
+            return True
+        return _fill_atomically(destdir, fill)
+
+    def store(self, key, resultdir):
+        keypath = self._keypath(key)
+        if os.path.isdir(keypath):
+            return
+        ensuredir(os.path.dirname(keypath))
+        tmpdir = tempfile.mkdtemp('.tmp', key, os.path.dirname(keypath))
+        try:
+            for name, path in _result_files(resultdir):
+                hardlink_or_copy(path, tmpdir + '/' + name)
+            try:
+                os.rename(tmpdir, keypath)
+            except OSError:
+                # Somebody else stored it first
+                if not os.path.isdir(keypath):
+                    raise
+        finally:
+            rmrf(tmpdir)
+
+def upload_signature(secret, key):
+    """Returns an object to update() with the uploaded contents of @key;
+    its hexdigest() is the signature in the X-Rdgo-Signature header."""
+    return hmac.new(secret, key + '\n', hashlib.sha256)
+
+# Failures talking to an HTTP cache, or reading what it sent
+_http_errors = (urllib2.URLError, socket.error, IOError, tarfile.TarError, ValueError)
+
+class HttpBuildCache(object):
+    """Talks to a server storing one tarball per key, such as the one
+    started by serve() below.  Results are fetched with GET and uploaded
+    with PUT on <url>/<key>.tar, signed with @secret if given."""
+    def __init__(self, url, secret=None):
+        self.url = url.rstrip('/')
+        self.secret = secret
+
+    def _keyurl(self, key):
+        assert _key_re.match(key)
+        return '{0}/{1}.tar'.format(self.url, key)
+
+    def lookup(self, key, destdir):
+        try:
+            return self._lookup(key, destdir)
+        except urllib2.HTTPError as e:
+            if e.code != 404:
+                log("Warning: result cache lookup of {0} failed: {1}".format(key, e))
+            return False
+        except _http_errors as e:
+            log("Warning: result cache lookup of {0} failed: {1}".format(key, e))
+            return False
+
+    def _lookup(self, key, destdir):
+        resp = urllib2.urlopen(self._keyurl(key))
+        with tempfile.TemporaryFile() as tmpf:
+            shutil.copyfileobj(resp, tmpf)
+            tmpf.seek(0)
+            tf = tarfile.open(fileobj=tmpf, mode='r')
+            members = tf.getmembers()
+            for member in members:
+                if not member.isfile() or '/' in member.name or member.name.startswith('.'):
+                    raise ValueError("Invalid member {0} in cached result {1}".format(member.name, key))
+            def fill(tmpdir):
+                for member in members:
+                    tf.extract(member, tmpdir)
+                return True
+            return _fill_atomically(destdir, fill)
+
+    def store(self, key, resultdir):
+        with tempfile.TemporaryFile() as tmpf:
+            tf = tarfile.open(fileobj=tmpf, mode='w')
+            for name, path in _result_files(resultdir):
+                tf.add(path, arcname=name)
+            tf.close()
+            size = tmpf.tell()
+            tmpf.seek(0)
+            data = tmpf.read(size)
+        req = urllib2.Request(self._keyurl(key), data=data)
+        req.add_header('Content-Type', 'application/x-tar')
+        if self.secret is not None:
+            signature = upload_signature(self.secret, key)
+            signature.update(data)
+            req.add_header('X-Rdgo-Signature', signature.hexdigest())
+        req.get_method = lambda: 'PUT'
+        try:
+            urllib2.urlopen(req).close()
+        except _http_errors as e:
+            log("Warning: storing {0} in the result cache failed: {1}".format(key, e))
+
+def open_cache(location, secret=None):
+    """The cache at @location, a directory or an HTTP URL; uploads to
+    the latter are signed with @secret if given."""
+    if location.startswith(('http://', 'https://')):
+        return HttpBuildCache(location, secret=secret)
+    return FilesystemBuildCache(location)
+
+class _CacheRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def _keypath(self):
+        name = self.path.strip('/')
+        if not name.endswith('.tar') or not _key_re.match(name[:-len('.tar')]):
+            self.send_error(404)
+            return None
+        return self.server.cachedir + '/' + name
+
+    def do_GET(self):
+        path = self._keypath()
+        if path is None:
+            return
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_PUT(self):
+        path = self._keypath()
+        if path is None:
+            return
+        secret = self.server.secret
+        if secret is None and self.client_address[0] not in ('127.0.0.1', '::1'):
+            self.send_error(403)
+            return
+        if secret is not None:
+            signature = upload_signature(secret, os.path.basename(path)[:-len('.tar')])
+        length = int(self.headers.getheader('Content-Length', 0))
+        (fd, tmppath) = tempfile.mkstemp('.tmp', 'put', self.server.cachedir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while length > 0:
+                    buf = self.rfile.read(min(length, 65536))
+                    if not buf:
+                        break
+                    f.write(buf)
+                    if secret is not None:
+                        signature.update(buf)
+                    length -= len(buf)
+            if length > 0:
+                self.send_error(400)
+                return
+            if secret is not None and not hmac.compare_digest(signature.hexdigest(),
+                                                              self.headers.getheader('X-Rdgo-Signature', '')):
+                self.send_error(403)
+                return
+            os.rename(tmppath, path)
+        finally:
+            rmrf(tmppath)
+        self.send_response(201)
+        self.end_headers()
+
+def make_server(cachedir, host='localhost', port=8742, secret=None):
+    """A simple HTTP server for HttpBuildCache, storing tarballs in
+    @cachedir.  Uploads must come from localhost, or if @secret is
+    given, be signed with it."""
+    ensuredir(cachedir)
+    server = BaseHTTPServer.HTTPServer((host, port), _CacheRequestHandler)
+    server.cachedir = cachedir
+    server.secret = secret
+    return server
+
+def serve(cachedir, host='localhost', port=8742, secret=None):
+    server = make_server(cachedir, host, port, secret=secret)
+    log("Serving build cache {0} on http://{1}:{2}/".format(cachedir, host, port))
+    server.serve_forever()
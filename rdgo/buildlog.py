@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Streaming scanners for the logs mock leaves in a result directory.
+# Build logs can be hundreds of megabytes, so nothing here holds more
+# than one (bounded) line plus a fixed number of error lines in memory.
+
+import os
+import re
+
+# Lines longer than this are scanned in pieces
+MAX_LINE = 64 * 1024
+# How many error lines we keep in status.json
+MAX_ERRORS = 20
+
+_missing_br_res = [
+    # yum
+    re.compile(r'No Package found for (\S+)'),
+    # dnf
+    re.compile(r"No matching package to install: '([^']+)'"),
+    re.compile(r'nothing provides (\S+)'),
+]
+
+def iter_lines(path, maxlen=MAX_LINE):
+    """Yield (offset, at_line_start, line) for each line of @path; offsets
+    are in bytes.  Overlong lines are returned in @maxlen sized
+    pieces, with at_line_start False for the continuations.
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        bol = True
+        while True:
+            line = f.readline(maxlen)
+            if not line:
+                break
+            yield offset, bol, line
+            offset += len(line)
+            bol = line.endswith('\n')
+
+def scan_state_log(path):
+    """Returns a tuple (status, phase) from mock's state.log, where phase
+    is the last step that was started but did not finish."""
+    status = 'unknown'
+    started = []
+    for _, bol, line in iter_lines(path):
+        if not bol:
+            continue
+        if line.find('Start: build setup ') >= 0:
+            status = 'root-failed'
+        elif line.find('Start: rpmbuild ') >= 0:
+            status = 'build-failed'
+        elif line.find('Finish: rpmbuild ') >= 0:
+            status = 'expected-success'
+        i = line.find('Start: ')
+        if i >= 0:
+            started.append(line[i+len('Start: '):].strip().decode('utf-8', 'replace'))
+            continue
+        i = line.find('Finish: ')
+        if i >= 0:
+            name = line[i+len('Finish: '):].strip().decode('utf-8', 'replace')
+            if name in started:
+                started.remove(name)
+    phase = started[-1] if started else None
+    return (status, phase)
+
+def scan_errors(path, limit=MAX_ERRORS):
+    """Returns a tuple (errors, count) where errors is a list of the first
+    @limit "error: " lines of @path as {'offset', 'line'} dicts, and
+    count is the total number found."""
+    errors = []
+    count = 0
+    for offset, bol, line in iter_lines(path):
+        if not (bol and line.startswith('error: ')):
+            continue
+        count += 1
+        if len(errors) < limit:
+            errors.append({'offset': offset,
+                           'line': line.rstrip('\n').decode('utf-8', 'replace')})
+    return (errors, count)
+
+def scan_missing_buildrequires(path):
+    """Find BuildRequires the package manager could not satisfy in
+    mock's root.log."""
+    missing = []
+    for _, _, line in iter_lines(path):
+        for r in _missing_br_res:
+            for m in r.finditer(line):
+                name = m.group(1).decode('utf-8', 'replace')
+                if name not in missing:
+                    missing.append(name)
+    return missing
+
+def summarize_resultdir(resdir, success, duration=None):
+    """Compute the structured status of a mock result directory; this is
+    what we write to status.json."""
+    statelog = resdir + '/state.log'
+    if os.path.isfile(statelog):
+        (status, phase) = scan_state_log(statelog)
+    else:
+        (status, phase) = ('unknown', None)
+    summary = {}
+    if success:
+        assert status == 'expected-success'
+        status = 'success'
+        phase = None
+    elif status == 'unknown':
+        status = 'unknown-failed'
+    summary['status'] = status
+    summary['phase'] = phase
+    if duration is not None:
+        summary['duration'] = round(duration, 3)
+    buildlog = resdir + '/build.log'
+    if status == 'build-failed' and os.path.isfile(buildlog):
+        (errors, count) = scan_errors(buildlog)
+        summary['errors'] = errors
+        summary['error_count'] = count
+    rootlog = resdir + '/root.log'
+    if status == 'root-failed' and os.path.isfile(rootlog):
+        summary['missing_buildrequires'] = scan_missing_buildrequires(rootlog)
+    return summary
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# What was last built for each component, and from which inputs.
+#
+# Each update is written out (and committed) right away, but marked
+# pending until the new build generation has been committed, so lookups
+# see the state matching the current generation.  Only marking pending
+# rows as current and dropping removed components wait for commit().
+# Pending rows carry a token of the BuildStateDB that wrote them, so
+# commit() only publishes its own; those left behind by a run that
+# didn't get to commit or roll back are dropped when the database is
+# next opened.
+
+import json
+import time
+import random
+import hashlib
+import sqlite3
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS builds (
+    pkgname TEXT NOT NULL,
+    pending INTEGER NOT NULL, -- 0 for current rows, else the writer's token
+    fingerprint TEXT NOT NULL,
+    dirname TEXT NOT NULL,
+    srpm_digest TEXT NOT NULL,
+    files TEXT NOT NULL,
+    duration REAL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (pkgname, pending)
+)
+'''
+
+_COLUMNS = 'pkgname, fingerprint, dirname, srpm_digest, files, duration, updated'
+
+def build_fingerprint(srpm_digest, mockcfg_digest, addrepos=(), mock_options=()):
+    """Digest of the inputs which determine a build's output"""
+    h = hashlib.sha256()
+    h.update('rdgo-buildstate-v1\n')
+    h.update(json.dumps([srpm_digest, mockcfg_digest,
+                         sorted(addrepos), list(mock_options)]))
+    return h.hexdigest()
+
+class BuildStateDB(object):
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._retain = None
+        self._token = random.SystemRandom().randint(1, 2 ** 62)
+        with self._conn:
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(builds)')]
+            if len(columns) > 0 and 'pending' not in columns:
+                # From before updates were committed as they were made
+                self._conn.execute('ALTER TABLE builds RENAME TO builds_old')
+                self._conn.execute(_SCHEMA)
+                self._conn.execute('INSERT INTO builds (pending, {0}) SELECT 0, {0} FROM builds_old'.format(_COLUMNS))
+                self._conn.execute('DROP TABLE builds_old')
+            else:
+                self._conn.execute(_SCHEMA)
+            self._conn.execute('DELETE FROM builds WHERE pending != 0')
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM builds WHERE pending = 0').fetchone()[0]
+
+    def lookup(self, pkgname):
+        row = self._conn.execute('SELECT {0} FROM builds WHERE pkgname = ? AND pending = 0'.format(_COLUMNS),
+                                 (pkgname, )).fetchone()
+        if row is None:
+            return None
+        result = dict(zip(row.keys(), row))
+        result['files'] = json.loads(result['files'])
+        return result
+
+    def update(self, pkgname, fingerprint, dirname, srpm_digest, files, duration=None):
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO builds (pending, {0}) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(_COLUMNS),
+                               (self._token, pkgname, fingerprint, dirname, srpm_digest,
+                                json.dumps(sorted(files)), duration, time.time()))
+
+    def retain(self, pkgnames):
+        """Forget components not in @pkgnames on commit()"""
+        self._retain = set(pkgnames)
+
+    def commit(self):
+        with self._conn:
+            self._conn.execute('DELETE FROM builds WHERE pending = 0 AND pkgname IN '
+                               '(SELECT pkgname FROM builds WHERE pending = ?)', (self._token, ))
+            self._conn.execute('UPDATE builds SET pending = 0 WHERE pending = ?', (self._token, ))
+            if self._retain is not None:
+                for row in self._conn.execute('SELECT pkgname FROM builds WHERE pending = 0').fetchall():
+                    if row[0] not in self._retain:
+                        self._conn.execute('DELETE FROM builds WHERE pkgname = ? AND pending = 0',
+                                           (row[0], ))
+        self._retain = None
+
+    def rollback(self):
+        with self._conn:
+            self._conn.execute('DELETE FROM builds WHERE pending = ?', (self._token, ))
+        self._retain = None
+
+    def close(self):
+        self._conn.close()
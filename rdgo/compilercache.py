@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Persistent per-component ccache directories, bind mounted into the
+# mock root by mock's ccache plugin.  ccache itself keeps each
+# directory under its size limit; here we evict whole directories of
+# components that haven't been built recently when the total gets too
+# large.
+
+import os
+import re
+import time
+import shutil
+
+from .utils import component_name
+
+STAMP = '.rdgo-last-used'
+
+# Indexes into ccache's "stats" files; these have been stable from
+# ccache 3 through 4.
+_STATS_MISS = 4
+_STATS_HIT_PREPROCESSED = 8
+_STATS_HIT_DIRECT = 22
+
+_size_re = re.compile(r'^(\d+(?:\.\d+)?)([KMGT]?)$', re.I)
+
+def parse_size(size):
+    """Parse a size like "2G" into bytes"""
+    m = _size_re.match(str(size).strip())
+    if not m:
+        raise ValueError("Invalid size: {0}".format(size))
+    mult = 1024 ** ' KMGT'.index(m.group(2).upper() or ' ')
+    return int(float(m.group(1)) * mult)
+
+def component_cachedir(topdir, pdn):
+    path = os.path.join(topdir, component_name(pdn))
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(path + '/' + STAMP, 'w') as f:
+        f.write(str(time.time()) + '\n')
+    return path
+
+def read_stats(cachedir):
+    """Return a dict with the hit and miss counters summed across the
+    stats files in @cachedir."""
+    counters = {'hits': 0, 'misses': 0}
+    for (dirpath, dirnames, filenames) in os.walk(cachedir):
+        if 'stats' not in filenames:
+            continue
+        try:
+            with open(os.path.join(dirpath, 'stats')) as f:
+                values = [int(v) for v in f.read().split()]
+        except (IOError, ValueError):
+            continue
+        def get(i):
+            return values[i] if i < len(values) else 0
+        counters['hits'] += get(_STATS_HIT_DIRECT) + get(_STATS_HIT_PREPROCESSED)
+        counters['misses'] += get(_STATS_MISS)
+    return counters
+
+def stats_delta(before, after):
+    return dict((k, after[k] - before.get(k, 0)) for k in after)
+
+def _dir_size(path):
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def _last_used(path):
+    try:
+        return os.stat(path + '/' + STAMP).st_mtime
+    except OSError:
+        return 0
+
+def evict(topdir, max_total, keep=()):
+    """Remove the least recently used component cache directories until
+    the total size of @topdir is at most @max_total bytes.  Names in
+    @keep are never removed.  Returns the list of removed names."""
+    if not os.path.isdir(topdir):
+        return []
+    entries = []
+    total = 0
+    for name in os.listdir(topdir):
+        path = os.path.join(topdir, name)
+        if not os.path.isdir(path):
+            continue
+        size = _dir_size(path)
+        total += size
+        entries.append((_last_used(path), name, size))
+    entries.sort()
+    removed = []
+    for (_, name, size) in entries:
+        if total <= max_total:
+            break
+        if name in keep:
+            continue
+        shutil.rmtree(os.path.join(topdir, name))
+        total -= size
+        removed.append(name)
+    return removed
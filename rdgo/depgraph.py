@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Build dependencies between overlay components.  Capabilities are
+# compared by name only; version constraints are ignored.
+
+import os
+import json
+import subprocess
+
+def capability_name(dep):
+    """Strip the version constraint from e.g. "foo-devel >= 1.2" """
+    return dep.strip().split(' ', 1)[0]
+
+def _rpm_query(paths, qf):
+    if len(paths) == 0:
+        return []
+    out = subprocess.check_output(['rpm', '-qp', '--nosignature', '--qf', qf] + list(paths))
+    return [l for l in out.split('\n') if l != '']
+
+def srpm_buildrequires(srpm):
+    names = set()
+    for dep in _rpm_query([srpm], '[%{REQUIRENAME}\n]'):
+        if dep.startswith('rpmlib('):
+            continue
+        names.add(capability_name(dep))
+    return sorted(names)
+
+def srpm_dependencies(srpms):
+    """For SRPMs that were never built, so all we know of what they
+    provide is their name: returns a dict mapping the basename of each
+    of @srpms to the set of the others it BuildRequires."""
+    index = DepIndex()
+    basenames = {}
+    for srpm in srpms:
+        [name] = _rpm_query([srpm], '%{NAME}\n')
+        basenames[name] = os.path.basename(srpm)
+        # Most libraries come with a -devel subpackage
+        index.set(name, provides=[name, name + '-devel'],
+                  buildrequires=srpm_buildrequires(srpm))
+    deps = index.dependencies(basenames.keys())
+    return dict((basenames[name], set(basenames[d] for d in d_names))
+                for (name, d_names) in deps.items())
+
+def srpm_buildarchs(srpm):
+    """The BuildArch of the SRPM's main package, e.g. ['noarch'], or []
+    if it builds for the target architecture."""
+    return _rpm_query([srpm], '[%{BUILDARCHS}\n]')
+
+def rpms_provides(rpms):
+    names = set()
+    for dep in _rpm_query(rpms, '[%{PROVIDENAME}\n]'):
+        names.add(capability_name(dep))
+    return sorted(names)
+
+def resultdir_provides(resultdir):
+    """Everything provided by the binary RPMs in a build result directory"""
+    rpms = [resultdir + '/' + name for name in sorted(os.listdir(resultdir))
+            if name.endswith('.rpm') and not name.endswith('.src.rpm')]
+    return rpms_provides(rpms)
+
+class DepIndex(object):
+    """Maps each component (by pkgname) to the capabilities its built
+    RPMs provide and the capabilities its SRPM BuildRequires."""
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.entries, f, indent=4, sort_keys=True)
+
+    def set(self, pkgname, provides=None, buildrequires=None):
+        entry = self.entries.setdefault(pkgname, {'provides': [], 'buildrequires': []})
+        if provides is not None:
+            entry['provides'] = sorted(provides)
+        if buildrequires is not None:
+            entry['buildrequires'] = sorted(buildrequires)
+
+    def provides(self, pkgname):
+        entry = self.entries.get(pkgname)
+        # A component always provides its own name, even if we haven't
+        # seen it built yet.
+        result = set([pkgname])
+        if entry is not None:
+            result.update(entry['provides'])
+        return result
+
+    def buildrequires(self, pkgname):
+        entry = self.entries.get(pkgname)
+        if entry is None:
+            return set()
+        return set(entry['buildrequires'])
+
+    def providers(self, pkgnames):
+        """Returns a dict mapping each capability provided by @pkgnames
+        to the set of those providing it."""
+        providers = {}
+        for pkgname in pkgnames:
+            for cap in self.provides(pkgname):
+                providers.setdefault(cap, set()).add(pkgname)
+        return providers
+
+    def dependencies_of(self, pkgname, providers):
+        """Returns the set of components in @providers (as returned by
+        providers()) that @pkgname BuildRequires."""
+        d = set()
+        for cap in self.buildrequires(pkgname):
+            d.update(providers.get(cap, ()))
+        d.discard(pkgname)
+        return d
+
+    def dependencies(self, pkgnames):
+        """Returns a dict mapping each of @pkgnames to the set of the
+        others it BuildRequires."""
+        providers = self.providers(pkgnames)
+        return dict((pkgname, self.dependencies_of(pkgname, providers))
+                    for pkgname in pkgnames)
+
+def reverse_closure(deps, changed):
+    """Given @deps as returned by DepIndex.dependencies(), return the set
+    of components that (transitively) BuildRequire anything in
+    @changed, including @changed itself."""
+    rdeps = {}
+    for pkgname, d in deps.items():
+        for dep in d:
+            rdeps.setdefault(dep, set()).add(pkgname)
+    closure = set(changed)
+    queue = list(changed)
+    while queue:
+        pkgname = queue.pop()
+        for rdep in rdeps.get(pkgname, ()):
+            if rdep not in closure:
+                closure.add(rdep)
+                queue.append(rdep)
+    return closure
+
+def dependency_closure(deps, pkgname):
+    """Given @deps as returned by DepIndex.dependencies(), return the set
+    of components @pkgname (transitively) BuildRequires."""
+    closure = set()
+    queue = [pkgname]
+    while queue:
+        for dep in deps.get(queue.pop(), ()):
+            if dep not in closure and dep != pkgname:
+                closure.add(dep)
+                queue.append(dep)
+    return closure
+
+def build_levels(nodes, deps):
+    """Partition @nodes (in their given order) into levels, such that
+    everything a node depends on is in an earlier level.  Members of
+    dependency cycles end up together in a final level."""
+    nodes = list(nodes)
+    nodeset = set(nodes)
+    remaining = dict((n, set(deps.get(n, ())) & nodeset) for n in nodes)
+    levels = []
+    done = set()
+    while remaining:
+        level = [n for n in nodes if n in remaining and remaining[n] <= done]
+        if len(level) == 0:
+            levels.append([n for n in nodes if n in remaining])
+            break
+        levels.append(level)
+        for n in level:
+            del remaining[n]
+        done.update(level)
+    return levels
+
+def toposort(nodes, deps):
+    """Order @nodes so dependencies come first, otherwise preserving the
+    given order."""
+    result = []
+    for level in build_levels(nodes, deps):
+        result.extend(level)
+    return result
+
+def component_graph(components):
+    """Given resolved snapshot components, with the 'buildrequires' and
+    'packages' of their specs, return a dict mapping each pkgname to the
+    sorted list of the others it BuildRequires, and the build levels."""
+    pkgnames = [c['pkgname'] for c in components]
+    index = DepIndex()
+    for component in components:
+        index.set(component['pkgname'], provides=component.get('packages', []),
+                  buildrequires=component.get('buildrequires', []))
+    deps = index.dependencies(pkgnames)
+    graph = dict((k, sorted(v)) for (k, v) in deps.items())
+    return graph, build_levels(pkgnames, deps)
@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Dispatch per-SRPM builds to a pool of workers.
+#
+# The protocol is a sequence of messages over a byte stream (a TCP
+# connection, or a pipe to a local process).  Each message is one line
+# of JSON; if it has a "size" key, that many bytes of payload follow.
+#
+#   <- {"type": "hello", "nonce": HEX, "auth": BOOL}
+#   -> {"type": "build", "srpm": NAME, "srpm-url": URL, "repos": [URL...],
+#       "root": MOCKCFG, "root-cfg": CONTENTS-OR-NULL, "mock-options": [OPT...],
+#       "hmac": HEX}
+#   <- {"type": "result", "srpm": NAME, "success": BOOL, "size": N}
+#      followed by a tar archive of the mockchain result directory
+#
+# Workers fetch the SRPM and see the in-progress build repository over
+# HTTP, served by the coordinator.
+#
+# A build request makes the worker run mock with the given config,
+# which is Python code, so a worker that is reachable from other hosts
+# must be given a shared secret: it then only accepts requests carrying
+# an HMAC (see job_signature()) of the request, the nonce of the
+# connection and the number of the request on it, keyed with the secret.
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import hmac
+import shutil
+import hashlib
+import binascii
+import socket
+import tarfile
+import tempfile
+import threading
+import subprocess
+import urllib2
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+
+from .utils import log, fatal, rmrf, ensuredir
+from . import mockchain
+from . import depgraph
+
+def send_message(f, msg, payload=None):
+    """Write @msg to @f, followed by the contents of the file object
+    @payload if given."""
+    if payload is not None:
+        payload.seek(0, os.SEEK_END)
+        msg = dict(msg)
+        msg['size'] = payload.tell()
+        payload.seek(0)
+    f.write(json.dumps(msg, sort_keys=True) + '\n')
+    if payload is not None:
+        shutil.copyfileobj(payload, f)
+    f.flush()
+
+def recv_message(f, payload=None):
+    """Read a message from @f; if it carries a payload, it is written
+    to the file object @payload.  Returns None at end of stream."""
+    line = f.readline()
+    if not line:
+        return None
+    msg = json.loads(line)
+    remaining = msg.get('size', 0)
+    while remaining > 0:
+        buf = f.read(min(remaining, 65536))
+        if not buf:
+            raise IOError("Unexpected end of stream in payload")
+        if payload is not None:
+            payload.write(buf)
+        remaining -= len(buf)
+    return msg
+
+def job_signature(secret, nonce, seq, job):
+    """HMAC of build request @job, the @seq'th on the connection whose
+    hello carried @nonce"""
+    signed = dict((k, v) for (k, v) in job.items() if k != 'hmac')
+    data = json.dumps([nonce, seq, signed], sort_keys=True)
+    return hmac.new(secret, data, hashlib.sha256).hexdigest()
+
+def is_local_address(host):
+    return host in ('localhost', '127.0.0.1', '::1')
+
+def srpm_dirname(srpm):
+    """The name of the directory mockchain puts results for @srpm into"""
+    return os.path.basename(srpm).replace('.temp.src.rpm', '')
+
+def _tar_resultdir(resultdir, fileobj):
+    tf = tarfile.open(fileobj=fileobj, mode='w')
+    if os.path.isdir(resultdir):
+        for name in sorted(os.listdir(resultdir)):
+            path = resultdir + '/' + name
+            if os.path.isfile(path):
+                tf.add(path, arcname=name)
+    tf.close()
+
+def _untar_resultdir(fileobj, resultdir):
+    fileobj.seek(0)
+    tf = tarfile.open(fileobj=fileobj, mode='r')
+    ensuredir(resultdir)
+    for member in tf.getmembers():
+        if not member.isfile() or '/' in member.name or member.name.startswith('.'):
+            raise ValueError("Invalid member {0} in build result".format(member.name))
+        tf.extract(member, resultdir)
+
+# Worker side
+
+def _build_one(job, tmpdir, config_cache_dir):
+    srpm = tmpdir + '/' + job['srpm']
+    resp = urllib2.urlopen(job['srpm-url'])
+    with open(srpm, 'wb') as f:
+        shutil.copyfileobj(resp, f)
+    root = job['root']
+    if job.get('root-cfg') is not None:
+        root = tmpdir + '/' + os.path.basename(root)
+        with open(root, 'w') as f:
+            f.write(job['root-cfg'])
+    localrepo = tmpdir + '/repo'
+    mc_argv = ['mockchain', '-r', root, '-l', localrepo,
+               '--tmp_prefix', 'rdgo-worker',
+               '--config-cache-dir', config_cache_dir]
+    for repo in job.get('repos', []):
+        mc_argv.extend(['-a', repo])
+    mc_argv.extend('--mock-option=' + o for o in job.get('mock-options', []))
+    mc_argv.append(srpm)
+    try:
+        rc = mockchain.main(mc_argv)
+    except SystemExit as e:
+        rc = e.code
+    return rc == 0, localrepo + '/' + srpm_dirname(srpm)
+
+def serve_connection(rfile, wfile, secret=None):
+    """Process build requests from @rfile until end of stream; if
+    @secret is given, only those signed with it."""
+    # Shared by the builds of this connection, which mostly use the
+    # same config; mkdtemp() makes it private to us.
+    config_cache_dir = tempfile.mkdtemp('', 'rdgo-worker-configs')
+    try:
+        _serve_jobs(rfile, wfile, config_cache_dir, secret)
+    finally:
+        rmrf(config_cache_dir)
+
+def _serve_jobs(rfile, wfile, config_cache_dir, secret):
+    nonce = binascii.hexlify(os.urandom(16))
+    send_message(wfile, {'type': 'hello', 'nonce': nonce, 'auth': secret is not None})
+    seq = 0
+    while True:
+        job = recv_message(rfile)
+        if job is None or job['type'] == 'quit':
+            break
+        assert job['type'] == 'build'
+        if secret is not None:
+            expected = job_signature(secret, nonce, seq, job)
+            if not hmac.compare_digest(expected, str(job.get('hmac', ''))):
+                print("Rejecting build request with a missing or bad signature", file=sys.stderr)
+                break
+        seq += 1
+        tmpdir = tempfile.mkdtemp('', 'rdgo-worker')
+        try:
+            try:
+                (success, resultdir) = _build_one(job, tmpdir, config_cache_dir)
+            except Exception as e:
+                print("Failed to build {0}: {1}".format(job['srpm'], e), file=sys.stderr)
+                (success, resultdir) = (False, None)
+            with tempfile.TemporaryFile() as tmpf:
+                if resultdir is not None:
+                    _tar_resultdir(resultdir, tmpf)
+                else:
+                    _tar_resultdir(tmpdir + '/nonexistent', tmpf)
+                send_message(wfile, {'type': 'result',
+                                     'srpm': job['srpm'],
+                                     'success': success}, payload=tmpf)
+        finally:
+            rmrf(tmpdir)
+
+def serve_stdio():
+    """Serve one coordinator over stdin/stdout.  Anything else written
+    to stdout (mockchain is chatty) is redirected to stderr."""
+    wfile = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    serve_connection(sys.stdin, wfile)
+
+class _WorkerHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        log("Accepted coordinator connection from {0}".format(self.client_address))
+        serve_connection(self.rfile, self.wfile, secret=self.server.secret)
+
+def serve_tcp(host, port, secret=None):
+    """Serve coordinators over TCP, one at a time; each connection
+    gets its own sequence of builds.  Without a @secret, only local
+    connections are possible."""
+    if secret is None and not is_local_address(host):
+        fatal("Listening on {0} requires a secret".format(host))
+    SocketServer.TCPServer.allow_reuse_address = True
+    server = SocketServer.TCPServer((host, port), _WorkerHandler)
+    server.secret = secret
+    log("Build worker listening on {0}:{1}".format(host, port))
+    server.serve_forever()
+
+# Coordinator side
+
+class BuildScheduler(object):
+    """Hands out SRPMs once everything they depend on has been attempted.
+    @deps maps an SRPM to the set of SRPMs it depends on; if None, each
+    SRPM depends on all the ones before it, which gives the same order
+    as a local mockchain.  Like mockchain --recurse, when a pass ends
+    with some failures and some successes, the failures are retried,
+    along with the SRPMs skipped because of them.
+
+    With @streaming, more SRPMs may be given to add() until close() is
+    called; a dependency that is neither added nor marked as available
+    with provide() yet is waited for.
+    """
+    def __init__(self, pkgs, deps=None, streaming=False):
+        # Only real dependencies are grounds for skipping a build
+        self._fail_fast = deps is not None or streaming
+        if deps is None:
+            deps = {}
+            if not streaming:
+                for i, pkg in enumerate(pkgs):
+                    deps[pkg] = set(pkgs[0:i])
+        self._deps = deps
+        self._closed = not streaming
+        self._aborted = False
+        self._provided = set()
+        self.skipped = {}
+        self._cond = threading.Condition()
+        self._start_pass(list(pkgs))
+        self.succeeded = []
+        self.failed = []
+
+    def add(self, pkg, deps):
+        with self._cond:
+            assert not self._closed
+            self._deps[pkg] = set(deps)
+            self._pass.add(pkg)
+            self._pending.append(pkg)
+            self._cond.notify_all()
+
+    def provide(self, pkg):
+        """Mark @pkg as available without building it"""
+        with self._cond:
+            self._provided.add(pkg)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _start_pass(self, pkgs):
+        self._pass = set(pkgs)
+        self._pending = pkgs
+        self._running = set()
+        self._attempted = set()
+        self._pass_failed = []
+        self._pass_succeeded = 0
+        self._unavailable = dict((pkg, root) for (pkg, (blockers, root)) in self.skipped.items())
+
+    def _ready(self, pkg):
+        for dep in self._deps.get(pkg, ()):
+            if dep in self._provided:
+                continue
+            if dep in self._pass:
+                if dep not in self._attempted:
+                    return False
+            elif not self._closed:
+                return False
+        return True
+
+    def next_job(self):
+        """Block until an SRPM is ready to build, and return it; returns
+        None when there is nothing left to do."""
+        with self._cond:
+            while True:
+                if self._aborted:
+                    return None
+                ready = [pkg for pkg in self._pending if self._ready(pkg)]
+                if (len(ready) == 0 and len(self._pending) > 0 and
+                    len(self._running) == 0 and self._closed):
+                    # A dependency cycle; build in the given order and
+                    # let the retry pass sort it out.
+                    ready = self._pending[0:1]
+                for pkg in ready:
+                    blockers, root = mockchain.find_blockers(self._deps, pkg, self._unavailable)
+                    if self._fail_fast and blockers:
+                        log("Skipping {0}: depends on failed build {1}".format(pkg, root))
+                        self._pending.remove(pkg)
+                        self._attempted.add(pkg)
+                        self._unavailable[pkg] = root
+                        self.skipped[pkg] = (blockers, root)
+                        self._cond.notify_all()
+                        continue
+                    self._pending.remove(pkg)
+                    self._running.add(pkg)
+                    return pkg
+                if len(ready) > 0:
+                    # Everything ready was skipped, which may have made
+                    # more ready
+                    continue
+                if len(self._pending) == 0 and len(self._running) == 0 and self._closed:
+                    if self._pass_failed and self._pass_succeeded > 0:
+                        retried = set(self._pass_failed)
+                        requeued = sorted(pkg for (pkg, (blockers, root)) in self.skipped.items()
+                                          if root in retried)
+                        for pkg in requeued:
+                            del self.skipped[pkg]
+                        log("Retrying {0} failed builds and {1} skipped dependents".format(len(retried),
+                                                                                         len(requeued)))
+                        self._start_pass(self._pass_failed + requeued)
+                        continue
+                    self.failed = self._pass_failed + sorted(self.skipped)
+                    return None
+                self._cond.wait()
+
+    def complete(self, pkg, success):
+        with self._cond:
+            self._running.remove(pkg)
+            self._attempted.add(pkg)
+            if success:
+                self.succeeded.append(pkg)
+                self._pass_succeeded += 1
+            else:
+                self._pass_failed.append(pkg)
+                self._unavailable[pkg] = None
+            self._cond.notify_all()
+
+    def abort(self):
+        """Called when no workers remain; everything unbuilt fails."""
+        with self._cond:
+            self._pass_failed.extend(self._pending)
+            self._pending = []
+            self.failed = self._pass_failed + sorted(self.skipped)
+            self._aborted = True
+            self._closed = True
+            self._cond.notify_all()
+
+class _QuietHTTPRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        for prefix, root in self.server.roots.items():
+            if path.startswith(prefix):
+                rel = os.path.normpath(urllib2.unquote(path[len(prefix):])).lstrip('/')
+                if rel.startswith('..'):
+                    break
+                return os.path.join(root, rel)
+        return '/nonexistent'
+
+    def log_message(self, *args):
+        pass
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class Worker(object):
+    """The coordinator's end of a connection to a worker, which signs
+    build requests with @secret if given."""
+    def __init__(self, name, rfile, wfile, secret=None):
+        self.name = name
+        self.rfile = rfile
+        self.wfile = wfile
+        self.secret = secret
+        hello = recv_message(rfile)
+        if hello is None or hello.get('type') != 'hello':
+            raise IOError("Unexpected greeting from worker {0}".format(name))
+        if hello.get('auth') and secret is None:
+            raise IOError("Worker {0} requires a secret".format(name))
+        self._nonce = hello['nonce']
+        self._seq = 0
+
+    def send_job(self, job):
+        if self.secret is not None:
+            job = dict(job)
+            job['hmac'] = job_signature(self.secret, self._nonce, self._seq, job)
+        self._seq += 1
+        send_message(self.wfile, job)
+
+    def close(self):
+        try:
+            send_message(self.wfile, {'type': 'quit'})
+        except (IOError, socket.error):
+            pass
+
+class LocalWorker(Worker):
+    def __init__(self, name):
+        env = dict(os.environ)
+        libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = libdir + ':' + env.get('PYTHONPATH', '')
+        self.proc = subprocess.Popen([sys.executable, '-m', 'rdgo.dispatch'],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     env=env)
+        super(LocalWorker, self).__init__(name, self.proc.stdout, self.proc.stdin)
+
+    def close(self):
+        super(LocalWorker, self).close()
+        self.proc.stdin.close()
+        self.proc.wait()
+
+class RemoteWorker(Worker):
+    def __init__(self, host, port, secret=None):
+        self.sock = socket.create_connection((host, port))
+        super(RemoteWorker, self).__init__('{0}:{1}'.format(host, port),
+                                           self.sock.makefile('rb'), self.sock.makefile('wb'),
+                                           secret=secret)
+
+    def close(self):
+        super(RemoteWorker, self).close()
+        self.sock.close()
+
+def open_workers(specs, secret=None):
+    """Parse worker specifications: "local" or "local:N" for local
+    processes, or HOST:PORT, whose requests are signed with @secret."""
+    workers = []
+    for spec in specs:
+        (host, _, port) = spec.rpartition(':')
+        if spec == 'local' or host == 'local':
+            n = int(port) if host == 'local' else 1
+            for i in range(n):
+                workers.append(LocalWorker('local-{0}'.format(len(workers))))
+        elif host != '':
+            try:
+                workers.append(RemoteWorker(host, int(port), secret=secret))
+            except (IOError, socket.error) as e:
+                fatal("Failed to connect to worker {0}: {1}".format(spec, e))
+        else:
+            fatal("Invalid worker specification: {0}".format(spec))
+    return workers
+
+def _parse_address(address):
+    (host, _, port) = address.rpartition(':')
+    return (host or 'localhost', int(port or 0))
+
+class Dispatcher(object):
+    """Serves SRPMs from @srpmdir and the repository @builddir over HTTP,
+    and runs the jobs handed out by a BuildScheduler on @workers.  Builds
+    also see the repositories @addrepos, and are passed @mock_options."""
+    def __init__(self, workers, root_mock, builddir, srpmdir,
+                 addrepos=(), mock_options=(),
+                 listen='localhost:0', public_url=None,
+                 createrepo_cachedir=None, createrepo_options=None):
+        self.workers = workers
+        self.root_mock = root_mock
+        self.addrepos = list(addrepos)
+        self.mock_options = list(mock_options)
+        self.root_cfg = None
+        if root_mock.endswith('.cfg'):
+            with open(root_mock) as f:
+                self.root_cfg = f.read()
+        self.builddir = builddir
+        self.createrepo_cachedir = createrepo_cachedir
+        self.createrepo_options = createrepo_options or []
+        self.server = _ThreadingHTTPServer(_parse_address(listen), _QuietHTTPRequestHandler)
+        self.server.roots = {'/repo/': builddir,
+                             '/srpms/': os.path.abspath(srpmdir)}
+        if public_url is None:
+            public_url = 'http://{0}:{1}/'.format(*self.server.server_address)
+        self.public_url = public_url.rstrip('/') + '/'
+        self._repo_lock = threading.Lock()
+
+    def createrepo(self):
+        with self._repo_lock:
+            out, err = mockchain.createrepo(self.builddir, cachedir=self.createrepo_cachedir,
+                                            options=self.createrepo_options)
+        if err.strip():
+            log("Error making local repo: {0}".format(err))
+
+    def run(self, scheduler, srpm_paths):
+        """Build until @scheduler has nothing left; @srpm_paths maps the
+        names it hands out to SRPM paths, and may be added to while
+        this runs.  Returns 0 if everything was built, 2 otherwise, like
+        mockchain."""
+        server_thread = threading.Thread(target=self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        self.createrepo()
+
+        live_workers = [len(self.workers)]
+        lock = threading.Lock()
+
+        def run_worker(worker):
+            try:
+                while True:
+                    pkg = scheduler.next_job()
+                    if pkg is None:
+                        break
+                    srpm = os.path.basename(srpm_paths[pkg])
+                    log("Dispatching {0} to {1}".format(srpm, worker.name))
+                    assert os.path.dirname(os.path.abspath(srpm_paths[pkg])) == self.server.roots['/srpms/']
+                    job = {'type': 'build',
+                           'srpm': srpm,
+                           'srpm-url': self.public_url + 'srpms/' + urllib2.quote(srpm),
+                           'repos': [self.public_url + 'repo/'] + self.addrepos,
+                           'root': self.root_mock,
+                           'root-cfg': self.root_cfg,
+                           'mock-options': self.mock_options}
+                    try:
+                        worker.send_job(job)
+                        with tempfile.TemporaryFile() as tmpf:
+                            result = recv_message(worker.rfile, payload=tmpf)
+                            if result is None:
+                                raise IOError("Worker closed the connection")
+                            resultdir = self.builddir + '/' + srpm_dirname(srpm)
+                            rmrf(resultdir)
+                            _untar_resultdir(tmpf, resultdir)
+                    except (IOError, ValueError, socket.error) as e:
+                        log("Lost worker {0}: {1}".format(worker.name, e))
+                        scheduler.complete(pkg, False)
+                        break
+                    success = result['success']
+                    if success:
+                        self.createrepo()
+                    log("{0} {1} on {2}".format('Built' if success else 'Failed to build',
+                                               srpm, worker.name))
+                    scheduler.complete(pkg, success)
+            finally:
+                with lock:
+                    live_workers[0] -= 1
+                    if live_workers[0] == 0:
+                        scheduler.abort()
+                worker.close()
+
+        threads = []
+        for worker in self.workers:
+            t = threading.Thread(target=run_worker, args=(worker, ))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.server.shutdown()
+
+        log("Pkgs built: {0}".format(len(scheduler.succeeded)))
+        if scheduler.failed:
+            log("The following pkgs could not be successfully built:")
+            for pkg in scheduler.failed:
+                srpm = os.path.basename(srpm_paths[pkg])
+                skipped = scheduler.skipped.get(pkg)
+                if skipped is not None:
+                    (blockers, root) = skipped
+                    mockchain.mark_skipped(self.builddir + '/' + srpm_dirname(srpm), blockers, root)
+                    log("{0} (skipped, blocked by {1})".format(srpm, root))
+                else:
+                    log(srpm)
+            return 2
+        return 0
+
+def dispatch_builds(srpms, workers, root_mock, builddir, deps=None,
+                    addrepos=(), mock_options=(),
+                    listen='localhost:0', public_url=None,
+                    createrepo_cachedir=None, createrepo_options=None):
+    """Build @srpms (paths) on @workers, merging results into the
+    repository @builddir.  @deps maps each SRPM basename to those it
+    depends on; if None, it is guessed from the SRPMs' BuildRequires.
+    Returns 0 if everything was built, 2 otherwise, like mockchain."""
+    srpm_paths = dict((os.path.basename(p), p) for p in srpms)
+    if deps is None:
+        deps = depgraph.srpm_dependencies(srpms)
+    dispatcher = Dispatcher(workers, root_mock, builddir, os.path.dirname(srpms[0]),
+                            addrepos=addrepos, mock_options=mock_options,
+                            listen=listen, public_url=public_url,
+                            createrepo_cachedir=createrepo_cachedir,
+                            createrepo_options=createrepo_options)
+    scheduler = BuildScheduler([os.path.basename(p) for p in srpms], deps=deps)
+    return dispatcher.run(scheduler, srpm_paths)
+
+if __name__ == '__main__':
+    serve_stdio()
@@ -24,6 +24,7 @@ import collections
 import shutil
 import subprocess
 import tempfile
+import threading
 import yaml
 
 from gi.repository import GLib, Gio
@@ -65,6 +66,28 @@ class GitMirror(object):
         self.tmpdir = mirrordir + '/_tmp'
         self.gitconfig = mirrordir + '/.gitconfig'
         ensuredir(self.tmpdir)
+        # (mirrordir, ref) -> result; only valid until the mirror is
+        # next fetched, which is assumed to happen through this object.
+        self._revparse_cache = {}
+        self._describe_cache = {}
+        # mirrordir -> lock held while it is cloned, fetched or its
+        # refs are looked up, so that mirrors can be shared between
+        # threads (see TaskDaemon).
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, mirrordir):
+        with self._locks_lock:
+            lock = self._locks.get(mirrordir)
+            if lock is None:
+                lock = self._locks[mirrordir] = threading.RLock()
+            return lock
+
+    def _invalidate(self, mirrordir):
+        for cache in [self._revparse_cache, self._describe_cache]:
+            for key in list(cache):
+                if key[0] == mirrordir:
+                    del cache[key]
 
     def _gitenv(self):
         return {'HOME': self.mirrordir}
@@ -148,6 +171,11 @@ class GitMirror(object):
     def mirror(self, url, branch_or_tag,
                fetch=False, fetch_continue=False):
         mirrordir = self._get_mirrordir(url)
+        with self._lock(mirrordir):
+            return self._mirror_locked(url, mirrordir, branch_or_tag,
+                                       fetch, fetch_continue)
+
+    def _mirror_locked(self, url, mirrordir, branch_or_tag, fetch, fetch_continue):
         tmp_mirror = os.path.dirname(mirrordir) + '/' + os.path.basename(mirrordir) + '.tmp'
         did_update = False
 
@@ -157,11 +185,16 @@ class GitMirror(object):
             self._run('clone', '--mirror', self._strip_file_url(url), tmp_mirror)
             self._run('config', 'gc.auto', '0', cwd=tmp_mirror)
             os.rename(tmp_mirror, mirrordir)
+            self._invalidate(mirrordir)
         elif fetch:
             sys.stdout.write(os.path.basename(mirrordir) + ': ')
             self._run('fetch', cwd=mirrordir)
+            self._invalidate(mirrordir)
         
-        rev = subprocess.check_output(['git', 'rev-parse', branch_or_tag], cwd=mirrordir).strip()
+        rev = self._revparse_cache.get((mirrordir, branch_or_tag))
+        if rev is None:
+            rev = subprocess.check_output(['git', 'rev-parse', branch_or_tag], cwd=mirrordir).strip()
+            self._revparse_cache[(mirrordir, branch_or_tag)] = rev
 
         # Cache making it more efficient to remirror the same commit
         # multiple times
@@ -197,10 +230,26 @@ class GitMirror(object):
         self._process_checkout_submodules(dest, url)
         return dest
 
+    def list_files(self, url, rev):
+        """Names of the files at the top of the tree of @rev"""
+        mirrordir = self._get_mirrordir(url)
+        out = subprocess.check_output(['git', 'ls-tree', '--name-only', rev],
+                                      cwd=mirrordir)
+        return [l for l in out.split('\n') if l != '']
+
+    def read_file(self, url, rev, path):
+        """Contents of @path in @rev, without a checkout"""
+        mirrordir = self._get_mirrordir(url)
+        return subprocess.check_output(['git', 'show', '{0}:{1}'.format(rev, path)],
+                                       cwd=mirrordir)
+
     def describe(self, url, branch_or_tag):
         mirrordir = self._get_mirrordir(url)
-        description = subprocess.check_output(['git', 'describe', '--long', '--abbrev=40', '--always', branch_or_tag],
-                                              cwd=mirrordir).strip()
+        description = self._describe_cache.get((mirrordir, branch_or_tag))
+        if description is None:
+            description = subprocess.check_output(['git', 'describe', '--long', '--abbrev=40', '--always', branch_or_tag],
+                                                  cwd=mirrordir).strip()
+            self._describe_cache[(mirrordir, branch_or_tag)] = description
         if len(description) == 40:
             return [None, description]
         else:
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# An archive of build logs across runs.  Each log is stored once per
+# distinct content under objects/, compressed with zstd in independent
+# frames of CHUNK_SIZE uncompressed bytes, so that a range of a log can
+# be read without decompressing all of it.  runs/<run>.json records the
+# status and logs of each component built in a run, and index.json
+# lists the last INDEX_RUNS runs that built each component.  Only the
+# last keep_runs runs are kept; adding a run deletes older ones, along
+# with the objects no kept run refers to.
+
+import os
+import json
+import errno
+import time
+import hashlib
+import subprocess
+import tempfile
+
+from .utils import component_name
+
+CHUNK_SIZE = 4 * 1024 * 1024
+INDEX_RUNS = 100
+KEEP_RUNS = 100
+
+def _zstd(args, data):
+    proc = subprocess.Popen(['zstd', '-q', '-c'] + args,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out, _ = proc.communicate(data)
+    if proc.returncode != 0:
+        raise IOError("zstd exited with code {0}".format(proc.returncode))
+    return out
+
+def _ensuredir(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+def _write_json(path, data):
+    (fd, tmppath) = tempfile.mkstemp('.tmp', 'json', os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    os.rename(tmppath, path)
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+class LogArchive(object):
+    def __init__(self, path, keep_runs=KEEP_RUNS):
+        self.path = path
+        self.keep_runs = keep_runs
+
+    def _objpath(self, digest):
+        return '{0}/objects/{1}/{2}'.format(self.path, digest[0:2], digest)
+
+    def _chunks(self, digest):
+        with open(self._objpath(digest) + '.chunks') as f:
+            return json.load(f)
+
+    def store(self, path):
+        """Add the file @path, returning its digest"""
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                buf = f.read(CHUNK_SIZE)
+                if not buf:
+                    break
+                h.update(buf)
+        digest = h.hexdigest()
+        objpath = self._objpath(digest)
+        if os.path.isfile(objpath + '.chunks'):
+            return digest
+        _ensuredir(os.path.dirname(objpath))
+        # [uncompressed offset, compressed offset, compressed length,
+        #  uncompressed length]
+        chunks = []
+        (fd, tmppath) = tempfile.mkstemp('.tmp', digest, os.path.dirname(objpath))
+        try:
+            with os.fdopen(fd, 'wb') as out, open(path, 'rb') as f:
+                offset = 0
+                coffset = 0
+                while True:
+                    buf = f.read(CHUNK_SIZE)
+                    if not buf:
+                        break
+                    cbuf = _zstd([], buf)
+                    out.write(cbuf)
+                    chunks.append([offset, coffset, len(cbuf), len(buf)])
+                    offset += len(buf)
+                    coffset += len(cbuf)
+            os.rename(tmppath, objpath + '.zst')
+        finally:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+        # Written last; its presence marks the object as complete
+        _write_json(objpath + '.chunks', {'size': offset, 'chunks': chunks})
+        return digest
+
+    def size(self, digest):
+        return self._chunks(digest)['size']
+
+    def read(self, digest, start=0, end=None):
+        """Return bytes [@start, @end) of a stored log, decompressing only
+        the chunks that overlap them."""
+        meta = self._chunks(digest)
+        if end is None or end > meta['size']:
+            end = meta['size']
+        chunks = meta['chunks']
+        result = []
+        with open(self._objpath(digest) + '.zst', 'rb') as f:
+            for (i, chunk) in enumerate(chunks):
+                (offset, coffset, clen) = chunk[0:3]
+                if len(chunk) > 3:
+                    length = chunk[3]
+                else:
+                    # Stored before the lengths were recorded
+                    length = (chunks[i + 1][0] if i + 1 < len(chunks) else meta['size']) - offset
+                if offset >= end:
+                    break
+                if offset + length <= start:
+                    continue
+                f.seek(coffset)
+                buf = _zstd(['-d'], f.read(clen))
+                result.append(buf[max(start - offset, 0):end - offset])
+        return ''.join(result)
+
+    def new_run_id(self):
+        runid = time.strftime('%Y%m%d.%H%M%S', time.gmtime())
+        serial = 0
+        candidate = runid
+        while os.path.exists('{0}/runs/{1}.json'.format(self.path, candidate)):
+            serial += 1
+            candidate = '{0}.{1}'.format(runid, serial)
+        return candidate
+
+    def add_run(self, runid, results):
+        """Record a run; @results maps result directory names to dicts
+        with 'status' (as in status.json) and 'logs' (name -> digest)."""
+        _ensuredir(self.path + '/runs')
+        _write_json('{0}/runs/{1}.json'.format(self.path, runid),
+                    {'run': runid, 'results': results})
+        index = self.load_index()
+        for dname in results:
+            entries = index.setdefault(component_name(dname), [])
+            entries.append([runid, dname])
+            del entries[:-INDEX_RUNS]
+        _write_json(self.path + '/index.json', index)
+        self.prune()
+
+    def run_ids(self):
+        """All archived runs, oldest first"""
+        try:
+            names = os.listdir(self.path + '/runs')
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        # Run ids are timestamps with an optional serial; compare them
+        # numerically so that e.g. .10 comes after .9
+        return sorted((name[:-len('.json')] for name in names if name.endswith('.json')),
+                      key=lambda runid: [int(p) if p.isdigit() else p for p in runid.split('.')])
+
+    def prune(self):
+        """Delete all but the last keep_runs runs, and the objects that
+        none of the remaining runs refer to."""
+        runids = self.run_ids()
+        if len(runids) <= self.keep_runs:
+            return
+        (dropped, kept) = (runids[:-self.keep_runs], runids[-self.keep_runs:])
+        # Stop referring to the runs before deleting anything
+        dropped_set = set(dropped)
+        index = self.load_index()
+        for component in list(index):
+            entries = [e for e in index[component] if e[0] not in dropped_set]
+            if entries:
+                index[component] = entries
+            else:
+                del index[component]
+        _write_json(self.path + '/index.json', index)
+        for runid in dropped:
+            _unlink('{0}/runs/{1}.json'.format(self.path, runid))
+        live = set()
+        for runid in kept:
+            for result in self.load_run(runid)['results'].values():
+                live.update(result['logs'].values())
+        objdir = self.path + '/objects'
+        if not os.path.isdir(objdir):
+            return
+        for prefix in os.listdir(objdir):
+            # Objects being written by store() end in .tmp, and have no
+            # .chunks yet
+            dead = set(name.split('.', 1)[0] for name in os.listdir(objdir + '/' + prefix)
+                       if name.endswith('.chunks')) - live
+            for digest in dead:
+                objpath = self._objpath(digest)
+                # The .chunks goes first, as it marks the object complete
+                _unlink(objpath + '.chunks')
+                _unlink(objpath + '.zst')
+
+    def load_index(self):
+        try:
+            with open(self.path + '/index.json') as f:
+                return json.load(f)
+        except IOError:
+            return {}
+
+    def load_run(self, runid):
+        with open('{0}/runs/{1}.json'.format(self.path, runid)) as f:
+            return json.load(f)
+
+    def find(self, component, runid=None):
+        """Returns (runid, dname, result) for the latest build of
+        @component, or the one in @runid; None if there is none."""
+        for (entry_runid, dname) in reversed(self.load_index().get(component, [])):
+            if runid is None or entry_runid == runid:
+                run = self.load_run(entry_runid)
+                return (entry_runid, dname, run['results'][dname])
+        return None
+
+    def failing_section(self, result, before=40, after=10, window=64 * 1024):
+        """Return the part of the logs most likely to explain a failure:
+        the lines around the first error of build.log, or else the end of
+        root.log."""
+        status = result['status']
+        logs = result['logs']
+        errors = status.get('errors')
+        if errors and 'build.log' in logs:
+            digest = logs['build.log']
+            offset = errors[0]['offset']
+            start = max(offset - window, 0)
+            lines = self.read(digest, start, offset + window).split('\n')
+            # Find the line holding the error; the first one may be partial
+            pos = start
+            for i, line in enumerate(lines):
+                if pos >= offset:
+                    break
+                pos += len(line) + 1
+            first = max(i - before, 1 if start > 0 else 0)
+            return '\n'.join(lines[first:i + after + 1]) + '\n'
+        for name in ['root.log', 'build.log']:
+            if name in logs:
+                digest = logs[name]
+                size = self.size(digest)
+                lines = self.read(digest, max(size - window, 0)).split('\n')
+                return '\n'.join(lines[-(before + after + 1):])
+        return ''
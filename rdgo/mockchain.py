@@ -27,6 +27,8 @@ try:
 except ImportError:
     from urlparse import urlsplit
 import sys
+import stat
+import errno
 import subprocess
 import json
 import os
@@ -35,9 +37,14 @@ import tempfile
 import shutil
 import time
 import re
+import hashlib
 
 import mockbuild.util
 
+from . import buildlog
+from . import compilercache
+from .utils import component_name
+
 # all of the variables below are substituted by the build system
 __VERSION__ = "unreleased_version"
 SYSCONFDIR = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])), "..", "etc")
@@ -48,11 +55,24 @@ MOCKCONFDIR = os.path.join(SYSCONFDIR, "mock")
 
 mockconfig_path = '/etc/mock'
 
-def createrepo(path):
+# Generated configs not used for this long are removed
+CONFIG_MAX_AGE = 7 * 24 * 60 * 60
+
+def mock_config_macros(root):
+    """The rpm macros that mock config @root defines in its build root,
+    without their leading %."""
+    config = mockbuild.util.load_config(mockconfig_path, root, None, __VERSION__, PKGPYTHONDIR)
+    return dict((name.lstrip('%'), value)
+                for (name, value) in config.get('macros', {}).items())
+
+def createrepo(path, cachedir=None, options=[]):
+    comm = ['/usr/bin/createrepo_c']
     if os.path.exists(path + '/repodata/repomd.xml'):
-        comm = ['/usr/bin/createrepo_c', '--update', path]
-    else:
-        comm = ['/usr/bin/createrepo_c', path]
+        comm.append('--update')
+    if cachedir is not None:
+        comm.extend(['--cachedir', cachedir])
+    comm.extend(options)
+    comm.append(path)
     cmd = subprocess.Popen(comm,
              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     out, err = cmd.communicate()
@@ -78,6 +98,21 @@ def parse_args(args):
             help="Add log files to this directory")
     parser.add_option('--tmp_prefix', default=None, dest='tmp_prefix',
             help="tmp dir prefix - will default to username-pid if not specified")
+    parser.add_option('--config-cache-dir', default=None,
+            help="directory for generated mock configs; reusing it across runs keeps config paths stable (default: a directory private to the user in $TMPDIR)")
+    parser.add_option('--ccache-dir', default=None,
+            help="enable ccache, with a persistent cache per package in this directory")
+    parser.add_option('--ccache-max-size', default='2G',
+            help="maximum size of each package's ccache")
+    parser.add_option('--ccache-max-total', default=None,
+            help="evict least recently used package caches beyond this total size")
+    parser.add_option('--createrepo-cachedir', default=None,
+            help="checksum cache directory for createrepo_c")
+    parser.add_option('--createrepo-option', default=[], action='append',
+            dest='createrepo_option',
+            help="option to pass directly to createrepo_c")
+    parser.add_option('--deps', default=None,
+            help="JSON file mapping SRPM names to the SRPMs they depend on; dependents of failed builds are skipped")
     parser.add_option('-m', '--mock-option', default=[], action='append',
             dest='mock_option',
             help="option to pass directly to mock")
@@ -99,44 +134,69 @@ def parse_args(args):
 
     return opts, args
 
-REPOS_ID = []
-def generate_repo_id(baseurl):
+def generate_repo_id(baseurl, existing):
     """ generate repository id for yum.conf out of baseurl """
     repoid = "/".join(baseurl.split('//')[1:]).replace('/', '_')
     repoid = re.sub(r'[^a-zA-Z0-9_]', '', repoid)
     suffix = ''
     i = 1
-    while repoid + suffix in REPOS_ID:
+    while repoid + suffix in existing:
         suffix = str(i)
         i += 1
-    repoid = repoid + suffix
-    REPOS_ID.append(repoid)
-    return repoid
-
-def add_local_repo(infile, destfile, baseurl, repoid=None):
-    """take a mock chroot config and add a repo to it's yum.conf
-       infile = mock chroot config file
-       destfile = where to save out the result
-       baseurl = baseurl of repo you wish to add"""
-    global config_opts
+    return repoid + suffix
 
+def private_dir(path):
+    """Create the directory @path, only accessible by the current user;
+    if it exists, it must have been created that way."""
     try:
-        # What's going on here is we're dynamically executing the config
-        # file as code, resetting any previous modifications to the `config_opts`
-        # variable.
-        with open(infile) as f:
-            code = compile(f.read(), infile, 'exec')
-        exec(code)
+        os.mkdir(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+        stat.S_IMODE(st.st_mode) & 0o077 != 0):
+        raise OSError(errno.EPERM, "Not a directory private to the current user", path)
+    return path
+
+def default_config_cache_dir():
+    return private_dir(os.path.join(tempfile.gettempdir(),
+                                    'mockchain-configs-{0}'.format(os.getuid())))
+
+def evict_configs(topdir, keep, max_age=CONFIG_MAX_AGE):
+    """Remove the configs written by MockConfigBuilder.write() into
+    @topdir which haven't been used for @max_age seconds, except for
+    @keep; returns their paths."""
+    evicted = []
+    cutoff = time.time() - max_age
+    for name in sorted(os.listdir(topdir)):
+        path = os.path.join(topdir, name)
+        if path == keep or not os.path.isdir(path) or os.path.islink(path):
+            continue
+        if os.stat(path).st_mtime < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            evicted.append(path)
+    return evicted
+
+class MockConfigBuilder(object):
+    """Takes a loaded mock config, applies our modifications (such as
+    extra repos) in memory, and writes the result out once.
+    """
+    # these files needed from the mock.config dir to make mock run
+    support_files = ['site-defaults.cfg', 'logging.ini']
 
+    def __init__(self, config_opts):
+        self.config_opts = dict(config_opts)
+        self.repo_ids = []
         # Add overrides to the default mock config here:
         # Ensure we're using the priorities plugin
-        config_opts['priorities.conf'] = '\n[main]\nenabled=1\n'
-        config_opts['yum.conf'] = config_opts['yum.conf'].replace('[main]\n', '[main]\nplugins=1\n')
+        self.config_opts['priorities.conf'] = '\n[main]\nenabled=1\n'
+        self.config_opts['yum.conf'] = self.config_opts['yum.conf'].replace('[main]\n', '[main]\nplugins=1\n')
 
+    def add_repo(self, baseurl, repoid=None):
         if not repoid:
-            repoid = generate_repo_id(baseurl)
-        else:
-            REPOS_ID.append(repoid)
+            repoid = generate_repo_id(baseurl, self.repo_ids)
+        self.repo_ids.append(repoid)
         localyumrepo = """
 [%s]
 name=%s
@@ -147,17 +207,50 @@ metadata_expire=30
 cost=1
 priority=1
 """ % (repoid, baseurl, baseurl)
-
-        config_opts['yum.conf'] += localyumrepo
-        br_dest = open(destfile, 'w')
-        for k, v in list(config_opts.items()):
-            br_dest.write("config_opts[%r] = %r\n" % (k, v))
-        br_dest.close()
-        return True, ''
-    except (IOError, OSError):
-        return False, "Could not write mock config to %s" % destfile
-
-    return True, ''
+        self.config_opts['yum.conf'] += localyumrepo
+
+    def serialize(self):
+        buf = []
+        for k, v in sorted(self.config_opts.items()):
+            buf.append("config_opts[%r] = %r\n" % (k, v))
+        return ''.join(buf)
+
+    def write(self, topdir):
+        """Write the config (with the support files from the system mock
+        config dir) to a directory under @topdir named after a digest of
+        the contents, so repeated runs with the same configuration use the
+        same path.  Using it updates its mtime, see evict_configs().
+        Returns the directory."""
+        contents = {self.config_opts['chroot_name'] + '.cfg': self.serialize()}
+        for fn in self.support_files:
+            with open(mockconfig_path + '/' + fn) as f:
+                contents[fn] = f.read()
+        h = hashlib.sha256()
+        for fn in sorted(contents):
+            h.update(fn + '\0' + contents[fn] + '\0')
+        config_path = os.path.join(topdir, '{0}-{1}'.format(self.config_opts['chroot_name'],
+                                                            h.hexdigest()[0:16]))
+        if os.path.isdir(config_path):
+            os.utime(config_path, None)
+            return config_path
+        if not os.path.isdir(topdir):
+            os.makedirs(topdir, mode=0o755)
+        tmpdir = tempfile.mkdtemp('.tmp', 'config', topdir)
+        try:
+            os.chmod(tmpdir, 0o755)
+            for fn, txt in contents.items():
+                with open(tmpdir + '/' + fn, 'w') as f:
+                    f.write(txt)
+            try:
+                os.rename(tmpdir, config_path)
+            except OSError:
+                # Another mockchain wrote it concurrently
+                if not os.path.isdir(config_path):
+                    raise
+        finally:
+            if os.path.isdir(tmpdir):
+                shutil.rmtree(tmpdir)
+        return config_path
 
 def get_mock_base_argv(opts, cfg):
    return ['/usr/bin/mock',
@@ -170,29 +263,39 @@ def do_clean_root(opts, cfg, pkg):
     mockcmd.extend(['--clean'])
     subprocess.check_call(mockcmd)
 
-def postprocess_mock_resultdir(resdir, success):
-    statelog = resdir + '/state.log'
-    status = 'unknown'
-    with open(statelog) as f:
-        for line in f:
-            if line.find('Start: build setup ') >= 0:
-                status = 'root-failed'
-            elif line.find('Start: rpmbuild ') >= 0:
-                status = 'build-failed'
-            elif line.find('Finish: rpmbuild ') >= 0:
-                status = 'expected-success'
-    if status == 'build-failed':
-        with open(resdir + '/build.log') as f:
-            for line in f:
-                if line.startswith('error: '):
-                    sys.stderr.write(line)
-    elif success:
-        assert status == 'expected-success'
-        status = 'success'
-    if not success and status == 'unknown':
-        status = 'unknown-failed'
+def postprocess_mock_resultdir(resdir, success, duration=None, extra=None):
+    status = buildlog.summarize_resultdir(resdir, success, duration=duration)
+    if extra is not None:
+        status.update(extra)
+    for error in status.get('errors', []):
+        sys.stderr.write(error['line'].encode('utf-8') + '\n')
+    if status.get('error_count', 0) > len(status.get('errors', [])):
+        sys.stderr.write('({0} more errors in {1}/build.log)\n'.format(status['error_count'] - len(status['errors']),
+                                                                      resdir))
+    for name in status.get('missing_buildrequires', []):
+        sys.stderr.write('Missing BuildRequires: {0}\n'.format(name))
+    with open(resdir + '/status.json', 'w') as f:
+        json.dump(status, f)
+
+def find_blockers(deps, pkg, unavailable):
+    """Returns the packages @pkg depends on that are in the dict
+    @unavailable (failed or skipped builds), along with the failed
+    build at the root of the chain."""
+    blockers = [dep for dep in deps.get(os.path.basename(pkg), []) if dep in unavailable]
+    if not blockers:
+        return blockers, None
+    root = blockers[0]
+    while unavailable.get(root) is not None:
+        root = unavailable[root]
+    return blockers, root
+
+def mark_skipped(resdir, blockers, root):
+    if not os.path.exists(resdir):
+        os.makedirs(resdir)
     with open(resdir + '/status.json', 'w') as f:
-        json.dump({'status': status}, f)
+        json.dump({'status': 'skipped-dependency-failed',
+                   'blocked-by': root,
+                   'blocked-by-direct': blockers}, f)
 
 def do_build(opts, cfg, pkg):
 
@@ -222,6 +325,12 @@ def do_build(opts, cfg, pkg):
                     '--yum',
                     '--resultdir', resdir,
                     '--no-cleanup-after'])
+    if opts.ccache_dir:
+        ccachedir = compilercache.component_cachedir(opts.ccache_dir, pdn)
+        ccache_before = compilercache.read_stats(ccachedir)
+        mockcmd.extend(['--enable-plugin=ccache',
+                        '--plugin-option=ccache:dir=' + ccachedir,
+                        '--plugin-option=ccache:max_cache_size=' + opts.ccache_max_size])
     # heuristic here, if user pass for mock "-d foo", but we must be care to leave
     # "-d'foo bar'" or "--define='foo bar'" as is
     compiled_re_1 = re.compile(r'^(-\S)\s+(.+)')
@@ -239,12 +348,16 @@ def do_build(opts, cfg, pkg):
 
     mockcmd.append(pkg)
     print('Executing: {0}'.format(subprocess.list2cmdline(mockcmd)))
+    starttime = time.time()
     cmd = subprocess.Popen(mockcmd,
            stdout=subprocess.PIPE,
            stderr=subprocess.PIPE)
     out, err = cmd.communicate()
     success = cmd.returncode == 0
-    postprocess_mock_resultdir(resdir, success)
+    extra = {}
+    if opts.ccache_dir:
+        extra['ccache'] = compilercache.stats_delta(ccache_before, compilercache.read_stats(ccachedir))
+    postprocess_mock_resultdir(resdir, success, duration=time.time() - starttime, extra=extra)
 
     ret = 1 if success else 0
     return ret, cmd, out, err
@@ -288,8 +401,6 @@ def main(args):
     else:
         opts.logfile = None
 
-    local_tmp_dir = tempfile.mkdtemp('mockchain')
-
     opts.local_repo_dir = opts.localrepo
 
     if not os.path.exists(opts.local_repo_dir):
@@ -297,62 +408,78 @@ def main(args):
 
     local_baseurl = "file://%s" % opts.local_repo_dir
     log(opts.logfile, "results dir: %s" % opts.local_repo_dir)
-    opts.config_path = os.path.normpath(local_tmp_dir + '/configs/' + config_opts['chroot_name'] + '/')
-
-    if not os.path.exists(opts.config_path):
-        os.makedirs(opts.config_path, mode=0o755)
-
-    log(opts.logfile, "config dir: %s" % opts.config_path)
-
-    my_mock_config = os.path.join(opts.config_path, "{0}.cfg".format(config_opts['chroot_name']))
 
     # modify with localrepo
-    res, msg = add_local_repo(config_opts['config_file'], my_mock_config, local_baseurl, 'local_build_repo')
-    if not res:
-        log(opts.logfile, "Error: Could not write out local config: %s" % msg)
-        sys.exit(1)
-
+    mockconfig = MockConfigBuilder(config_opts)
+    mockconfig.add_repo(local_baseurl, 'local_build_repo')
     for baseurl in opts.repos:
-        res, msg = add_local_repo(my_mock_config, my_mock_config, baseurl)
-        if not res:
-            log(opts.logfile, "Error: Could not add: %s to yum config in mock chroot: %s" % (baseurl, msg))
-            sys.exit(1)
-
+        mockconfig.add_repo(baseurl)
+    try:
+        if opts.config_cache_dir is None:
+            opts.config_cache_dir = default_config_cache_dir()
+        opts.config_path = mockconfig.write(opts.config_cache_dir)
+    except (IOError, OSError) as e:
+        log(opts.logfile, "Error: Could not write out local config: %s" % e)
+        sys.exit(1)
 
-    # these files needed from the mock.config dir to make mock run
-    for fn in ['site-defaults.cfg', 'logging.ini']:
-        pth = mockconfig_path + '/' + fn
-        shutil.copyfile(pth, opts.config_path + '/' + fn)
+    log(opts.logfile, "config dir: %s" % opts.config_path)
+    for path in evict_configs(opts.config_cache_dir, opts.config_path):
+        log(opts.logfile, "Removed unused config dir: %s" % path)
 
 
     # createrepo on it
-    out, err = createrepo(opts.local_repo_dir)
+    out, err = createrepo(opts.local_repo_dir, cachedir=opts.createrepo_cachedir,
+                          options=opts.createrepo_option)
     if err.strip():
         log(opts.logfile, "Error making local repo: %s" % opts.local_repo_dir)
         log(opts.logfile, "Err: %s" % err)
         sys.exit(1)
 
 
+    deps = {}
+    if opts.deps:
+        with open(opts.deps) as f:
+            deps = json.load(f)
+
     downloaded_pkgs = {}
     built_pkgs = []
     try_again = True
     to_be_built = pkgs
     return_code = 0
     num_of_tries = 0
+    # Skipped packages, with the failed package blocking them; they
+    # are tried again along with that package
+    skipped = []
     while try_again:
         num_of_tries += 1
         failed = []
+        # Maps the names of packages that failed in this pass to None,
+        # and those skipped (in any pass) to the failed package blocking
+        # them
+        unavailable = dict((os.path.basename(pkg), root) for (pkg, root) in skipped)
+        nskipped = 0
         for pkg in to_be_built:
             if not pkg.endswith('.rpm'):
                 log(opts.logfile, "%s doesn't appear to be an rpm - skipping" % pkg)
                 failed.append(pkg)
                 continue
 
+            blockers, root = find_blockers(deps, pkg, unavailable)
+            if blockers:
+                log(opts.logfile, "Skipping %s: depends on failed build %s" % (os.path.basename(pkg), root))
+                resdir = os.path.join(opts.local_repo_dir, os.path.basename(pkg).replace('.temp.src.rpm', ''))
+                mark_skipped(resdir, blockers, root)
+                skipped.append((pkg, root))
+                nskipped += 1
+                unavailable[os.path.basename(pkg)] = root
+                continue
+
             log(opts.logfile, "Start build: %s" % pkg)
             ret, cmd, out, err = do_build(opts, config_opts['chroot_name'], pkg)
             log(opts.logfile, "End build: %s" % pkg)
             if ret == 0:
                 failed.append(pkg)
+                unavailable[os.path.basename(pkg)] = None
                 log(opts.logfile, "Error building %s." % os.path.basename(pkg))
                 if opts.recurse:
                     log(opts.logfile, "Will try to build again (if some other package will succeed).")
@@ -364,7 +491,8 @@ def main(args):
                 do_clean_root(opts, config_opts['chroot_name'], pkg)
                 built_pkgs.append(pkg)
                 # createrepo with the new pkgs
-                out, err = createrepo(opts.local_repo_dir)
+                out, err = createrepo(opts.local_repo_dir, cachedir=opts.createrepo_cachedir,
+                          options=opts.createrepo_option)
                 if err.strip():
                     log(opts.logfile, "Error making local repo: %s" % opts.local_repo_dir)
                     log(opts.logfile, "Err: %s" % err)
@@ -372,11 +500,16 @@ def main(args):
                 log(opts.logfile, "Skipping already built pkg %s" % os.path.basename(pkg))
 
         if failed and opts.recurse:
-            if len(failed) != len(to_be_built):
-                to_be_built = failed
+            if len(failed) + nskipped != len(to_be_built):
+                retried = set(os.path.basename(pkg) for pkg in failed)
+                requeued = set(pkg for (pkg, root) in skipped if root in retried)
+                skipped = [(pkg, root) for (pkg, root) in skipped if pkg not in requeued]
+                # In the original order, so dependents come after
+                to_be_built = [pkg for pkg in pkgs if pkg in requeued or pkg in failed]
                 try_again = True
                 log(opts.logfile, 'Some package succeeded, some failed.')
-                log(opts.logfile, 'Trying to rebuild %s failed pkgs, because --recurse is set.' % len(failed))
+                log(opts.logfile, 'Trying to rebuild %s failed pkgs and %s skipped dependents, because --recurse is set.'
+                    % (len(failed), len(requeued)))
             else:
                 log(opts.logfile, "Tried %s times - following pkgs could not be successfully built:" % num_of_tries)
                 for pkg in failed:
@@ -385,16 +518,25 @@ def main(args):
                         msg = downloaded_pkgs[pkg]
                     log(opts.logfile, msg)
                 try_again = False
-                return_code = 2
         else:
             try_again = False
-            if failed:
-                return_code = 2
+
+    for (pkg, root) in skipped:
+        log(opts.logfile, "Skipped %s, blocked by %s" % (pkg, root))
+    if failed or skipped:
+        return_code = 2
+
+    if opts.ccache_dir and opts.ccache_max_total:
+        keep = [component_name(os.path.basename(pkg).replace('.temp.src.rpm', ''))
+                for pkg in pkgs]
+        for name in compilercache.evict(opts.ccache_dir, compilercache.parse_size(opts.ccache_max_total),
+                                        keep=keep):
+            log(opts.logfile, "Evicted ccache for %s" % name)
 
     log(opts.logfile, "Results out to: %s" % opts.local_repo_dir)
     log(opts.logfile, "Pkgs built: %s" % len(built_pkgs))
     if built_pkgs:
-        if failed:
+        if failed or skipped:
             if len(built_pkgs):
                 log(opts.logfile, "Some packages successfully built in this order:")
         else:
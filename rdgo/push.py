@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Receiving push notifications from git forges.  Payloads in GitHub's
+# format (which GitLab and Gitea largely share) are supported, as
+# well as a generic {"url": URL} or {"urls": [URL, ...]}.  To test by
+# hand:
+#
+#   curl -d '{"url": "https://github.com/projectatomic/rpm-ostree"}' \
+#       http://localhost:8744/
+#
+# With a secret, requests must carry GitHub's (or Gitea's) HMAC of the
+# body keyed with it, or GitLab's X-Gitlab-Token.
+
+import re
+import hmac
+import json
+import hashlib
+import urlparse
+import threading
+import BaseHTTPServer
+
+_url_re = re.compile(r'^[\w.+-]+://(?:[^@/]+@)?([^/:]+)(?::\d*)?/(.*)$')
+_scp_re = re.compile(r'^(?:[^@/]+@)?([^:/]+):(.*)$')
+
+_repository_url_keys = ['clone_url', 'git_url', 'ssh_url', 'html_url', 'url',
+                        'git_http_url', 'git_ssh_url', 'homepage']
+
+def normalize_url(url):
+    """Reduce the various ways of spelling a git repository URL (scheme,
+    user, port, .git suffix) to HOST/PATH."""
+    url = url.strip()
+    m = _url_re.match(url) or _scp_re.match(url)
+    if m is None:
+        return url
+    path = m.group(2).strip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return m.group(1).lower() + '/' + path
+
+def payload_urls(body, content_type=None):
+    """Returns the repository URLs mentioned in a push notification"""
+    if content_type is not None and content_type.startswith('application/x-www-form-urlencoded'):
+        # GitHub's alternative delivery format; some clients also
+        # label plain JSON like this
+        form = urlparse.parse_qs(body)
+        if 'payload' in form:
+            body = form['payload'][0]
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    urls = []
+    repository = data.get('repository')
+    if isinstance(repository, dict):
+        for key in _repository_url_keys:
+            if isinstance(repository.get(key), basestring):
+                urls.append(repository[key])
+    elif isinstance(repository, basestring):
+        urls.append(repository)
+    if isinstance(data.get('url'), basestring):
+        urls.append(data['url'])
+    for url in data.get('urls', []):
+        if isinstance(url, basestring):
+            urls.append(url)
+    return urls
+
+def components_for_urls(components, urls):
+    """Returns the pkgnames of the (expanded) @components whose src or
+    distgit/src is one of @urls."""
+    wanted = set(normalize_url(url) for url in urls)
+    result = []
+    for component in components:
+        srcs = [component.get('src')]
+        distgit = component.get('distgit')
+        if distgit is not None:
+            srcs.append(distgit.get('src'))
+        if any(src is not None and normalize_url(src) in wanted for src in srcs):
+            result.append(component['pkgname'])
+    return result
+
+def verify_signature(secret, body, headers):
+    """Whether the request with @body and @headers (a dict-like of HTTP
+    headers) was sent by someone who knows @secret."""
+    signatures = [('X-Hub-Signature-256', 'sha256=', hashlib.sha256),
+                  ('X-Hub-Signature', 'sha1=', hashlib.sha1),
+                  ('X-Gitea-Signature', '', hashlib.sha256)]
+    for (header, prefix, digestmod) in signatures:
+        signature = headers.get(header)
+        if signature is not None:
+            expected = prefix + hmac.new(secret, body, digestmod).hexdigest()
+            return hmac.compare_digest(expected, signature.strip().lower())
+    token = headers.get('X-Gitlab-Token')
+    if token is not None:
+        return hmac.compare_digest(secret, token)
+    return False
+
+class _PushRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def _reply(self, code, data):
+        body = json.dumps(data) + '\n'
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        body = self.rfile.read(length)
+        secret = self.server.secret
+        if secret is not None and not verify_signature(secret, body, self.headers):
+            self._reply(403, {'error': "Missing or bad signature"})
+            return
+        try:
+            urls = payload_urls(body, self.headers.getheader('Content-Type'))
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+        # GitHub sends one of these when a webhook is created
+        if self.headers.getheader('X-GitHub-Event') == 'ping':
+            self._reply(200, {'components': []})
+            return
+        self._reply(202, {'components': self.server.callback(urls)})
+
+    def log_message(self, *args):
+        pass
+
+class PushListener(object):
+    """Serves HTTP on @host:@port in a background thread; for each push
+    notification, @callback is called with the list of repository URLs
+    and returns the list of affected components.  If @secret is given,
+    notifications must be signed with it (see verify_signature())."""
+    def __init__(self, host, port, callback, secret=None):
+        self.server = BaseHTTPServer.HTTPServer((host, port), _PushRequestHandler)
+        self.server.callback = callback
+        self.server.secret = secret
+        self.address = self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Checks of a component's spec which can be made without building
+# anything; see TaskResolve.check_components().
+
+import os
+import re
+
+_patch_tag_re = re.compile(r'^Patch(\d+):', re.M)
+_patch_apply_re = re.compile(r'^%patch(\d+)\b', re.M)
+
+def check_spec(spec):
+    """Problems with a dist-git @spec (a specfile.Spec) as it is before
+    we edit it, as a list of strings."""
+    problems = []
+    if (spec.get_tag('Source0', allow_empty=True) is None and
+        spec.get_tag('Source', allow_empty=True) is None):
+        problems.append("No Source0 or Source tag")
+    try:
+        spec.sanity_check()
+    except Exception:
+        problems.append("BuildArch comes before the Source and Patch tags, but patches are applied with git am")
+    defined = set(int(n) for n in _patch_tag_re.findall(spec.txt))
+    for n in _patch_apply_re.findall(spec.txt):
+        if int(n) not in defined:
+            problems.append("%patch{0} has no Patch{0} tag".format(n))
+    return problems
+
+def check_patch_files(metadata, files):
+    """Problems with the patches listed in @metadata (from
+    specindex.spec_metadata()) given the @files next to the spec."""
+    problems = []
+    files = set(files)
+    for (num, url) in metadata['patches']:
+        if os.path.basename(url) not in files:
+            problems.append("Patch{0} file {1} is not in the repository".format(num, os.path.basename(url)))
+    return problems
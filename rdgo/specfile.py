@@ -24,6 +24,9 @@ import StringIO
 import os
 import re
 import time
+import hashlib
+import threading
+import collections
 
 import rpm
 
@@ -60,6 +63,68 @@ def release_parts(release):
 def has_macros(s):
     return s.find('%{') != -1
 
+
+# rpm.spec() parses, cached by spec content and macro context.  Macros
+# are expanded in rpm's global state, as left by the last spec parsed,
+# so expansions are cached along with the parse; a spec is only parsed
+# again to expand something new after another spec has been parsed.
+_PARSE_CACHE_SIZE = 128
+_parse_cache = collections.OrderedDict()
+_parse_lock = threading.Lock()
+_last_parsed = [None]
+# Macros defined for the context of the last spec parsed
+_context_macros = [()]
+
+
+def _set_context_macros(macros):
+    """Call with _parse_lock held"""
+    if macros == _context_macros[0]:
+        return
+    for (name, _) in _context_macros[0]:
+        rpm.delMacro(name)
+    for (name, value) in macros:
+        rpm.addMacro(name, value)
+    _context_macros[0] = macros
+
+
+class _ParsedSpec(object):
+    def __init__(self, rpmspec):
+        self.rpmspec = rpmspec
+        self.expansions = {}
+
+
+_tag_line_re = re.compile(r'([^\s:]+):')
+_tag_value_re = re.compile(r'(\s+)(\S.*)$')
+_blank_re = re.compile(r'\s*\Z')
+_patch_line_re = re.compile(r'(?:Patch|.patch)\d+')
+_ws_re = re.compile(r'\s+')
+
+
+def _parse_setup_args(args, srcn):
+    """Split the arguments of a %setup line as set_setup_dirname()'s
+    argparse parser would; returns the -b value and the remaining
+    arguments, or None if the line needs the real parser."""
+    b = str(srcn)
+    remain = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-n':
+            pass
+        elif arg == '-b':
+            if i + 1 == len(args) or args[i + 1].startswith('-'):
+                return None
+            i += 1
+            b = args[i]
+        elif arg.startswith('-'):
+            if len(arg) != 2 or arg[1] in '-hnb' or not arg[1].isalnum():
+                return None
+            remain.append(arg)
+        else:
+            remain.append(arg)
+        i += 1
+    return b, remain
+
 class Spec(object):
     """
     Lazy .spec file parser and editor.
@@ -70,10 +135,60 @@ class Spec(object):
     RE_AFTER_PATCHES_BASE = (
         r'((?:^|\n)(?:#\n)*#\s*patches_base\s*=[^\n]*\n(?:#\n)*)\n*')
 
-    def __init__(self, fn=None, txt=None):
+    def __init__(self, fn=None, txt=None, macros=None):
         self._fn = fn
-        self._txt = txt
+        # Defined while parsing, e.g. those of the target build root
+        self._macros = tuple(sorted((macros or {}).items()))
+        self._text = txt
+        # The text split into lines, with None for deleted ones; built by
+        # _index() and edited in place by set_tag(), set_setup_dirname(),
+        # wipe_patches() and delete_changelog().  Assigning _txt drops it.
+        self._lines = None
         self._rpmspec = None
+        self._parse_key = None
+
+    def _get_txt(self):
+        if self._text is None and self._lines is not None:
+            self._text = '\n'.join(l for l in self._lines if l is not None)
+        return self._text
+
+    def _set_txt(self, txt):
+        self._text = txt
+        self._lines = None
+
+    _txt = property(_get_txt, _set_txt)
+
+    def _index(self):
+        """Split the text into lines once, noting the lines which may
+        hold tags, %setup, patches and %changelog.  Entries are only
+        candidates; they're checked again when used."""
+        if self._lines is not None:
+            return
+        self._lines = self.txt.split('\n')
+        self._tags = {}
+        self._setup_lines = []
+        self._patch_lines = []
+        self._changelog_lines = []
+        for i, line in enumerate(self._lines):
+            m = _tag_line_re.match(line)
+            if m:
+                self._tags.setdefault(m.group(1), []).append(i)
+            if line.startswith(('%setup', '%autosetup')):
+                self._setup_lines.append(i)
+            elif line.startswith('%changelog'):
+                self._changelog_lines.append(i)
+            if _patch_line_re.match(line):
+                self._patch_lines.append(i)
+
+    def _tag_lines(self, tag):
+        """Yield (index, rest of line after the colon) for each line
+        defining @tag, in order."""
+        prefix = tag + ':'
+        for i in self._tags.get(tag, []):
+            if i < len(self._lines):
+                line = self._lines[i]
+                if line is not None and line.startswith(prefix):
+                    yield i, line[len(prefix):]
 
     @property
     def fn(self):
@@ -87,34 +202,120 @@ class Spec(object):
             self._txt = codecs.open(self.fn, 'r', encoding='utf-8').read()
         return self._txt
 
+    def _parse(self, key):
+        _set_context_macros(key[3])
+        rpm.addMacro('_sourcedir', key[1])
+        try:
+            rpmspec = rpm.spec(self.fn)
+        except ValueError, e:
+            raise Exception("Error parsing spec: {0}".format(e))
+        _last_parsed[0] = key
+        return rpmspec
+
+    def _lookup_parsed(self):
+        """Returns the cache key and _ParsedSpec of the spec as saved,
+        parsing it if needed; call with _parse_lock held."""
+        if self._parse_key is None:
+            with open(self.fn, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            _set_context_macros(self._macros)
+            self._parse_key = (digest,
+                               os.path.dirname(os.path.realpath(self.fn)),
+                               rpm.expandMacro('%{?dist}'),
+                               self._macros)
+        key = self._parse_key
+        parsed = _parse_cache.pop(key, None)
+        if parsed is None:
+            parsed = _ParsedSpec(self._parse(key))
+        _parse_cache[key] = parsed
+        while len(_parse_cache) > _PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+        return key, parsed
+
     @property
     def rpmspec(self):
         if not self._rpmspec:
-            rpm.addMacro('_sourcedir',
-                         os.path.dirname(os.path.realpath(self.fn)))
-            try:
-                self._rpmspec = rpm.spec(self.fn)
-            except ValueError, e:
-                raise Exception("Error parsing spec: {0}".format(e))
+            with _parse_lock:
+                self._rpmspec = self._lookup_parsed()[1].rpmspec
         return self._rpmspec
 
+    def expand_macros(self, macros):
+        """Expand each of @macros in the context of this spec, returning
+        a list of the results."""
+        with _parse_lock:
+            key, parsed = self._lookup_parsed()
+            missing = [m for m in macros if m not in parsed.expansions]
+            if missing:
+                if _last_parsed[0] != key:
+                    parsed.rpmspec = self._parse(key)
+                for macro in missing:
+                    parsed.expansions[macro] = rpm.expandMacro(macro)
+            return [parsed.expansions[m] for m in macros]
+
     def expand_macro(self, macro):
-        rs = self.rpmspec
-        return rpm.expandMacro(macro)
+        return self.expand_macros([macro])[0]
+
+    def _find_tag(self, tag):
+        if re.match(r'\w+\Z', tag):
+            self._index()
+            for _, rest in self._tag_lines(tag):
+                m = _tag_value_re.match(rest)
+                if m:
+                    return m.group(2)
+                if _blank_re.match(rest):
+                    # \s+ would carry on to the following lines
+                    break
+            else:
+                return None
+        m = re.search('^%s:\s+(\S.*)$' % tag, self.txt, re.M)
+        return m.group(1) if m else None
 
     def get_tag(self, tag, expand_macros=False, allow_empty=False):
-        m = re.search('^%s:\s+(\S.*)$' % tag, self.txt, re.M)
-        if not m:
+        tag_value = self._find_tag(tag)
+        if tag_value is None:
             if allow_empty:
                 return None
             raise Exception("Error parsing spec: tag not found: {0}".format(tag))
-        tag = m.group(1).rstrip()
+        tag = tag_value.rstrip()
         if expand_macros and has_macros(tag):
             # don't parse using rpm unless required
             tag = self.expand_macro(tag)
         return tag
 
+    def get_tags(self, tags, expand_macros=False, allow_empty=False):
+        """Like get_tag() for each of @tags, expanding macros in one go;
+        returns a dict."""
+        values = {}
+        for tag in tags:
+            values[tag] = self.get_tag(tag, allow_empty=allow_empty)
+        if expand_macros:
+            macros = sorted(set(v for v in values.itervalues()
+                                if v is not None and has_macros(v)))
+            if macros:
+                expanded = dict(zip(macros, self.expand_macros(macros)))
+                for tag, v in values.iteritems():
+                    if v in expanded:
+                        values[tag] = expanded[v]
+        return values
+
     def set_tag(self, tag, value):
+        value = '%s' % value
+        if (re.match(r'[^\s:]+\Z', tag) and
+                '\\' not in value and '\n' not in value):
+            self._index()
+            edits = []
+            for i, rest in self._tag_lines(tag):
+                m = _tag_value_re.match(rest)
+                if m:
+                    edits.append((i, tag + ':' + m.group(1) + value))
+                elif _blank_re.match(rest):
+                    edits = []
+                    break
+            if edits:
+                for i, line in edits:
+                    self._lines[i] = line
+                self._text = None
+                return
         self._txt, n = re.subn(r'^(%s:\s+).*$' % re.escape(tag),
                                r'\g<1>%s' % value, self.txt, flags=re.M)
         if n == 0:
@@ -199,7 +400,24 @@ class Spec(object):
         return fns
 
     def wipe_patches(self):
-        self._txt = re.sub(r'\n+(?:(?:Patch|.patch)\d+[^\n]*)', '', self.txt)
+        self._index()
+        lines = self._lines
+        first = 0
+        while first < len(lines) and lines[first] is None:
+            first += 1
+        # Each patch line goes along with the empty lines before it, the
+        # same as removing r'\n+(?:(?:Patch|.patch)\d+[^\n]*)' would
+        for i in self._patch_lines:
+            if i <= first or i >= len(lines):
+                continue
+            if lines[i] is None or not _patch_line_re.match(lines[i]):
+                continue
+            lines[i] = None
+            j = i - 1
+            while j > first and (lines[j] is None or lines[j] == ''):
+                lines[j] = None
+                j -= 1
+            self._text = None
 
     def buildarch_sanity_check(self):
         bm = re.search('^BuildArch:', self.txt, flags=re.M)
@@ -229,6 +447,38 @@ class Spec(object):
         return 'rpm'
 
     def set_setup_dirname(self, srcname, srcn=0):
+        self._index()
+        lines = self._lines
+        last = len(lines) - 1
+        while last > 0 and lines[last] is None:
+            last -= 1
+        edits = []
+        for i in self._setup_lines:
+            if i >= len(lines) or lines[i] is None:
+                continue
+            line = lines[i]
+            if not line.startswith(('%setup', '%autosetup')):
+                continue
+            if i < last:
+                line += '\n'
+            parts = _ws_re.split(line)
+            parsed = _parse_setup_args(parts[1:], srcn)
+            if parsed is None:
+                return self._set_setup_dirname_argparse(srcname, srcn)
+            b, remain = parsed
+            if int(b) != srcn:
+                continue
+            edits.append((i, ' '.join([parts[0]] + remain + ['-n', srcname])))
+        if not edits:
+            raise Exception("Failed to find %setup or %autosetup")
+        for i, line in edits:
+            lines[i] = line
+        if edits[-1][0] == last:
+            # The last line gains a newline
+            lines.append('')
+        self._text = None
+
+    def _set_setup_dirname_argparse(self, srcname, srcn):
         newtxt = StringIO.StringIO()
         ws_re = re.compile(r'\s+')
         matched = False
@@ -314,19 +564,32 @@ class Spec(object):
         return self.set_release(release, milestone=milestone, postfix=postfix)
 
     def delete_changelog(self):
-        i = self._txt.find('\n%changelog')
-        if i < 0:
-            return
-        self._txt = self._txt[0:i+1]
+        self._index()
+        lines = self._lines
+        first = None
+        for i in self._changelog_lines:
+            if i >= len(lines) or lines[i] is None or not lines[i].startswith('%changelog'):
+                continue
+            if first is None:
+                first = 0
+                while lines[first] is None:
+                    first += 1
+            if i > first:
+                # Keep the newline before it
+                del lines[i:]
+                lines.append('')
+                self._text = None
+                return
 
     def new_changelog_entry(self, user, email, changes=[]):
         changes_str = "\n".join(map(lambda x: "- %s" % x, changes)) + "\n"
         date = time.strftime('%a %b %d %Y')
-        version = self.get_tag('Version', expand_macros=True)
+        tags = self.get_tags(['Version', 'Release'], expand_macros=True)
+        version = tags['Version']
         epoch = self.get_tag('Epoch', allow_empty=True)
         if epoch is not None:
             version = '%s:%s' % (epoch, version)
-        release = self.get_tag('Release', expand_macros=True)
+        release = tags['Release']
         # Assume release ends with %{?dist}
         release, _, _ = release.rpartition('.')
         # TODO: detect if there is '-' in changelog entries and use it if so
@@ -343,6 +606,7 @@ class Spec(object):
         f.write(self.txt)
         f.close()
         self._rpmspec = None
+        self._parse_key = None
 
     def get_source_urls(self):
         # arcane rpm constants, now in python!
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# What a spec file says (name, version, sources, BuildRequires...) only
+# depends on the git revision it comes from, so it is parsed once per
+# revision and kept next to the mirror, in
+# <mirror>/rdgo-specindex-v1/<revision>/<spec>.json, or
+# <spec>-<digest of macros>.json if it was parsed with extra macros
+# defined.  The spec is read with "git show"; no checkout is needed.
+
+import os
+import json
+import hashlib
+import tempfile
+
+from .utils import log, ensuredir, rmrf
+from .depgraph import capability_name
+from . import specfile
+
+INDEX_DIR = 'rdgo-specindex-v1'
+
+# rpm's RPMBUILD_ISSOURCE and RPMBUILD_ISPATCH
+_ISSOURCE = 1
+_ISPATCH = 2
+
+def spec_metadata(path, macros=None):
+    """Parse the spec file at @path with rpm, with @macros defined,
+    returning a dict"""
+    rpmspec = specfile.Spec(path, macros=macros).rpmspec
+    header = rpmspec.sourceHeader
+    sources = []
+    patches = []
+    for (url, num, flags) in rpmspec.sources:
+        if flags & _ISSOURCE:
+            sources.append([num, url])
+        elif flags & _ISPATCH:
+            patches.append([num, url])
+    buildrequires = set()
+    for dep in header['requirename'] or []:
+        if not dep.startswith('rpmlib('):
+            buildrequires.add(capability_name(dep))
+    return {'name': header['name'],
+            'epoch': header['epoch'],
+            'version': header['version'],
+            'release': header['release'],
+            'sources': sorted(sources),
+            'patches': sorted(patches),
+            'buildrequires': sorted(buildrequires),
+            'packages': [pkg.header['name'] for pkg in rpmspec.packages]}
+
+class SpecIndex(object):
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self._cache = {}
+
+    def _path(self, url, rev, specname, macros):
+        name = specname or 'default'
+        if macros:
+            h = hashlib.sha256(json.dumps(macros, sort_keys=True))
+            name += '-' + h.hexdigest()[0:16]
+        return '{0}/{1}/{2}/{3}.json'.format(self.mirror._get_mirrordir(url), INDEX_DIR,
+                                            rev, name)
+
+    def lookup(self, url, rev, specname=None, macros=None):
+        """Returns the metadata of @specname (by default, the only spec
+        file at the top of the tree) in revision @rev of the mirrored
+        repository @url, parsing it with @macros defined if this hasn't
+        been done before.  The dict has an 'error' key if it couldn't be
+        parsed."""
+        path = self._path(url, rev, specname, macros)
+        result = self._cache.get(path)
+        if result is not None:
+            return result
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except IOError:
+            result = self._parse(url, rev, specname, macros)
+            ensuredir(os.path.dirname(path), with_parents=True)
+            (fd, tmppath) = tempfile.mkstemp('.tmp', 'spec', os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f, indent=4, sort_keys=True)
+            os.rename(tmppath, path)
+        self._cache[path] = result
+        return result
+
+    def _parse(self, url, rev, specname, macros):
+        if specname is None:
+            specs = [n for n in self.mirror.list_files(url, rev) if n.endswith('.spec')]
+            if len(specs) != 1:
+                return {'error': "Expected one spec file, found {0}".format(len(specs))}
+            specname = specs[0]
+        log("Indexing {0} from {1} {2}".format(specname, url, rev))
+        tmpdir = tempfile.mkdtemp('', 'rdgo-specindex', self.mirror.tmpdir)
+        try:
+            path = tmpdir + '/' + specname
+            with open(path, 'w') as f:
+                f.write(self.mirror.read_file(url, rev, specname))
+            result = spec_metadata(path, macros)
+        except Exception as e:
+            # e.g. %include of a file next to the spec
+            return {'spec': specname, 'error': str(e)}
+        finally:
+            rmrf(tmpdir)
+        result['spec'] = specname
+        return result
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Writes a .src.rpm without running "rpmbuild -bs".  rpm already puts
+# everything the spec says about the source package in the header of
+# the parsed spec (see specfile.Spec.rpmspec), which is usually cached;
+# what rpmbuild adds is the file list, some build information and the
+# signature header, which is done here.  The package is laid out as
+# rpm does: a lead, the signature header, the header and a gzip
+# compressed cpio (newc) payload.
+#
+# compare_srpms() checks what the result says against an SRPM made by
+# rpmbuild, using rpm and rpm2cpio.
+
+import os
+import pwd
+import grp
+import zlib
+import time
+import socket
+import struct
+import hashlib
+import tempfile
+import subprocess
+
+import rpm
+
+# Header data types
+_CHAR = 1
+_INT8 = 2
+_INT16 = 3
+_INT32 = 4
+_INT64 = 5
+_STRING = 6
+_BIN = 7
+_STRING_ARRAY = 8
+_I18NSTRING = 9
+
+_SIZES = {_CHAR: 1, _INT8: 1, _INT16: 2, _INT32: 4, _INT64: 8, _BIN: 1}
+
+# Region tags, which mark the immutable part of a header
+_HEADERSIGNATURES = 62
+_HEADERIMMUTABLE = 63
+_REGION_TAGS = (61, _HEADERSIGNATURES, _HEADERIMMUTABLE)
+
+_HEADER_MAGIC = '\x8e\xad\xe8\x01\x00\x00\x00\x00'
+_LEAD_MAGIC = '\xed\xab\xee\xdb'
+
+# Signature tags
+_SIGTAG_SHA1 = 269
+_SIGTAG_SHA256 = 273
+_SIGTAG_SIZE = 1000
+_SIGTAG_MD5 = 1004
+_SIGTAG_PAYLOADSIZE = 1007
+
+# Header tags
+_TAG_NAME = 1000
+_TAG_VERSION = 1001
+_TAG_RELEASE = 1002
+_TAG_BUILDTIME = 1006
+_TAG_BUILDHOST = 1007
+_TAG_SIZE = 1009
+_TAG_FILESIZES = 1028
+_TAG_FILEMODES = 1030
+_TAG_FILERDEVS = 1033
+_TAG_FILEMTIMES = 1034
+_TAG_FILEDIGESTS = 1035
+_TAG_FILELINKTOS = 1036
+_TAG_FILEFLAGS = 1037
+_TAG_FILEUSERNAME = 1039
+_TAG_FILEGROUPNAME = 1040
+_TAG_FILEVERIFYFLAGS = 1045
+_TAG_REQUIREFLAGS = 1048
+_TAG_REQUIRENAME = 1049
+_TAG_REQUIREVERSION = 1050
+_TAG_RPMVERSION = 1064
+_TAG_COOKIE = 1094
+_TAG_FILEDEVICES = 1095
+_TAG_FILEINODES = 1096
+_TAG_FILELANGS = 1097
+_TAG_SOURCEPACKAGE = 1106
+_TAG_DIRINDEXES = 1116
+_TAG_BASENAMES = 1117
+_TAG_DIRNAMES = 1118
+_TAG_PAYLOADFORMAT = 1124
+_TAG_PAYLOADCOMPRESSOR = 1125
+_TAG_PAYLOADFLAGS = 1126
+_TAG_FILEDIGESTALGO = 5011
+
+# rpmbuild's values for these are replaced
+_WRITTEN_TAGS = set([_TAG_BUILDTIME, _TAG_BUILDHOST, _TAG_SIZE, _TAG_FILESIZES,
+                     _TAG_FILEMODES, _TAG_FILERDEVS, _TAG_FILEMTIMES, _TAG_FILEDIGESTS,
+                     _TAG_FILELINKTOS, _TAG_FILEFLAGS, _TAG_FILEUSERNAME,
+                     _TAG_FILEGROUPNAME, _TAG_FILEVERIFYFLAGS, _TAG_RPMVERSION,
+                     _TAG_COOKIE, _TAG_FILEDEVICES, _TAG_FILEINODES, _TAG_FILELANGS,
+                     _TAG_SOURCEPACKAGE, _TAG_DIRINDEXES, _TAG_BASENAMES, _TAG_DIRNAMES,
+                     _TAG_PAYLOADFORMAT, _TAG_PAYLOADCOMPRESSOR, _TAG_PAYLOADFLAGS,
+                     _TAG_FILEDIGESTALGO])
+
+# rpmspec.sources flags
+_ISNO = 4
+# RPMFILE_SPECFILE
+_FILE_SPECFILE = 1 << 5
+# RPMSENSE_LESS | RPMSENSE_EQUAL | RPMSENSE_RPMLIB
+_SENSE_RPMLIB_LE = (1 << 1) | (1 << 3) | (1 << 24)
+
+# pgp hash algorithm numbers, as in %_source_filedigest_algorithm
+_DIGEST_ALGOS = {1: 'md5', 2: 'sha1', 8: 'sha256', 9: 'sha384', 10: 'sha512'}
+
+class Header(object):
+    """An rpm header as tag -> (type, count, raw data)"""
+    def __init__(self):
+        self.entries = {}
+
+    @classmethod
+    def load(cls, blob):
+        """Parse a header as returned by rpm's hdr.unload()"""
+        if blob.startswith(_HEADER_MAGIC):
+            blob = blob[len(_HEADER_MAGIC):]
+        (il, dl) = struct.unpack('!II', blob[0:8])
+        data = blob[8 + il * 16:]
+        if len(data) != dl:
+            raise ValueError("Invalid header: {0} bytes of data, expected {1}".format(len(data), dl))
+        header = cls()
+        for i in range(il):
+            (tag, typ, offset, count) = struct.unpack('!IIiI', blob[8 + i * 16:8 + (i + 1) * 16])
+            if tag in _REGION_TAGS:
+                continue
+            if typ == _STRING:
+                end = data.index('\0', offset) + 1
+            elif typ in (_STRING_ARRAY, _I18NSTRING):
+                end = offset
+                for _ in range(count):
+                    end = data.index('\0', end) + 1
+            else:
+                end = offset + _SIZES[typ] * count
+            header.entries[tag] = (typ, count, data[offset:end])
+        return header
+
+    def set(self, tag, typ, value):
+        """Set @tag to @value: a string for STRING, otherwise a list, or
+        a string for BIN"""
+        if typ == _STRING:
+            self.entries[tag] = (typ, 1, value + '\0')
+        elif typ in (_STRING_ARRAY, _I18NSTRING):
+            self.entries[tag] = (typ, len(value), ''.join(v + '\0' for v in value))
+        elif typ == _BIN:
+            self.entries[tag] = (typ, len(value), value)
+        else:
+            fmt = {_INT16: 'H', _INT32: 'I', _INT64: 'Q'}[typ]
+            self.entries[tag] = (typ, len(value), struct.pack('!{0}{1}'.format(len(value), fmt), *value))
+
+    def get(self, tag):
+        """The value of @tag, as for set(), or None"""
+        entry = self.entries.get(tag)
+        if entry is None:
+            return None
+        (typ, count, data) = entry
+        if typ == _STRING:
+            return data[:-1]
+        elif typ in (_STRING_ARRAY, _I18NSTRING):
+            return data.split('\0')[:count]
+        elif typ == _BIN:
+            return data
+        fmt = {_CHAR: 'B', _INT8: 'B', _INT16: 'H', _INT32: 'I', _INT64: 'Q'}[typ]
+        return list(struct.unpack('!{0}{1}'.format(count, fmt), data))
+
+    def unload(self, region_tag):
+        """The header as written in a package, with an immutable region
+        marked by @region_tag around all of it"""
+        tags = sorted(self.entries)
+        il = len(tags) + 1
+        index = []
+        data = []
+        dl = 0
+        for tag in tags:
+            (typ, count, value) = self.entries[tag]
+            pad = -dl % _SIZES.get(typ, 1)
+            if pad:
+                data.append('\0' * pad)
+                dl += pad
+            index.append(struct.pack('!IIiI', tag, typ, dl, count))
+            data.append(value)
+            dl += len(value)
+        index.insert(0, struct.pack('!IIiI', region_tag, _BIN, dl, 16))
+        data.append(struct.pack('!IIiI', region_tag, _BIN, -il * 16, 16))
+        dl += 16
+        return _HEADER_MAGIC + struct.pack('!II', il, dl) + ''.join(index) + ''.join(data)
+
+def _cpio_header(ino, mode, nlink, mtime, size, name):
+    fields = [ino, mode, 0, 0, nlink, mtime, size, 0, 0, 0, 0, len(name) + 1, 0]
+    header = '070701' + ''.join('{0:08x}'.format(f) for f in fields) + name + '\0'
+    return header + '\0' * (-len(header) % 4)
+
+class _Payload(object):
+    """Writes a gzip compressed cpio archive to @f, keeping count of
+    the uncompressed size"""
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self._z = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, buf):
+        self.size += len(buf)
+        self.f.write(self._z.compress(buf))
+
+    def add(self, ino, st, name, path, algo):
+        """Add @path as @name; returns the @algo hex digest of its
+        contents"""
+        self.write(_cpio_header(ino, st.st_mode, 1, int(st.st_mtime), st.st_size, name))
+        h = hashlib.new(algo)
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                buf = f.read(65536)
+                if not buf:
+                    break
+                size += len(buf)
+                h.update(buf)
+                self.write(buf)
+        if size != st.st_size:
+            raise Exception("{0} changed while being read".format(path))
+        self.write('\0' * (-size % 4))
+        return h.hexdigest()
+
+    def finish(self):
+        self.write(_cpio_header(0, 0, 1, 0, 0, 'TRAILER!!!'))
+        self.f.write(self._z.flush())
+
+def _user_name(uid):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return 'root'
+
+def _group_name(gid):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return 'root'
+
+def _source_files(spec):
+    """(name, path) of the files to put in the SRPM of @spec, sorted
+    by name, as rpmbuild does"""
+    sourcedir = os.path.dirname(os.path.abspath(spec.fn))
+    files = {os.path.basename(spec.fn): os.path.abspath(spec.fn)}
+    for (url, num, flags) in spec.rpmspec.sources:
+        if flags & _ISNO:
+            raise Exception("NoSource and NoPatch are not supported")
+        name = os.path.basename(url)
+        files[name] = sourcedir + '/' + name
+    return sorted(files.items())
+
+def write_srpm(spec, destdir):
+    """Write the SRPM of @spec (a specfile.Spec saved next to its
+    sources) into @destdir, returning its path."""
+    header = Header.load(spec.rpmspec.sourceHeader.unload())
+    for tag in _WRITTEN_TAGS:
+        header.entries.pop(tag, None)
+    algo = spec.expand_macro('%{?_source_filedigest_algorithm}')
+    try:
+        algo = int(algo)
+    except ValueError:
+        algo = 1
+    if algo not in _DIGEST_ALGOS:
+        algo = 1
+    nvr = '{0}-{1}-{2}'.format(header.get(_TAG_NAME), header.get(_TAG_VERSION),
+                               header.get(_TAG_RELEASE))
+    path = destdir + '/' + nvr + '.src.rpm'
+
+    files = _source_files(spec)
+    spec_path = os.path.abspath(spec.fn)
+    stats = []
+    digests = []
+    (fd, payload_path) = tempfile.mkstemp('.tmp', 'payload', destdir)
+    try:
+        with os.fdopen(fd, 'w+b') as payload_file:
+            payload = _Payload(payload_file)
+            for (i, (name, fpath)) in enumerate(files):
+                st = os.stat(fpath)
+                if st.st_size >= 1 << 32:
+                    raise Exception("{0} is too large".format(name))
+                digests.append(payload.add(i + 1, st, name, fpath, _DIGEST_ALGOS[algo]))
+                stats.append(st)
+            payload.finish()
+            payload_size = payload.size
+
+            buildhost = socket.gethostname()
+            buildtime = int(time.time())
+            names = [name for (name, _) in files]
+            header.set(_TAG_BUILDTIME, _INT32, [buildtime])
+            header.set(_TAG_BUILDHOST, _STRING, buildhost)
+            header.set(_TAG_COOKIE, _STRING, '{0} {1}'.format(buildhost, buildtime))
+            header.set(_TAG_RPMVERSION, _STRING, rpm.__version__)
+            header.set(_TAG_SIZE, _INT32, [sum(s.st_size for s in stats)])
+            header.set(_TAG_SOURCEPACKAGE, _INT32, [1])
+            header.set(_TAG_FILESIZES, _INT32, [s.st_size for s in stats])
+            header.set(_TAG_FILEMODES, _INT16, [s.st_mode & 0xffff for s in stats])
+            header.set(_TAG_FILERDEVS, _INT16, [0] * len(files))
+            header.set(_TAG_FILEMTIMES, _INT32, [int(s.st_mtime) for s in stats])
+            header.set(_TAG_FILEDIGESTS, _STRING_ARRAY, digests)
+            header.set(_TAG_FILELINKTOS, _STRING_ARRAY, [''] * len(files))
+            header.set(_TAG_FILEFLAGS, _INT32, [_FILE_SPECFILE if fpath == spec_path else 0
+                                                for (_, fpath) in files])
+            header.set(_TAG_FILEUSERNAME, _STRING_ARRAY, [_user_name(s.st_uid) for s in stats])
+            header.set(_TAG_FILEGROUPNAME, _STRING_ARRAY, [_group_name(s.st_gid) for s in stats])
+            header.set(_TAG_FILEVERIFYFLAGS, _INT32, [0xffffffff] * len(files))
+            header.set(_TAG_FILEDEVICES, _INT32, [1] * len(files))
+            header.set(_TAG_FILEINODES, _INT32, range(1, len(files) + 1))
+            header.set(_TAG_FILELANGS, _STRING_ARRAY, [''] * len(files))
+            header.set(_TAG_DIRINDEXES, _INT32, [0] * len(files))
+            header.set(_TAG_BASENAMES, _STRING_ARRAY, names)
+            header.set(_TAG_DIRNAMES, _STRING_ARRAY, [''])
+            header.set(_TAG_PAYLOADFORMAT, _STRING, 'cpio')
+            header.set(_TAG_PAYLOADCOMPRESSOR, _STRING, 'gzip')
+            header.set(_TAG_PAYLOADFLAGS, _STRING, '9')
+
+            rpmlib = [('rpmlib(CompressedFileNames)', '3.0.4-1')]
+            if algo != 1:
+                header.set(_TAG_FILEDIGESTALGO, _INT32, [algo])
+                rpmlib.append(('rpmlib(FileDigests)', '4.6.0-1'))
+            requires = zip(header.get(_TAG_REQUIRENAME) or [],
+                           header.get(_TAG_REQUIREFLAGS) or [],
+                           header.get(_TAG_REQUIREVERSION) or [])
+            for (name, version) in rpmlib:
+                if name not in [r[0] for r in requires]:
+                    requires.append((name, _SENSE_RPMLIB_LE, version))
+            header.set(_TAG_REQUIRENAME, _STRING_ARRAY, [r[0] for r in requires])
+            header.set(_TAG_REQUIREFLAGS, _INT32, [r[1] for r in requires])
+            header.set(_TAG_REQUIREVERSION, _STRING_ARRAY, [r[2] for r in requires])
+
+            header_data = header.unload(_HEADERIMMUTABLE)
+            md5 = hashlib.md5(header_data)
+            payload_file.seek(0)
+            while True:
+                buf = payload_file.read(65536)
+                if not buf:
+                    break
+                md5.update(buf)
+            signature = Header()
+            signature.set(_SIGTAG_SHA1, _STRING, hashlib.sha1(header_data).hexdigest())
+            signature.set(_SIGTAG_SHA256, _STRING, hashlib.sha256(header_data).hexdigest())
+            signature.set(_SIGTAG_SIZE, _INT32, [len(header_data) + payload_file.tell()])
+            signature.set(_SIGTAG_MD5, _BIN, md5.digest())
+            signature.set(_SIGTAG_PAYLOADSIZE, _INT32, [payload_size])
+            signature_data = signature.unload(_HEADERSIGNATURES)
+            signature_data += '\0' * (-len(signature_data) % 8)
+
+            # type 1 is a source package, signature type 5 a header
+            lead = struct.pack('!4sBBHH66sHH16s', _LEAD_MAGIC, 3, 0, 1, 0,
+                               nvr[0:65], 1, 5, '')
+            (fd, tmppath) = tempfile.mkstemp('.tmp', 'srpm', destdir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(lead)
+                    f.write(signature_data)
+                    f.write(header_data)
+                    payload_file.seek(0)
+                    while True:
+                        buf = payload_file.read(65536)
+                        if not buf:
+                            break
+                        f.write(buf)
+                os.rename(tmppath, path)
+            except:
+                os.unlink(tmppath)
+                raise
+    finally:
+        os.unlink(payload_path)
+    return path
+
+# What compare_srpms() looks at; requirements on rpmlib features
+# depend on the version of rpm and are left out.
+_REQUIRES_QUERY = '[%{REQUIRENAME} %{REQUIREFLAGS} %{REQUIREVERSION}\n]'
+_COMPARE_QUERIES = ['%{NAME}', '%{EPOCH}', '%{VERSION}', '%{RELEASE}', '%{SUMMARY}',
+                    '%{DESCRIPTION}', '%{LICENSE}', '%{GROUP}', '%{URL}',
+                    _REQUIRES_QUERY,
+                    '[%{CONFLICTNAME} %{CONFLICTFLAGS} %{CONFLICTVERSION}\n]',
+                    '[%{SOURCE}\n]', '[%{PATCH}\n]', '[%{BUILDARCHS}\n]',
+                    '[%{EXCLUDEARCH}\n]', '[%{EXCLUSIVEARCH}\n]',
+                    '[%{FILENAMES} %{FILESIZES} %{FILEMODES:octal} %{FILEFLAGS}\n]']
+
+def _query(path):
+    sentinel = '@@rdgo-end@@\n'
+    out = subprocess.check_output(['rpm', '-qp', '--nosignature',
+                                   '--qf', sentinel.join(_COMPARE_QUERIES) + sentinel, path])
+    values = out.split(sentinel)[:-1]
+    i = _COMPARE_QUERIES.index(_REQUIRES_QUERY)
+    values[i] = ''.join(l + '\n' for l in values[i].split('\n')
+                        if l != '' and not l.startswith('rpmlib('))
+    return values
+
+def _read_exactly(f, size, path):
+    data = f.read(size)
+    if len(data) != size:
+        raise Exception("Truncated payload in {0}".format(path))
+    return data
+
+def _payload_digests(path):
+    """sha256 of each file in the payload of the package at @path"""
+    proc = subprocess.Popen(['rpm2cpio', path], stdout=subprocess.PIPE)
+    f = proc.stdout
+    digests = {}
+    offset = 0
+    try:
+        while True:
+            header = _read_exactly(f, 110, path)
+            if header[0:6] not in ('070701', '070702'):
+                raise Exception("Bad cpio header in the payload of {0}".format(path))
+            try:
+                fields = [int(header[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+            except ValueError:
+                raise Exception("Bad cpio header in the payload of {0}".format(path))
+            (size, namesize) = (fields[6], fields[11])
+            name = _read_exactly(f, namesize, path)[:-1]
+            if name == 'TRAILER!!!':
+                break
+            offset += 110 + namesize
+            _read_exactly(f, -offset % 4, path)
+            offset += -offset % 4
+            h = hashlib.sha256()
+            left = size
+            while left > 0:
+                buf = _read_exactly(f, min(left, 65536), path)
+                h.update(buf)
+                left -= len(buf)
+            offset += size
+            _read_exactly(f, -offset % 4, path)
+            offset += -offset % 4
+            if name.startswith('./'):
+                name = name[2:]
+            digests[name] = h.hexdigest()
+        f.read()
+    finally:
+        f.close()
+        rc = proc.wait()
+    if rc != 0:
+        raise Exception("rpm2cpio {0} failed".format(path))
+    return digests
+
+def compare_srpms(expected, actual):
+    """Differences between the SRPMs at @expected (e.g. from rpmbuild)
+    and @actual, as a list of strings"""
+    differences = []
+    for (query, a, b) in zip(_COMPARE_QUERIES, _query(expected), _query(actual)):
+        if a != b:
+            differences.append("{0}: {1!r} != {2!r}".format(query.strip('[]\n'), a, b))
+    a = _payload_digests(expected)
+    b = _payload_digests(actual)
+    for name in sorted(set(a) | set(b)):
+        if a.get(name) != b.get(name):
+            differences.append("Payload differs for {0}".format(name))
+    return differences
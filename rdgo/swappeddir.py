@@ -21,7 +21,7 @@ import sys
 import subprocess
 import os
 
-from .utils import ensuredir, ensure_clean_dir, rmrf
+from .utils import ensuredir, ensure_clean_dir, rmrf, clone_tree
 
 class SwappedDirectory(object):
     def __init__(self, path):
@@ -69,6 +69,15 @@ class SwappedDirectory(object):
         ensure_clean_dir(newpath)
         return newpath
 
+    def seed(self, names):
+        """Clone the given entries (e.g. 'repodata') of the current
+        generation into the one returned by prepare()."""
+        newpath = self._newpath()
+        for name in names:
+            src = self.path + '/' + name
+            if os.path.isdir(src) and not os.path.exists(newpath + '/' + name):
+                clone_tree(src, newpath + '/' + name)
+
     def abandon(self):
         newpath = self._newpath()
         rmrf(newpath)
@@ -30,4 +30,14 @@ class Task(object):
             with open(self.workdir + '/snapshot/snapshot.json') as f:
                 self._snapshot = json.load(f)
         return self._snapshot
+
+    def _resolve_mock_config(self, root_mock):
+        """Support including mock .cfg files next to overlay.yml"""
+        if root_mock.endswith('.cfg') and not os.path.isabs(root_mock):
+            target_root_mock = os.path.join(self.workdir, root_mock)
+            if os.path.isfile(target_root_mock):
+                return target_root_mock
+            contextdir = os.path.dirname(os.path.realpath(self.workdir + '/overlay.yml'))
+            return os.path.join(contextdir, root_mock)
+        return root_mock
         
@@ -20,21 +20,27 @@
 from __future__ import print_function
 
 import os
+import sys
 import argparse
+import threading
 import json
 import StringIO
 import subprocess
-import shutil
 import hashlib
 import yaml
 import tempfile
 import copy
 
 from .swappeddir import SwappedDirectory
-from .utils import log, fatal, ensuredir, rmrf, ensure_clean_dir, run_sync, hardlink_or_copy
+from .utils import log, fatal, read_secret_file, ensuredir, rmrf, run_sync, hardlink_or_copy, clone_trees
 from .task import Task
 from .git import GitMirror
-from .mockchain import main as mockchain_main
+from .mockchain import main as mockchain_main, mockconfig_path
+from . import dispatch
+from .depgraph import DepIndex, srpm_buildrequires, srpm_buildarchs, resultdir_provides, reverse_closure, dependency_closure, toposort
+from .buildcache import open_cache, cache_key, mock_config_digest, deps_digest, srpm_content_digests
+from .buildstate import BuildStateDB, build_fingerprint
+from . import logarchive
 
 def require_key(conf, key):
     try:
@@ -59,23 +65,262 @@ class TaskBuild(Task):
         h.update(serialized)
         return h.hexdigest()
 
-    def _move_logs_to_logdir(self, builddir, logdir):
+    def _mock_config_path(self, root_mock):
+        if root_mock.endswith('.cfg'):
+            return root_mock
+        return mockconfig_path + '/' + root_mock + '.cfg'
+
+    def _worker_secret(self, opts):
+        if opts.worker_secret_file is None:
+            return None
+        return read_secret_file(opts.worker_secret_file)
+
+    def _build_succeeded(self, resultdir):
+        statusjson = resultdir + '/status.json'
+        if not os.path.isfile(statusjson):
+            return False
+        with open(statusjson) as f:
+            return json.load(f)['status'] == 'success'
+
+    def _record_build(self, statedb, distgit_name, dirname, fingerprint, srpm_digest):
+        resultdir = self.newbuilddir + '/' + dirname
+        if not os.path.isdir(resultdir):
+            return
+        duration = None
+        statusjson = resultdir + '/status.json'
+        if os.path.isfile(statusjson):
+            with open(statusjson) as f:
+                status = json.load(f)
+            if status['status'] != 'success':
+                return
+            duration = status.get('duration')
+        files = [name for name in os.listdir(resultdir) if name.endswith('.rpm')]
+        statedb.update(distgit_name, fingerprint, dirname, srpm_digest, files,
+                       duration=duration)
+
+    def _prepare(self, root, root_mock, statedir):
+        """Set up a new build generation in @statedir for the mock config
+        @root_mock, and the repodata settings from @root."""
+        self.statedir = statedir
+        self.repodata_layout = root.get('repodata', 'single')
+        if self.repodata_layout not in ('single', 'per-component'):
+            fatal("Invalid root/repodata: {0}".format(self.repodata_layout))
+        self.deltarpms = root.get('deltarpms')
+        if self.deltarpms and self.repodata_layout == 'per-component':
+            fatal("root/deltarpms is not supported with per-component repodata")
+
+        self.builddir = SwappedDirectory(statedir + '/build')
+        self.newbuilddir = self.builddir.prepare()
+        # Lets createrepo_c --update reuse the metadata of unchanged
+        # packages rather than re-reading every header.
+        self.builddir.seed(['repodata'])
+
+        self.root_mock = self._resolve_mock_config(root_mock)
+
+        # Extra inputs to every build; these go into the fingerprints
+        self.addrepos = [str(r) for r in root.get('addrepos') or []]
+        self.mock_options = [str(o) for o in root.get('mock-options') or []]
+
+        self.createrepo_cachedir = self.workdir + '/createrepo-cache'
+        createrepo_cfg = root.get('createrepo') or {}
+        # These apply to every repodata we publish, merged or not
+        self.metadata_opts = []
+        if 'compress-type' in createrepo_cfg:
+            self.metadata_opts.extend(['--compress-type', str(createrepo_cfg['compress-type'])])
+        if createrepo_cfg.get('zchunk'):
+            self.metadata_opts.append('--zck')
+        self.createrepo_opts = list(self.metadata_opts)
+        if 'workers' in createrepo_cfg:
+            self.createrepo_opts.extend(['--workers', str(createrepo_cfg['workers'])])
+
+    def _mockchain_argv(self, root):
+        mc_argv = ['mockchain', '--recurse', '-r', self.root_mock,
+                   '-l', self.newbuilddir,
+                   '--config-cache-dir', self.workdir + '/mock-configs',
+                   '--createrepo-cachedir', self.createrepo_cachedir]
+        mc_argv.extend('--createrepo-option=' + o for o in self.createrepo_opts)
+        for baseurl in self.addrepos:
+            mc_argv.extend(['-a', baseurl])
+        mc_argv.extend('--mock-option=' + o for o in self.mock_options)
+
+        ccache = root.get('ccache')
+        if ccache:
+            if not isinstance(ccache, dict):
+                ccache = {}
+            mc_argv.extend(['--ccache-dir', self.statedir + '/ccache'])
+            if 'max-size' in ccache:
+                mc_argv.extend(['--ccache-max-size', str(ccache['max-size'])])
+            if 'max-total' in ccache:
+                mc_argv.extend(['--ccache-max-total', str(ccache['max-total'])])
+        return mc_argv
+
+    def _publish(self, statedb, newindex, dirnames, pkgnames):
+        """Finish the new generation: record what the components in
+        @dirnames (built in this run) provide, and generate the repodata."""
+        for distgit_name, dirname in dirnames.iteritems():
+            resultdir = self.newbuilddir + '/' + dirname
+            if os.path.isdir(resultdir):
+                newindex.set(distgit_name, provides=resultdir_provides(resultdir))
+        newindex.save(self.newbuilddir + '/depindex.json')
+        if self.repodata_layout == 'per-component':
+            self._merge_component_repos(set(dirnames.values()), self.createrepo_cachedir,
+                                        self.createrepo_opts, self.metadata_opts)
+        else:
+            delta_opts = []
+            if self.deltarpms:
+                delta_opts = self._deltarpm_opts(self.deltarpms)
+            run_sync(['createrepo_c', '--no-database', '--update',
+                      '--cachedir', self.createrepo_cachedir] + self.createrepo_opts + delta_opts + ['.'],
+                     cwd=self.newbuilddir)
+        statedb.retain(pkgnames)
+
+    def _touch(self, path):
+        # Python doesn't bind futimens() - http://stackoverflow.com/questions/1158076/implement-touch-using-python
+        with open(path, 'a'):
+            log("Updated timestamp of {}".format(path))
+            os.utime(path, None)
+
+    def _target_name(self, root_mock):
+        name = os.path.basename(root_mock)
+        if name.endswith('.cfg'):
+            name = name[:-len('.cfg')]
+        return name
+
+    def _run_target_builds(self, targets, argv, extra_args=None):
+        """Build for each of @targets in parallel subprocesses, prefixing
+        their output with the target name.  Returns the failed targets."""
+        env = dict(os.environ)
+        libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = libdir + ':' + env.get('PYTHONPATH', '')
+        procs = []
+        threads = []
+        for target in targets:
+            proc = subprocess.Popen([sys.executable, '-m', 'rdgo.task_build'] + argv +
+                                    ['--target', target] + (extra_args or []),
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    cwd=self.workdir, env=env)
+            prefix = '[{0}] '.format(self._target_name(target))
+            def relay(stream, prefix=prefix):
+                for line in iter(stream.readline, ''):
+                    log(prefix + line.rstrip('\n'))
+            thread = threading.Thread(target=relay, args=(proc.stdout, ))
+            thread.start()
+            procs.append((target, proc))
+            threads.append(thread)
+        failed = []
+        for (target, proc) in procs:
+            if proc.wait() != 0:
+                failed.append(target)
+        for thread in threads:
+            thread.join()
+        return failed
+
+    def _build_targets(self, targets, argv):
+        """Build the snapshot for each mock config in @targets, publishing
+        a repository per target in builds/<name>/build.  The first target
+        builds first; the others then build in parallel, reusing its
+        results for SRPMs that only produce noarch packages."""
+        primary = targets[0]
+        log("Building primary target {0}".format(primary))
+        if len(self._run_target_builds([primary], argv)) > 0:
+            fatal("Build failed for {0}".format(primary))
+        others = targets[1:]
+        if len(others) == 0:
+            return
+        log("Building targets: {0}".format(' '.join(others)))
+        primary_builddir = self.workdir + '/builds/' + self._target_name(primary) + '/build'
+        failed = self._run_target_builds(others, argv, ['--noarch-from', primary_builddir])
+        if len(failed) > 0:
+            fatal("Build failed for {0}".format(' '.join(failed)))
+
+    def _deltarpm_opts(self, deltarpms):
+        """createrepo_c options to generate delta RPMs (in parallel with
+        its other workers) against the packages of the previous
+        generation that were replaced in this one."""
+        if not isinstance(deltarpms, dict):
+            deltarpms = {}
+        olddirs = []
+        for name in sorted(os.listdir(self.builddir.path)):
+            path = self.builddir.path + '/' + name
+            if name in ('repodata', 'drpms') or not os.path.isdir(path):
+                continue
+            if not os.path.exists(self.newbuilddir + '/' + name):
+                olddirs.append(os.path.realpath(path))
+        if len(olddirs) == 0:
+            return []
+        opts = ['--deltas', '--num-deltas', str(deltarpms.get('num-deltas', 1))]
+        if 'max-delta-rpm-size' in deltarpms:
+            opts.extend(['--max-delta-rpm-size', str(deltarpms['max-delta-rpm-size'])])
+        for path in olddirs:
+            opts.extend(['--oldpackagedirs', path])
+        return opts
+
+    def _merge_component_repos(self, changed, cachedir, createrepo_opts, metadata_opts):
+        """Give each changed result directory its own repodata (made with
+        @createrepo_opts), with locations relative to the top, then merge
+        them all into the top-level repodata.  Unchanged directories keep
+        the repodata they were reused with."""
+        repos = []
+        for name in sorted(os.listdir(self.newbuilddir)):
+            path = self.newbuilddir + '/' + name
+            if name == 'repodata' or not os.path.isdir(path):
+                continue
+            if name in changed or not os.path.isfile(path + '/repodata/repomd.xml'):
+                run_sync(['createrepo_c', '--no-database', '--location-prefix', name + '/',
+                          '--cachedir', cachedir] + createrepo_opts + ['.'], cwd=path)
+            repos.append(path)
+        argv = ['mergerepo_c', '--no-database', '--omit-baseurl', '--all',
+                '-o', self.newbuilddir] + metadata_opts
+        for path in repos:
+            argv.extend(['--repo', path])
+        run_sync(argv)
+
+    def _archive_logs(self, builddir, logdir, keep_runs):
+        archive = logarchive.LogArchive(logdir, keep_runs=keep_runs)
+        runid = archive.new_run_id()
+        results = {}
+        failures = {}
+        nsuccess = 0
         for dname in os.listdir(builddir):
             dpath = os.path.join(builddir, dname)
             statusjson = dpath + '/status.json'
             if os.path.isfile(statusjson):
                 with open(statusjson) as f:
                     status = json.load(f)
-                success = (status['status'] == 'success')
-                if success:
-                    sublogdir = logdir + '/success/' + dname
+                if status['status'] == 'success':
+                    nsuccess += 1
                 else:
-                    sublogdir = logdir + '/failed/' + dname
-                ensure_clean_dir(sublogdir)
+                    failures[dname] = status
+                logs = {}
                 for subname in os.listdir(dpath):
                     subpath = dpath + '/' + subname
-                    if subname.endswith(('.json', '.log')):
-                        shutil.move(subpath, sublogdir + '/' + subname)
+                    if subname.endswith('.log'):
+                        logs[subname] = archive.store(subpath)
+                        os.unlink(subpath)
+                    elif subname.endswith('.json'):
+                        os.unlink(subpath)
+                results[dname] = {'status': status, 'logs': logs}
+        archive.add_run(runid, results)
+        log("Archived logs of {0} builds as run {1}".format(len(results), runid))
+        # A run-wide index, so one doesn't have to crawl runs/ to triage
+        with open(logdir + '/failures.json', 'w') as f:
+            json.dump({'success-count': nsuccess,
+                       'failed-count': len(failures),
+                       'failed': failures}, f, indent=4, sort_keys=True)
+        for dname in sorted(failures):
+            status = failures[dname]
+            msg = u"Failed: {0}: {1}".format(dname, status['status'])
+            if status.get('phase') is not None:
+                msg += u" (in {0})".format(status['phase'])
+            if status.get('blocked-by') is not None:
+                msg += u" (blocked by {0})".format(status['blocked-by'])
+            missing = status.get('missing_buildrequires')
+            if missing:
+                msg += u"\n  Missing BuildRequires: {0}".format(u' '.join(missing))
+            errors = status.get('errors')
+            if errors:
+                msg += u"\n  First error: {0}".format(errors[0]['line'])
+            log(msg.encode('utf-8'))
 
     def run(self, argv):
         parser = argparse.ArgumentParser(description="Build RPMs")
@@ -84,95 +329,262 @@ class TaskBuild(Task):
         parser.add_argument('--touch-if-changed', action='store', default=None,
                             help='Create or update timestamp on target path if a change occurred')
         parser.add_argument('--logdir', action='store', default=None,
-                            help='Store build logs in this directory')
+                            help='Archive build logs in this directory')
+        parser.add_argument('--logdir-keep-runs', action='store', type=int, default=logarchive.KEEP_RUNS,
+                            help='Keep the logs of this many runs in --logdir (default: %(default)s)')
+        parser.add_argument('--result-cache', action='store', default=None,
+                            help='Share build results via this cache (a directory or http:// URL)')
+        parser.add_argument('--result-cache-secret-file', action='store', default=None,
+                            help='Sign uploads to an HTTP --result-cache with the secret in this file')
+        parser.add_argument('--rebuild-rdeps', action='store_true',
+                            help='Also rebuild everything that (transitively) BuildRequires a changed component')
+        parser.add_argument('--worker', action='append', default=[],
+                            help='Dispatch builds to a worker: "local", "local:N" for N local processes, or HOST:PORT')
+        parser.add_argument('--worker-secret-file', action='store', default=None,
+                            help='Sign the builds sent to remote workers with the secret in this file')
+        parser.add_argument('--dispatch-listen', action='store', default='localhost:0',
+                            help='Address to serve SRPMs and the build repository to workers on')
+        parser.add_argument('--dispatch-url', action='store', default=None,
+                            help='URL at which workers can reach --dispatch-listen')
+        # Used when building for each of several targets; see _build_targets()
+        parser.add_argument('--target', action='store', default=None,
+                            help=argparse.SUPPRESS)
+        parser.add_argument('--noarch-from', action='store', default=None,
+                            help=argparse.SUPPRESS)
         opts = parser.parse_args(argv)
 
         snapshot = self.get_snapshot()
 
         root = require_key(snapshot, 'root')
         root_mock = require_key(root, 'mock')
+        if opts.worker and root.get('ccache'):
+            fatal("--worker does not support root/ccache")
+        if isinstance(root_mock, list):
+            if opts.target is None:
+                self._build_targets(root_mock, argv)
+                return
+            if opts.target not in root_mock:
+                fatal("Unknown target: {0}".format(opts.target))
+            root_mock = opts.target
+            # Everything specific to the target lives under builds/<name>/
+            statedir = self.workdir + '/builds/' + self._target_name(root_mock)
+            ensuredir(statedir, with_parents=True)
+            if opts.logdir is not None:
+                opts.logdir = opts.logdir + '/' + self._target_name(root_mock)
+        else:
+            statedir = self.workdir
 
         self.tmpdir = opts.tempdir
 
         self.mirror = GitMirror(self.workdir + '/src')
         self.snapshotdir = self.workdir + '/snapshot'
-        self.builddir = SwappedDirectory(self.workdir + '/build')
+        self._prepare(root, root_mock, statedir)
+        root_mock = self.root_mock
+        mc_argv = self._mockchain_argv(root)
+        srpms = []
 
-        self.newbuilddir = self.builddir.prepare()
+        # Only the inputs that affect the build output go into a
+        # component's fingerprint; see buildstate.py.
+        mockcfg_digest = mock_config_digest(self._mock_config_path(root_mock), mockconfig_path)
+        srpm_digests = srpm_content_digests([self.snapshotdir + '/' + c['srpm']
+                                             for c in snapshot['components']])
+        srpm_digests = dict((os.path.basename(k), v) for (k, v) in srpm_digests.iteritems())
+
+        statedb = BuildStateDB(self.statedir + '/buildstate.db')
+        try:
+            # Migrate the reuse state of older versions
+            legacystate_path = self.builddir.path + '/buildstate.json'
+            legacystate = {}
+            if len(statedb) == 0 and os.path.exists(legacystate_path):
+                with open(legacystate_path) as f:
+                    legacystate = json.load(f)
+
+            old_component_count = max(len(statedb), len(legacystate))
+            new_component_count = len(snapshot['components'])
+
+            resultcache = None
+            if opts.result_cache is not None:
+                secret = None
+                if opts.result_cache_secret_file is not None:
+                    secret = read_secret_file(opts.result_cache_secret_file)
+                resultcache = open_cache(opts.result_cache, secret=secret)
+            to_store = {}
+
+            oldindex = DepIndex.load(self.builddir.path + '/depindex.json')
+            newindex = DepIndex()
 
-        # Support including mock .cfg files next to overlay.yml
-        if root_mock.endswith('.cfg') and not os.path.isabs(root_mock):
-            target_root_mock = os.path.join(self.workdir, root_mock)
-            if os.path.isfile(target_root_mock):
-                root_mock = target_root_mock
+            components = {}
+            fingerprints = {}
+            reusable = {}
+            to_build = []
+            for component in snapshot['components']:
+                distgit_name = component['pkgname']
+                components[distgit_name] = component
+                fingerprint = build_fingerprint(srpm_digests[component['srpm']], mockcfg_digest,
+                                                self.addrepos, self.mock_options)
+                fingerprints[distgit_name] = fingerprint
+                cachedstate = statedb.lookup(distgit_name)
+                if cachedstate is not None:
+                    if cachedstate['fingerprint'] == fingerprint:
+                        reusable[distgit_name] = cachedstate['dirname']
+                else:
+                    cachedstate = legacystate.get(distgit_name)
+                    if cachedstate is not None and cachedstate['hashv0'] == self._json_hash(component):
+                        reusable[distgit_name] = cachedstate['dirname']
+                dirname = reusable.get(distgit_name)
+                if dirname is None or not os.path.isdir(self.builddir.path + '/' + dirname):
+                    reusable.pop(distgit_name, None)
+                    to_build.append(distgit_name)
+            # What changed components provide is only known from their
+            # previous build, but their BuildRequires are in the snapshot
+            # (or, from older versions, the new SRPMs).
+            for distgit_name in to_build:
+                buildrequires = components[distgit_name].get('buildrequires')
+                if buildrequires is None:
+                    srpm = self.snapshotdir + '/' + components[distgit_name]['srpm']
+                    buildrequires = srpm_buildrequires(srpm)
+                oldindex.set(distgit_name, buildrequires=buildrequires)
+                # Never built; go by the subpackages of its spec
+                packages = components[distgit_name].get('packages')
+                if len(oldindex.entries[distgit_name]['provides']) == 0 and packages:
+                    oldindex.set(distgit_name, provides=packages)
+            deps = oldindex.dependencies(components.keys())
+            if opts.rebuild_rdeps and len(to_build) > 0:
+                for distgit_name in sorted(reverse_closure(deps, to_build)):
+                    if distgit_name not in to_build:
+                        log("Rebuilding reverse dependency: {0}".format(distgit_name))
+                        to_build.append(distgit_name)
+            to_build = toposort([c['pkgname'] for c in snapshot['components'] if c['pkgname'] in to_build],
+                                deps)
+            srpm_deps = {}
+            for distgit_name in to_build:
+                srpm_deps[components[distgit_name]['srpm']] = sorted(components[n]['srpm'] for n in deps[distgit_name])
+            # What components that were never built, and whose subpackages
+            # we don't know, provide is unknown, so they might be in any
+            # buildroot
+            unknown = set(n for n in components if len(oldindex.entries.get(n, {}).get('provides', [])) == 0)
+            if all(n not in unknown for n in to_build):
+                build_deps = dict((k, set(v)) for (k, v) in srpm_deps.iteritems())
             else:
-                contextdir = os.path.dirname(os.path.realpath(self.workdir + '/overlay.yml'))
-                root_mock = os.path.join(contextdir, root_mock)
-
-        mc_argv = ['mockchain', '--recurse', '-r', root_mock,
-                   '-l', self.newbuilddir]
-
-        oldcache_path = self.builddir.path + '/buildstate.json'
-        oldcache = {}
-        if os.path.exists(oldcache_path):
-            with open(oldcache_path) as f:
-                oldcache = json.load(f)
-        newcache = {}
-        newcache_path = self.newbuilddir + '/buildstate.json'
-
-        old_component_count = len(oldcache)
-        new_component_count = len(snapshot['components'])
-
-        need_build = False
-        need_createrepo = old_component_count != new_component_count
-        for component in snapshot['components']:
-            component_hash = self._json_hash(component)
-            distgit_name = component['pkgname']
-            cachedstate = oldcache.get(distgit_name)
-            if cachedstate is not None:
-                if cachedstate['hashv0'] == component_hash:
-                    cached_dirname = cachedstate['dirname']
-                    log("Reusing cached build: {0}".format(cached_dirname))
-                    oldrpmdir = self.builddir.path + '/' + cached_dirname
-                    newrpmdir = self.newbuilddir + '/' + cached_dirname
-                    subprocess.check_call(['cp', '-al', oldrpmdir, newrpmdir])
-                    newcache[distgit_name] = cachedstate
+                # Something new from an older snapshot, without the list of
+                # its subpackages; let the dispatcher go by the SRPMs.
+                build_deps = None
+
+            need_build = False
+            need_createrepo = old_component_count != new_component_count
+            to_clone = []
+            for component in snapshot['components']:
+                distgit_name = component['pkgname']
+                if distgit_name in to_build:
                     continue
-            srpm = component['srpm']
-            assert srpm.endswith('.temp.src.rpm')
-            srpm_version = srpm[:-len('.temp.src.rpm')]
-            newcache[distgit_name] = {'hashv0': component_hash,
-                                      'dirname': srpm_version}
-            mc_argv.append(self.snapshotdir + '/' + srpm)
-            need_build = True
-            need_createrepo = True
-
-        if need_build:
-            log("Performing mockchain: {0}".format(subprocess.list2cmdline(mc_argv)))
-            rc = mockchain_main(mc_argv) 
-            if opts.logdir is not None:
-                ensure_clean_dir(opts.logdir)
-                self._move_logs_to_logdir(self.newbuilddir, opts.logdir)
-            if rc != 0:
-                fatal("mockchain exited with code {0}".format(rc))
-        elif need_createrepo:
-            log("No build neeeded, but component set changed")
-
-        if need_createrepo:
-            run_sync(['createrepo_c', '--no-database', '--update', '.'], cwd=self.newbuilddir)
-            # No idea why createrepo is injecting this
-            with open(newcache_path, 'w') as f:
-                json.dump(newcache, f, sort_keys=True)
-
-            self.builddir.commit()
-            if opts.touch_if_changed:
-                # Python doesn't bind futimens() - http://stackoverflow.com/questions/1158076/implement-touch-using-python
-                with open(opts.touch_if_changed, 'a'):
-                    log("Updated timestamp of {}".format(opts.touch_if_changed))
-                    os.utime(opts.touch_if_changed, None)
-            log("Success!")
-        else:
-            self.builddir.abandon()
-            log("No changes.")
+                cached_dirname = reusable[distgit_name]
+                log("Reusing cached build: {0}".format(cached_dirname))
+                oldrpmdir = self.builddir.path + '/' + cached_dirname
+                newrpmdir = self.newbuilddir + '/' + cached_dirname
+                to_clone.append((oldrpmdir, newrpmdir))
+                if distgit_name in oldindex.entries:
+                    newindex.entries[distgit_name] = oldindex.entries[distgit_name]
+            if len(to_clone) > 0:
+                stats = clone_trees(to_clone)
+                log("Reused {0} builds: {1} MiB shared, {2} MiB copied".format(len(to_clone),
+                                                                             stats['shared'] / 1024 / 1024,
+                                                                             stats['copied'] / 1024 / 1024))
+            for distgit_name in legacystate:
+                if distgit_name in reusable and distgit_name not in to_build:
+                    self._record_build(statedb, distgit_name, reusable[distgit_name],
+                                       fingerprints[distgit_name],
+                                       srpm_digests[components[distgit_name]['srpm']])
 
+            dirnames = {}
+            for distgit_name in to_build:
+                component = components[distgit_name]
+                srpm = component['srpm']
+                assert srpm.endswith('.temp.src.rpm')
+                srpm_version = srpm[:-len('.temp.src.rpm')]
+                dirnames[distgit_name] = srpm_version
+                newindex.set(distgit_name, buildrequires=oldindex.buildrequires(distgit_name))
+                if opts.noarch_from is not None:
+                    shareddir = opts.noarch_from + '/' + srpm_version
+                    if (os.path.isdir(shareddir) and
+                        srpm_buildarchs(self.snapshotdir + '/' + srpm) == ['noarch']):
+                        log("Reusing noarch build: {0}".format(srpm_version))
+                        clone_trees([(shareddir, self.newbuilddir + '/' + srpm_version)])
+                        self._record_build(statedb, distgit_name, srpm_version,
+                                           fingerprints[distgit_name], srpm_digests[srpm])
+                        need_createrepo = True
+                        continue
+                if resultcache is not None:
+                    # The overlay packages which can end up in the buildroot
+                    builddeps = (dependency_closure(deps, distgit_name) | unknown) - set([distgit_name])
+                    key = cache_key(srpm_digests[srpm], mockcfg_digest,
+                                    deps_digest(srpm_digests, [components[n]['srpm'] for n in builddeps]),
+                                    self.addrepos, self.mock_options)
+                    if resultcache.lookup(key, self.newbuilddir + '/' + srpm_version):
+                        log("Reusing build from result cache: {0}".format(srpm_version))
+                        self._record_build(statedb, distgit_name, srpm_version,
+                                           fingerprints[distgit_name], srpm_digests[srpm])
+                        need_createrepo = True
+                        continue
+                    to_store[srpm_version] = key
+                srpms.append(self.snapshotdir + '/' + srpm)
+                need_build = True
+                need_createrepo = True
+
+            if need_build:
+                if opts.worker:
+                    workers = dispatch.open_workers(opts.worker, secret=self._worker_secret(opts))
+                    rc = dispatch.dispatch_builds(srpms, workers, root_mock, self.newbuilddir,
+                                                  deps=build_deps,
+                                                  addrepos=self.addrepos,
+                                                  mock_options=self.mock_options,
+                                                  listen=opts.dispatch_listen,
+                                                  public_url=opts.dispatch_url,
+                                                  createrepo_cachedir=self.createrepo_cachedir,
+                                                  createrepo_options=self.createrepo_opts)
+                else:
+                    # Lets mockchain skip the dependents of failed builds
+                    depsfile = tempfile.NamedTemporaryFile(prefix='rdgo-deps', suffix='.json', dir=self.tmpdir)
+                    json.dump(srpm_deps, depsfile)
+                    depsfile.flush()
+                    mc_argv.extend(['--deps', depsfile.name])
+                    mc_argv.extend(srpms)
+                    log("Performing mockchain: {0}".format(subprocess.list2cmdline(mc_argv)))
+                    rc = mockchain_main(mc_argv) 
+                    depsfile.close()
+                for dirname, key in to_store.iteritems():
+                    resultdir = self.newbuilddir + '/' + dirname
+                    if self._build_succeeded(resultdir):
+                        resultcache.store(key, resultdir)
+                # Before the logs (and status.json with them) are moved away
+                for distgit_name in to_build:
+                    srpm = components[distgit_name]['srpm']
+                    if self.snapshotdir + '/' + srpm in srpms:
+                        self._record_build(statedb, distgit_name, dirnames[distgit_name],
+                                           fingerprints[distgit_name], srpm_digests[srpm])
+                if opts.logdir is not None:
+                    self._archive_logs(self.newbuilddir, opts.logdir, opts.logdir_keep_runs)
+                if rc != 0:
+                    fatal("Build exited with code {0}".format(rc))
+            elif need_createrepo:
+                log("No build neeeded, but component set changed")
+
+            if need_createrepo:
+                self._publish(statedb, newindex, dirnames, components.keys())
+                self.builddir.commit()
+                statedb.commit()
+                if opts.touch_if_changed:
+                    self._touch(opts.touch_if_changed)
+                log("Success!")
+            else:
+                self.builddir.abandon()
+                statedb.rollback()
+                log("No changes.")
+        except BaseException:
+            # Nothing of this run is published
+            statedb.rollback()
+            raise
+        finally:
+            statedb.close()
 
+if __name__ == '__main__':
+    TaskBuild().run(sys.argv[1:])
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import argparse
+
+from .task import Task
+from .task_resolve import TaskResolve
+from .utils import fatal, log
+
+
+class TaskCheck(Task):
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Check the specs of all components")
+        parser.add_argument('--tempdir', action='store', default=None,
+                            help='Path to directory for temporary working files')
+        parser.add_argument('--fetch-all', action='store_true', help='Fetch all git repositories')
+        parser.add_argument('-f', '--fetch', action='append', default=[],
+                            help='Fetch the specified git repository')
+        parser.add_argument('-j', '--jobs', action='store', type=int, default=8,
+                            help='Number of components to check in parallel')
+
+        opts = parser.parse_args(argv)
+
+        resolver = TaskResolve()
+        expanded = resolver.prepare(opts, snapshot=False)
+        count = resolver.check_components(expanded['components'], opts, jobs=opts.jobs)
+        if count > 0:
+            fatal("Found {0} problems in specs".format(count))
+        log("Checked {0} components".format(len(expanded['components'])))
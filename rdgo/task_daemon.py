@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Keep running, polling the upstream repositories and resolving and
+# building whenever something changed.  Unlike running resolve and
+# build from cron, the parsed overlay, git ref and describe caches,
+# SRPM digests and build state stay in memory between runs.
+
+import os
+import json
+import time
+import argparse
+import threading
+import traceback
+import Queue
+
+from .utils import log, read_secret_file
+from .task import Task
+from .task_resolve import TaskResolve
+from .task_run import TaskRun
+from .git import GitMirror
+from . import push
+
+
+class TaskDaemon(Task):
+    def _revisions(self, component):
+        revs = []
+        if component.get('src') is not None:
+            revs.append(component['revision'])
+        if component.get('distgit') is not None:
+            revs.append(component['distgit']['revision'])
+        return revs
+
+    def _poll(self, resolver, pkgnames=None):
+        """Fetch the repositories of the components in @pkgnames (or all),
+        and return a dict mapping their pkgnames to current revisions."""
+        revisions = {}
+        self._components = resolver.load_overlay()['components']
+        for component in self._components:
+            if pkgnames is not None and component['pkgname'] not in pkgnames:
+                continue
+            src = component.get('src')
+            if src is not None:
+                ref = resolver._one_of_keys(component, 'freeze', 'branch', 'tag')
+                component['revision'] = resolver.mirror.mirror(src, ref, fetch=True)
+            distgit = component.get('distgit')
+            if distgit is not None:
+                ref = resolver._one_of_keys(distgit, 'freeze', 'branch', 'tag')
+                distgit['revision'] = resolver.mirror.mirror(distgit['src'], ref, fetch=True)
+            revisions[component['pkgname']] = self._revisions(component)
+        return revisions
+
+    def _built_revisions(self):
+        """The revisions of each component in the current snapshot"""
+        path = self.workdir + '/snapshot/snapshot.json'
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return {}
+        if mtime != self._snapshot_mtime:
+            with open(path) as f:
+                snapshot = json.load(f)
+            self._built = dict((c['pkgname'], self._revisions(c)) for c in snapshot['components'])
+            self._snapshot_mtime = mtime
+        return self._built
+
+    def _process_jobs(self, jobs, opts, resolver, runner):
+        while True:
+            pkgnames = jobs.get()
+            if pkgnames is None:
+                return
+            # Coalesce everything queued meanwhile into one run
+            while True:
+                try:
+                    more = jobs.get_nowait()
+                except Queue.Empty:
+                    break
+                if more is None:
+                    jobs.put(None)
+                    break
+                elif not pkgnames or not more:
+                    # Everything
+                    pkgnames = frozenset()
+                else:
+                    pkgnames = pkgnames | more
+            log("Starting run for: {0}".format(' '.join(sorted(pkgnames)) or '(all)'))
+            try:
+                # Anything else that changed meanwhile is still being
+                # debounced, and is built by a later run.
+                runner.execute(opts, resolver, only=pkgnames or None)
+            except SystemExit as e:
+                log("Run failed: {0}".format(e))
+            except Exception:
+                log("Run failed:\n" + traceback.format_exc())
+
+    def _on_push(self, urls):
+        pkgnames = push.components_for_urls(self._components, urls)
+        if pkgnames:
+            log("Push notification for: {0}".format(' '.join(pkgnames)))
+            with self._push_lock:
+                self._pushed.update(pkgnames)
+            self._wakeup.set()
+        return pkgnames
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Poll for changes and build them")
+        resolver = TaskResolve()
+        runner = TaskRun()
+        runner.keep_state = True
+        runner.add_arguments(parser, resolver)
+        parser.add_argument('--interval', action='store', type=int, default=600,
+                            help='Seconds between polls of all upstream repositories')
+        parser.add_argument('--debounce', action='store', type=int, default=120,
+                            help='Wait until a component has not changed for this many seconds')
+        parser.add_argument('--listen', action='store', default=None,
+                            help='Accept push notifications over HTTP on HOST:PORT')
+        parser.add_argument('--push-secret-file', action='store', default=None,
+                            help='Only accept push notifications signed with the secret in this file')
+        opts = parser.parse_args(argv)
+        # Polling does the fetching
+        opts.fetch_all = False
+        opts.fetch = []
+
+        # The resolver and its mirrors are shared with the job thread,
+        # and lock themselves; the build state is only used there.
+        self._snapshot_mtime = None
+        resolver.mirror = GitMirror(self.workdir + '/src')
+        self._components = resolver.load_overlay()['components']
+        jobs = Queue.Queue()
+        worker = threading.Thread(target=self._process_jobs, args=(jobs, opts, resolver, runner))
+        worker.daemon = True
+        worker.start()
+
+        self._wakeup = threading.Event()
+        self._push_lock = threading.Lock()
+        self._pushed = set()
+        listener = None
+        if opts.listen is not None:
+            (host, _, port) = opts.listen.rpartition(':')
+            secret = None
+            if opts.push_secret_file is not None:
+                secret = read_secret_file(opts.push_secret_file)
+            listener = push.PushListener(host or 'localhost', int(port), self._on_push,
+                                         secret=secret)
+            listener.start()
+            log("Listening for push notifications on {0}:{1}".format(*listener.address))
+
+        # Catch up on anything that changed while we weren't running;
+        # an empty set means everything.
+        jobs.put(frozenset())
+        # Revisions not built yet: when they were first polled, and
+        # which were queued
+        polled = {}
+        changed_at = {}
+        queued = {}
+        next_poll = time.time() + opts.interval
+        try:
+            while True:
+                deadlines = [next_poll] + [t + opts.debounce for t in changed_at.itervalues()]
+                # Event.wait() without a timeout can't be interrupted
+                self._wakeup.wait(max(min(deadlines) - time.time(), 0.1))
+                self._wakeup.clear()
+                with self._push_lock:
+                    pushed = self._pushed
+                    self._pushed = set()
+                if time.time() >= next_poll:
+                    log("Polling for changes")
+                    targets = None
+                    next_poll = time.time() + opts.interval
+                elif pushed:
+                    targets = pushed
+                else:
+                    targets = set()
+                revisions = {}
+                if targets is None or len(targets) > 0:
+                    revisions = self._poll(resolver, targets)
+                built = self._built_revisions()
+                now = time.time()
+                for pkgname, revs in revisions.iteritems():
+                    if built.get(pkgname) == revs:
+                        changed_at.pop(pkgname, None)
+                        queued.pop(pkgname, None)
+                    elif polled.get(pkgname) != revs:
+                        # Another commit; wait for things to settle
+                        changed_at[pkgname] = now
+                    polled[pkgname] = revs
+                ready = set(p for (p, t) in changed_at.iteritems()
+                            if now - t >= opts.debounce and queued.get(p) != polled[p])
+                if ready:
+                    for pkgname in ready:
+                        queued[pkgname] = polled[pkgname]
+                        del changed_at[pkgname]
+                    jobs.put(frozenset(ready))
+        except KeyboardInterrupt:
+            if listener is not None:
+                listener.stop()
+            jobs.put(None)
+            worker.join()
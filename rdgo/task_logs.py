@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from __future__ import print_function
+
+import sys
+import argparse
+
+from .task import Task
+from .utils import fatal
+from .logarchive import LogArchive, CHUNK_SIZE
+
+
+class TaskLogs(Task):
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Show archived build logs")
+        parser.add_argument('--logdir', action='store', required=True,
+                            help='Log archive, as passed to build --logdir')
+        parser.add_argument('--run', action='store', default=None,
+                            help='Show the build from this run instead of the latest one')
+        parser.add_argument('--log', action='store', default=None,
+                            help='Print this whole log (e.g. root.log) instead of the failing section')
+        parser.add_argument('--list', action='store_true',
+                            help='List the runs which built the component')
+        parser.add_argument('component', action='store',
+                            help='Component name')
+
+        opts = parser.parse_args(argv)
+
+        archive = LogArchive(opts.logdir)
+        if opts.list:
+            for (runid, dname) in archive.load_index().get(opts.component, []):
+                status = archive.load_run(runid)['results'][dname]['status']
+                print("{0} {1} {2}".format(runid, dname, status['status']))
+            return
+
+        found = archive.find(opts.component, runid=opts.run)
+        if found is None:
+            fatal("No archived build of {0}".format(opts.component))
+        (runid, dname, result) = found
+        sys.stderr.write("{0} ({1}): {2}\n".format(dname, runid, result['status']['status']))
+        if opts.log is not None:
+            digest = result['logs'].get(opts.log)
+            if digest is None:
+                fatal("No {0} for {1}".format(opts.log, dname))
+            size = archive.size(digest)
+            for offset in range(0, size, CHUNK_SIZE):
+                sys.stdout.write(archive.read(digest, offset, offset + CHUNK_SIZE))
+        else:
+            sys.stdout.write(archive.failing_section(result))
@@ -25,11 +25,18 @@ import shutil
 import yaml
 import tempfile
 import copy
+import threading
+from multiprocessing.pool import ThreadPool
 
 from .utils import log, fatal, ensuredir, rmrf, ensure_clean_dir, run_sync, hardlink_or_copy
 from .task import Task
 from . import specfile 
+from . import speccheck
+from . import srpmwriter
 from .git import GitMirror
+from .specindex import SpecIndex, spec_metadata
+from .depgraph import srpm_buildrequires, component_graph
+from .mockchain import mock_config_macros
 
 def require_key(conf, key):
     try:
@@ -37,7 +44,23 @@ def require_key(conf, key):
     except KeyError, e:
         fatal("Missing config key {0}".format(key))
 
+# Recorded in snapshot.json from each component's spec
+SPEC_KEYS = ['buildrequires', 'packages']
+
 class TaskResolve(Task):
+    mirror = None
+    specindex = None
+    target_macros = None
+    srpm_writer = 'rpmbuild'
+    _target_mock = None
+    _overlay_mtime = None
+    _only = None
+
+    def __init__(self):
+        super(TaskResolve, self).__init__()
+        # The daemon polls with this resolver while it is resolving
+        self._overlay_lock = threading.Lock()
+
     def _url_to_projname(self, url):
         rcolon = url.rfind(':')
         rslash = url.rfind('/')
@@ -124,7 +147,14 @@ class TaskResolve(Task):
     def _tar_czf_with_prefix(self, dirpath, prefix, output):
         dn = os.path.dirname(dirpath)
         bn = os.path.basename(dirpath)
-        run_sync(['tar', '--exclude-vcs', '-czf', output, '--transform', 's,^' + bn + ',' + prefix + ',', bn],
+        # Make the tarball a pure function of the commit, so that
+        # identical sources give identical SRPM contents (and hence
+        # build cache hits).
+        mtime = subprocess.check_output(['git', 'log', '-1', '--format=%ct', 'HEAD'], cwd=dirpath).strip()
+        run_sync(['tar', '--exclude-vcs', '--sort=name', '--mtime=@' + mtime,
+                  '--owner=0', '--group=0', '--numeric-owner',
+                  '--use-compress-program=gzip -n',
+                  '-cf', output, '--transform', 's,^' + bn + ',' + prefix + ',', bn],
                  cwd=dn)
 
     def _strip_all_prefixes(self, s, prefixes):
@@ -144,30 +174,29 @@ class TaskResolve(Task):
             gitdesc += distgit_desc.replace('-', '.')
         return [rpm_version, gitdesc]
 
-    def _generate_srpm(self, component, upstream_tag, upstream_rev, upstream_co,
-                       distgit_desc, distgit_co,
-                       target,
-                       prep_cmd=None):
+    def _srpm_name(self, component, upstream_tag, upstream_rev, distgit_desc):
+        [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
+        return "{0}-{1}-{2}.temp.src.rpm".format(component['pkgname'], rpm_version, rpm_release)
+
+    def _patches_action(self, component):
         distgit = component.get('distgit')
         if distgit is not None:
-            patches_action = distgit.get('patches', None)
-        else:
-            patches_action = None
+            return distgit.get('patches', None)
+        return None
 
+    def _tar_dirname(self, component, upstream_tag, upstream_rev):
+        if upstream_rev is None:
+            return None
         upstream_desc = upstream_rev
         if upstream_tag is not None:
             upstream_desc = upstream_tag + '-' + upstream_desc
+        return '{0}-{1}'.format(component['name'], upstream_desc)
 
-        [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
-
-        spec_fn = specfile.spec_fn(spec_dir=distgit_co)
-        spec = specfile.Spec(distgit_co + '/' + spec_fn)
-
-        if upstream_desc is not None:
-            tar_dirname = '{0}-{1}'.format(component['name'], upstream_desc)
+    def _edit_spec(self, spec, component, tar_dirname, rpm_version, rpm_release):
+        """Make @spec build our tarball (if any) at our version"""
+        patches_action = self._patches_action(component)
+        if tar_dirname is not None:
             tarname = tar_dirname + '.tar.gz'
-            tmp_tarpath = distgit_co + '/' + tarname
-            self._tar_czf_with_prefix(upstream_co, tar_dirname, tmp_tarpath)
             has_zero = spec.get_tag('Source0', allow_empty=True) is not None
             source_tag = 'Source'
             if has_zero:
@@ -187,6 +216,21 @@ class TaskResolve(Task):
         else:
             fatal("Component '{0}': Unknown patches action '{1}'".format(component['name'],
                                                                          patches_action))
+
+    def _generate_srpm(self, component, upstream_tag, upstream_rev, upstream_co,
+                       distgit_desc, distgit_co,
+                       target,
+                       prep_cmd=None):
+        [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
+
+        spec_fn = specfile.spec_fn(spec_dir=distgit_co)
+        spec = specfile.Spec(distgit_co + '/' + spec_fn)
+
+        tar_dirname = self._tar_dirname(component, upstream_tag, upstream_rev)
+        if tar_dirname is not None:
+            self._tar_czf_with_prefix(upstream_co, tar_dirname,
+                                      distgit_co + '/' + tar_dirname + '.tar.gz')
+        self._edit_spec(spec, component, tar_dirname, rpm_version, rpm_release)
         spec.save()
         spec._txt = '# NOTE: AUTO-GENERATED by rpmdistro-gitoverlay; DO NOT EDIT\n' + spec._txt
         rpmbuild_argv = ['rpmbuild']
@@ -196,29 +240,61 @@ class TaskResolve(Task):
         if prep_cmd is not None:
             print("Executing preparation command")
             run_sync(prep_cmd, cwd=distgit_co, shell=True)
-        rpmbuild_argv.extend(['-bs', spec_fn])
-        run_sync(rpmbuild_argv, cwd=distgit_co)
-        srpms = []
-        for fname in os.listdir(distgit_co):
-            if fname.endswith('.src.rpm'):
-                srpms.append(fname)
-        if len(srpms) == 0:
-            fatal("No .src.rpm found in {0}".format(distgit_co))
-        elif len(srpms) > 1:
-            fatal("Multiple .src.rpm found in {0}".format(distgit_co))
-        srpm = srpms[0]
-        hardlink_or_copy(distgit_co + '/' + srpm, self.tmp_snapshotdir + '/' + target)
-
-    def _ensure_srpm(self, component):
+        try:
+            spec_info = spec_metadata(distgit_co + '/' + spec_fn, self.target_macros)
+        except Exception, e:
+            log("Failed to parse {0}: {1}".format(spec_fn, e))
+        else:
+            for key in SPEC_KEYS:
+                component[key] = spec_info[key]
+        written = None
+        if self.srpm_writer != 'rpmbuild':
+            written = self._write_srpm(distgit_co + '/' + spec_fn)
+        if written is not None and self.srpm_writer == 'internal':
+            srpm_path = written
+        else:
+            rpmbuild_argv.extend(['-bs', spec_fn])
+            run_sync(rpmbuild_argv, cwd=distgit_co)
+            srpms = []
+            for fname in os.listdir(distgit_co):
+                if fname.endswith('.src.rpm'):
+                    srpms.append(fname)
+            if len(srpms) == 0:
+                fatal("No .src.rpm found in {0}".format(distgit_co))
+            elif len(srpms) > 1:
+                fatal("Multiple .src.rpm found in {0}".format(distgit_co))
+            srpm_path = distgit_co + '/' + srpms[0]
+            if written is not None:
+                try:
+                    differences = srpmwriter.compare_srpms(srpm_path, written)
+                except Exception, e:
+                    differences = ["Comparing failed: {0}".format(e)]
+                for difference in differences:
+                    log("{0}: SRPM written without rpmbuild differs: {1}".format(component['name'],
+                                                                                 difference))
+        hardlink_or_copy(srpm_path, self.tmp_snapshotdir + '/' + target)
+
+    def _write_srpm(self, spec_path):
+        """Write the SRPM of the spec at @spec_path without rpmbuild,
+        into a new directory next to it; returns its path, or None if
+        that failed."""
+        destdir = os.path.dirname(spec_path) + '/.rdgo-srpm'
+        ensuredir(destdir)
+        try:
+            return srpmwriter.write_srpm(specfile.Spec(spec_path), destdir)
+        except Exception, e:
+            log("Failed to write the SRPM of {0}, using rpmbuild: {1}".format(os.path.basename(spec_path), e))
+            return None
+
+    def _describe(self, component):
+        """Returns the upstream tag and revision and the dist-git
+        revision and description of a mirrored @component"""
         upstream_src = component.get('src')
         if upstream_src is not None:
             upstream_rev = component['revision']
             [upstream_tag, upstream_rev] = self.mirror.describe(upstream_src, upstream_rev)
-            upstream_desc = upstream_rev
-            if upstream_tag is not None:
-                upstream_desc = upstream_tag + '-' + upstream_desc
         else:
-            upstream_rev = upstream_tag = upstream_desc = None
+            upstream_rev = upstream_tag = None
 
         distgit = component.get('distgit')
         if distgit is not None:
@@ -229,14 +305,17 @@ class TaskResolve(Task):
             if distgit_tag is not None:
                 distgit_desc = distgit_tag + '-' + distgit_desc
         else:
-            distgit_desc = None
+            distgit_rev = distgit_desc = None
 
-        assert (upstream_desc or distgit_desc) is not None
+        assert (upstream_rev or distgit_desc) is not None
+        return (upstream_tag, upstream_rev, distgit_rev, distgit_desc)
 
-        [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
+    def _ensure_srpm(self, component):
+        upstream_src = component.get('src')
+        distgit = component.get('distgit')
+        (upstream_tag, upstream_rev, distgit_rev, distgit_desc) = self._describe(component)
 
-        name = "{0}-{1}-{2}.temp.src.rpm".format(component['pkgname'],
-                                                 rpm_version, rpm_release)
+        name = self._srpm_name(component, upstream_tag, upstream_rev, distgit_desc)
         tmpdir = tempfile.mkdtemp('', 'rdgo-srpms', self.tmpdir)
         try:
             if upstream_src is not None:
@@ -251,7 +330,7 @@ class TaskResolve(Task):
                 # Create a directory whose name matches the module
                 # name, which helps fedpkg/rhpkg.
                 distgit_co = distgit_topdir + '/' + distgit['name']
-                self.mirror.checkout(distgit_src, distgit_rev, distgit_co)
+                self.mirror.checkout(distgit['src'], distgit_rev, distgit_co)
             else:
                 shutil.copy2(upstream_co + '/' + component['pkgname'] + '.spec', tmpdir)
                 distgit_co = tmpdir
@@ -269,60 +348,275 @@ class TaskResolve(Task):
                 rmrf(tmpdir)
         return name
 
-    def run(self, argv):
-        parser = argparse.ArgumentParser(description="Create snapshot.json")
-        parser.add_argument('--tempdir', action='store', default=None,
-                            help='Path to directory for temporary working files')
-        parser.add_argument('--fetch-all', action='store_true', help='Fetch all git repositories')
-        parser.add_argument('-f', '--fetch', action='append', default=[],
-                            help='Fetch the specified git repository')
-        parser.add_argument('--touch-if-changed', action='store', default=None,
-                            help='Create or update timestamp on target path if a change occurred')
-
-        opts = parser.parse_args(argv)
-
+    def prepare(self, opts, snapshot=True, only=None):
+        """Load overlay.yml and (if @snapshot) start a new snapshot;
+        returns the expanded overlay, whose components still need
+        resolve_component().  If @only is given, the components not in
+        it keep their revisions from the current snapshot."""
         srcdir = self.workdir + '/src'
         if not os.path.isdir(srcdir):
             fatal("Missing src/ directory; run 'rpmdistro-gitoverlay init'?")
 
-        self.mirror = GitMirror(self.workdir + '/src')
+        # Kept across calls, along with its caches
+        if self.mirror is None:
+            self.mirror = GitMirror(self.workdir + '/src')
+        if self.specindex is None:
+            self.specindex = SpecIndex(self.mirror)
         self.tmpdir = opts.tempdir
+        self._only = only
 
+        if not snapshot:
+            expanded = self.load_overlay()
+            self._load_target_macros(expanded)
+            return expanded
+
+        self.srpm_writer = opts.srpm_writer
         self.old_snapshotdir = self.workdir + '/old-snapshot'
         self.snapshotdir = self.workdir + '/snapshot'
         self.tmp_snapshotdir = self.snapshotdir + '.tmp'
         ensure_clean_dir(self.tmp_snapshotdir)
 
+        # SRPMs of components whose sources and settings are unchanged
+        # can be reused.
+        self._old_components = {}
+        self._old_target_macros = None
+        old_snapshot_path = self.snapshotdir + '/snapshot.json'
+        if os.path.isfile(old_snapshot_path):
+            with open(old_snapshot_path) as f:
+                old_snapshot = json.load(f)
+            for component in old_snapshot.get('components', []):
+                self._old_components[component['pkgname']] = component
+            self._old_target_macros = old_snapshot.get('target-macros')
+
+        expanded = self.load_overlay()
+        self._load_target_macros(expanded)
+        return expanded
+
+    def _load_target_macros(self, expanded):
+        """Specs are parsed with the macros of the (first) mock root
+        defined, so that conditionals in them go the way they will in
+        the build."""
+        root_mock = expanded.get('root', {}).get('mock')
+        if isinstance(root_mock, list):
+            root_mock = root_mock[0]
+        if root_mock is not None:
+            root_mock = self._resolve_mock_config(root_mock)
+        if root_mock is None:
+            self.target_macros = None
+        elif root_mock != self._target_mock:
+            self.target_macros = mock_config_macros(root_mock)
+        self._target_mock = root_mock
+
+    def load_overlay(self):
+        """Returns the expanded overlay.yml, reparsing it only if it
+        changed since the last call."""
         ovlpath = self.workdir + '/overlay.yml'
-        with open(ovlpath) as f:
-            self._overlay = yaml.load(f)
-            
-        self._distgit = require_key(self._overlay, 'distgit')
-        self._distgit_prefix = require_key(self._distgit, 'prefix')
-
-        expanded = copy.deepcopy(self._overlay)
-        for component in expanded['components']:
-            self._expand_component(component)
-            ref = self._one_of_keys(component, 'freeze', 'branch', 'tag')
-            do_fetch = opts.fetch_all or (component['name'] in opts.fetch)
-            src = component.get('src')
-            if src is not None:
-                revision = self.mirror.mirror(src, ref, fetch=do_fetch)
-                component['revision'] = revision
-
-            distgit = component.get('distgit')
-            if distgit is not None:
-                ref = self._one_of_keys(distgit, 'freeze', 'branch', 'tag')
-                do_fetch = opts.fetch_all or (distgit['name'] in opts.fetch)
-                revision = self.mirror.mirror(distgit['src'], ref, fetch=do_fetch)
-                distgit['revision'] = revision
+        with self._overlay_lock:
+            mtime = os.stat(ovlpath).st_mtime
+            if mtime != self._overlay_mtime:
+                with open(ovlpath) as f:
+                    self._overlay = yaml.load(f)
+
+                self._distgit = require_key(self._overlay, 'distgit')
+                self._distgit_prefix = require_key(self._distgit, 'prefix')
+
+                self._expanded = copy.deepcopy(self._overlay)
+                for component in self._expanded['components']:
+                    self._expand_component(component)
+                self._overlay_mtime = mtime
+            return copy.deepcopy(self._expanded)
+
+    def old_component(self, pkgname):
+        """The entry of @pkgname in the current snapshot, or None"""
+        return self._old_components.get(pkgname)
+
+    def _reuse_srpm(self, component):
+        old = self._old_components.get(component['pkgname'])
+        if old is None or 'srpm' not in old:
+            return False
+        # The spec was parsed with the macros of the target
+        if self._old_target_macros != self.target_macros:
+            return False
+        oldsrpm = self.snapshotdir + '/' + old['srpm']
+        unchanged = dict(old)
+        for key in ['srpm'] + SPEC_KEYS:
+            unchanged.pop(key, None)
+        if unchanged != component or not os.path.isfile(oldsrpm):
+            return False
+        # Its version comes from git describe, which a new tag changes
+        # without changing the revisions
+        (upstream_tag, upstream_rev, _, distgit_desc) = self._describe(component)
+        if self._srpm_name(component, upstream_tag, upstream_rev, distgit_desc) != old['srpm']:
+            return False
+        log("Reusing SRPM: {0}".format(old['srpm']))
+        hardlink_or_copy(oldsrpm, self.tmp_snapshotdir + '/' + old['srpm'])
+        for key in ['srpm'] + SPEC_KEYS:
+            if key in old:
+                component[key] = old[key]
+        return True
+
+    def _pin_to_snapshot(self, component):
+        """Give @component its revisions from the current snapshot,
+        unless prepare() was asked to resolve it or it changed in
+        overlay.yml since.  Returns whether it did."""
+        if self._only is None or component['pkgname'] in self._only:
+            return False
+        old = self._old_components.get(component['pkgname'])
+        if old is None:
+            return False
+        unresolved = copy.deepcopy(old)
+        for key in ['srpm', 'revision'] + SPEC_KEYS:
+            unresolved.pop(key, None)
+        if unresolved.get('distgit') is not None:
+            unresolved['distgit'].pop('revision', None)
+        if unresolved != component:
+            return False
+        if 'revision' in old:
+            component['revision'] = old['revision']
+        if old.get('distgit') is not None:
+            component['distgit']['revision'] = old['distgit']['revision']
+        return True
+
+    def mirror_component(self, component, opts):
+        """Mirror the sources of @component, recording their revisions"""
+        if self._pin_to_snapshot(component):
+            return
+        ref = self._one_of_keys(component, 'freeze', 'branch', 'tag')
+        do_fetch = opts.fetch_all or (component['name'] in opts.fetch)
+        src = component.get('src')
+        if src is not None:
+            revision = self.mirror.mirror(src, ref, fetch=do_fetch)
+            component['revision'] = revision
 
+        distgit = component.get('distgit')
+        if distgit is not None:
+            ref = self._one_of_keys(distgit, 'freeze', 'branch', 'tag')
+            do_fetch = opts.fetch_all or (distgit['name'] in opts.fetch)
+            revision = self.mirror.mirror(distgit['src'], ref, fetch=do_fetch)
+            distgit['revision'] = revision
+
+    def resolve_component(self, component, opts):
+        """Mirror the sources of @component and generate its SRPM"""
+        self.mirror_component(component, opts)
+        if not self._reuse_srpm(component):
             srpm = self._ensure_srpm(component)
             component['srpm'] = os.path.basename(srpm)
+        if 'buildrequires' not in component:
+            spec_info = self.component_spec(component)
+            if spec_info is not None:
+                for key in SPEC_KEYS:
+                    component[key] = spec_info[key]
+            else:
+                srpm = self.tmp_snapshotdir + '/' + component['srpm']
+                component['buildrequires'] = srpm_buildrequires(srpm)
+                component['packages'] = []
+
+    def component_spec(self, component):
+        """Metadata of the spec of a resolved @component, from the spec
+        index; None if it is only known once the SRPM is generated."""
+        distgit = component.get('distgit')
+        if distgit is not None:
+            # This may change the spec
+            if distgit.get('prep-command') is not None:
+                return None
+            result = self.specindex.lookup(distgit['src'], distgit['revision'],
+                                           macros=self.target_macros)
+        else:
+            result = self.specindex.lookup(component['src'], component['revision'],
+                                           component['pkgname'] + '.spec',
+                                           macros=self.target_macros)
+        if 'error' in result:
+            return None
+        return result
+
+    def _check_component(self, component):
+        """Returns a list of problems with the spec of a mirrored
+        @component, edited as _generate_srpm() would."""
+        distgit = component.get('distgit')
+        if distgit is not None:
+            url = distgit['src']
+            rev = distgit['revision']
+            files = self.mirror.list_files(url, rev)
+            specs = [n for n in files if n.endswith('.spec')]
+            if len(specs) != 1:
+                return ["Expected one spec file in dist-git, found {0}".format(len(specs))]
+            spec_fn = specs[0]
+        else:
+            url = component['src']
+            rev = component['revision']
+            files = self.mirror.list_files(url, rev)
+            spec_fn = component['pkgname'] + '.spec'
+            if spec_fn not in files:
+                return ["No {0} in the repository".format(spec_fn)]
+        try:
+            txt = self.mirror.read_file(url, rev, spec_fn).decode('utf-8')
+        except UnicodeDecodeError, e:
+            return ["{0} is not valid UTF-8: {1}".format(spec_fn, e)]
 
+        tmpdir = tempfile.mkdtemp('', 'rdgo-check', self.mirror.tmpdir)
+        try:
+            spec = specfile.Spec(tmpdir + '/' + spec_fn, txt)
+            problems = speccheck.check_spec(spec)
+            patches_action = self._patches_action(component)
+            if patches_action not in (None, 'keep', 'drop'):
+                problems.append("Unknown patches action '{0}'".format(patches_action))
+                return problems
+            (upstream_tag, upstream_rev, _, distgit_desc) = self._describe(component)
+            [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
+            try:
+                self._edit_spec(spec, component,
+                                self._tar_dirname(component, upstream_tag, upstream_rev),
+                                rpm_version, rpm_release)
+            except Exception, e:
+                problems.append("Editing the spec failed: {0}".format(e))
+                return problems
+            spec.save()
+            try:
+                metadata = spec_metadata(spec.fn, self.target_macros)
+            except Exception, e:
+                problems.append(str(e))
+                return problems
+            if patches_action != 'drop':
+                problems.extend(speccheck.check_patch_files(metadata, files))
+            return problems
+        finally:
+            rmrf(tmpdir)
+
+    def check_components(self, components, opts, jobs=8):
+        """Check the specs of all @components in parallel, logging any
+        problems; returns how many there were."""
+        components = copy.deepcopy(components)
+        # Serially, since components may share repositories
+        for component in components:
+            self.mirror_component(component, opts)
+        def check(component):
+            try:
+                return self._check_component(component)
+            except Exception, e:
+                return ["Checking failed: {0}".format(e)]
+        pool = ThreadPool(jobs)
+        try:
+            results = pool.map(check, components)
+        finally:
+            pool.close()
+            pool.join()
+        count = 0
+        for component, problems in zip(components, results):
+            for problem in problems:
+                log("{0}: {1}".format(component['name'], problem))
+            count += len(problems)
+        return count
+
+    def commit(self, expanded, touch_if_changed=None):
+        """Write snapshot.json and replace the previous snapshot, if
+        anything changed.  Returns whether it did."""
         del expanded['aliases']
 
+        (expanded['graph'], expanded['levels']) = component_graph(expanded['components'])
+
         expanded['00comment'] = 'Generated by rpmdistro-gitoverlay from overlay.yml: DO NOT EDIT!'
+        # So that SRPMs are only reused for the same target
+        expanded['target-macros'] = self.target_macros
 
         snapshot_path = self.snapshotdir + '/snapshot.json'
         snapshot_tmppath = self.tmp_snapshotdir + '/snapshot.json'
@@ -339,11 +633,51 @@ class TaskResolve(Task):
             os.rename(self.snapshotdir, self.old_snapshotdir)
             os.rename(self.tmp_snapshotdir, self.snapshotdir)
             log("Wrote: " + self.snapshotdir)
-            if opts.touch_if_changed:
-                with open(opts.touch_if_changed, 'a'):
-                    log("Updated timestamp of {}".format(opts.touch_if_changed))
-                    os.utime(opts.touch_if_changed, None)
+            if touch_if_changed:
+                with open(touch_if_changed, 'a'):
+                    log("Updated timestamp of {}".format(touch_if_changed))
+                    os.utime(touch_if_changed, None)
         else:
             rmrf(self.tmp_snapshotdir)
             log("No changes.")
-                
+        return changed
+
+    def abandon(self):
+        rmrf(self.tmp_snapshotdir)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tempdir', action='store', default=None,
+                            help='Path to directory for temporary working files')
+        parser.add_argument('--fetch-all', action='store_true', help='Fetch all git repositories')
+        parser.add_argument('-f', '--fetch', action='append', default=[],
+                            help='Fetch the specified git repository')
+        parser.add_argument('--touch-if-changed', action='store', default=None,
+                            help='Create or update timestamp on target path if a change occurred')
+        parser.add_argument('--check', action='store_true',
+                            help='Check the specs of all components before generating any SRPM')
+        parser.add_argument('--srpm-writer', action='store', default='rpmbuild',
+                            choices=['rpmbuild', 'internal', 'compare'],
+                            help='Write SRPMs with rpmbuild (the default), in-process falling back to rpmbuild, '
+                            'or with both, logging differences and keeping rpmbuild\'s')
+
+    def check_or_fail(self, expanded, opts):
+        if opts.check:
+            count = self.check_components(expanded['components'], opts)
+            if count > 0:
+                self.abandon()
+                fatal("Found {0} problems in specs".format(count))
+            # Everything was just fetched
+            opts.fetch_all = False
+            opts.fetch = []
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Create snapshot.json")
+        self.add_arguments(parser)
+
+        opts = parser.parse_args(argv)
+
+        expanded = self.prepare(opts)
+        self.check_or_fail(expanded, opts)
+        for component in expanded['components']:
+            self.resolve_component(component, opts)
+        self.commit(expanded, touch_if_changed=opts.touch_if_changed)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Resolve and build in one pass: each component is handed to the build
+# scheduler as soon as its SRPM exists, while later components are
+# still being fetched.  The snapshot and build generation are only
+# committed once everything is done.
+
+import os
+import argparse
+import threading
+
+from .utils import log, fatal, clone_trees
+from .task_build import TaskBuild, require_key
+from .mockchain import mockconfig_path
+from .task_resolve import TaskResolve
+from . import dispatch
+from . import logarchive
+from .depgraph import DepIndex
+from .buildcache import mock_config_digest, srpm_content_digest
+from .buildstate import BuildStateDB, build_fingerprint
+
+
+class TaskRun(TaskBuild):
+    # Set by the daemon, which keeps these across runs
+    keep_state = False
+    _statedb = None
+
+    def __init__(self):
+        super(TaskRun, self).__init__()
+        self._srpm_digests = {}
+
+    def _srpm_content_digest(self, path):
+        # Reused SRPMs are hardlinked, so this identifies the contents
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        digest = self._srpm_digests.get(key)
+        if digest is None:
+            digest = srpm_content_digest(path)
+            self._srpm_digests[key] = digest
+        return digest
+
+    def _known_provides(self, index, pkgname):
+        return len(index.entries.get(pkgname, {}).get('provides', [])) > 0
+
+    def _open_statedb(self):
+        if self._statedb is None:
+            self._statedb = BuildStateDB(self.workdir + '/buildstate.db')
+        return self._statedb
+
+    def _close_statedb(self):
+        if not self.keep_state:
+            self._statedb.close()
+            self._statedb = None
+
+    def add_arguments(self, parser, resolver):
+        resolver.add_arguments(parser)
+        parser.add_argument('--logdir', action='store', default=None,
+                            help='Archive build logs in this directory')
+        parser.add_argument('--logdir-keep-runs', action='store', type=int, default=logarchive.KEEP_RUNS,
+                            help='Keep the logs of this many runs in --logdir (default: %(default)s)')
+        parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                            help='Number of local builds to run in parallel')
+        parser.add_argument('--worker', action='append', default=[],
+                            help='Dispatch builds to a worker instead: "local:N" or HOST:PORT')
+        parser.add_argument('--worker-secret-file', action='store', default=None,
+                            help='Sign the builds sent to remote workers with the secret in this file')
+        parser.add_argument('--dispatch-listen', action='store', default='localhost:0',
+                            help='Address to serve SRPMs and the build repository to workers on')
+        parser.add_argument('--dispatch-url', action='store', default=None,
+                            help='URL at which workers can reach --dispatch-listen')
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Resolve and build, pipelined")
+        resolver = TaskResolve()
+        self.add_arguments(parser, resolver)
+        opts = parser.parse_args(argv)
+        self.execute(opts, resolver)
+
+    def execute(self, opts, resolver, only=None):
+        """Resolve and build once, with @resolver (a TaskResolve); if
+        @only is given, the other components stay at their snapshot
+        revisions."""
+        expanded = resolver.prepare(opts, only=only)
+        resolver.check_or_fail(expanded, opts)
+        root = require_key(expanded, 'root')
+        root_mock = require_key(root, 'mock')
+        if isinstance(root_mock, list):
+            fatal("run does not support multiple mock targets; use resolve and build")
+        if root.get('ccache'):
+            fatal("run does not support root/ccache; use resolve and build")
+
+        self.tmpdir = opts.tempdir
+        self._prepare(root, root_mock, self.workdir)
+        mockcfg_digest = mock_config_digest(self._mock_config_path(self.root_mock), mockconfig_path)
+        statedb = self._open_statedb()
+        oldindex = DepIndex.load(self.builddir.path + '/depindex.json')
+        newindex = DepIndex()
+        pkgnames = [c['pkgname'] for c in expanded['components']]
+
+        workers = dispatch.open_workers(opts.worker or ['local:{0}'.format(opts.jobs)],
+                                        secret=self._worker_secret(opts))
+        dispatcher = dispatch.Dispatcher(workers, self.root_mock, self.newbuilddir,
+                                         resolver.tmp_snapshotdir,
+                                         addrepos=self.addrepos,
+                                         mock_options=self.mock_options,
+                                         listen=opts.dispatch_listen,
+                                         public_url=opts.dispatch_url,
+                                         createrepo_cachedir=self.createrepo_cachedir,
+                                         createrepo_options=self.createrepo_opts)
+        scheduler = dispatch.BuildScheduler([], streaming=True)
+        srpm_paths = {}
+        result = {}
+        def build():
+            result['rc'] = dispatcher.run(scheduler, srpm_paths)
+        builder = threading.Thread(target=build)
+        builder.start()
+
+        # Components built in this run
+        dirnames = {}
+        fingerprints = {}
+        srpm_digests = {}
+        need_createrepo = len(statedb) != len(pkgnames)
+        # What the others provide is known from their previous builds,
+        # or as in TaskBuild, for those never built, from the
+        # subpackages of their specs: in the previous snapshot, or once
+        # they are resolved.
+        for pkgname in pkgnames:
+            old = resolver.old_component(pkgname)
+            if not self._known_provides(oldindex, pkgname) and old is not None and old.get('packages'):
+                oldindex.set(pkgname, provides=old['packages'])
+        providers = oldindex.providers(pkgnames)
+        try:
+            for component in expanded['components']:
+                resolver.resolve_component(component, opts)
+                distgit_name = component['pkgname']
+                if not self._known_provides(oldindex, distgit_name) and component.get('packages'):
+                    oldindex.set(distgit_name, provides=component['packages'])
+                    for cap in component['packages']:
+                        providers.setdefault(cap, set()).add(distgit_name)
+                srpm = resolver.tmp_snapshotdir + '/' + component['srpm']
+                srpm_digest = self._srpm_content_digest(srpm)
+                fingerprint = build_fingerprint(srpm_digest, mockcfg_digest,
+                                                self.addrepos, self.mock_options)
+                cachedstate = statedb.lookup(distgit_name)
+                if cachedstate is not None and cachedstate['fingerprint'] == fingerprint:
+                    oldrpmdir = self.builddir.path + '/' + cachedstate['dirname']
+                    if os.path.isdir(oldrpmdir):
+                        log("Reusing cached build: {0}".format(cachedstate['dirname']))
+                        clone_trees([(oldrpmdir, self.newbuilddir + '/' + cachedstate['dirname'])])
+                        if distgit_name in oldindex.entries:
+                            newindex.entries[distgit_name] = oldindex.entries[distgit_name]
+                        scheduler.provide(distgit_name)
+                        continue
+                buildrequires = component['buildrequires']
+                oldindex.set(distgit_name, buildrequires=buildrequires)
+                newindex.set(distgit_name, buildrequires=buildrequires)
+                deps = oldindex.dependencies_of(distgit_name, providers)
+                dirnames[distgit_name] = dispatch.srpm_dirname(srpm)
+                fingerprints[distgit_name] = fingerprint
+                srpm_digests[distgit_name] = srpm_digest
+                srpm_paths[distgit_name] = srpm
+                scheduler.add(distgit_name, deps)
+                need_createrepo = True
+        except BaseException:
+            scheduler.abort()
+            builder.join()
+            resolver.abandon()
+            statedb.rollback()
+            self._close_statedb()
+            raise
+        scheduler.close()
+        builder.join()
+
+        for distgit_name, dirname in dirnames.iteritems():
+            self._record_build(statedb, distgit_name, dirname,
+                               fingerprints[distgit_name], srpm_digests[distgit_name])
+        if opts.logdir is not None and len(dirnames) > 0:
+            self._archive_logs(self.newbuilddir, opts.logdir, opts.logdir_keep_runs)
+        if result.get('rc') != 0:
+            resolver.abandon()
+            statedb.rollback()
+            self._close_statedb()
+            fatal("Build exited with code {0}".format(result.get('rc')))
+
+        if need_createrepo:
+            self._publish(statedb, newindex, dirnames, pkgnames)
+        changed = resolver.commit(expanded)
+        if need_createrepo:
+            self.builddir.commit()
+            statedb.commit()
+        else:
+            self.builddir.abandon()
+            statedb.rollback()
+        self._close_statedb()
+        if (changed or need_createrepo) and opts.touch_if_changed:
+            self._touch(opts.touch_if_changed)
+        log("Success!")
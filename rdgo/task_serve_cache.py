@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import argparse
+
+from .utils import read_secret_file
+from .task import Task
+from . import buildcache
+
+
+class TaskServeCache(Task):
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Serve a build result cache over HTTP")
+        parser.add_argument('--host', action='store', default='localhost',
+                            help='Address to listen on')
+        parser.add_argument('--port', action='store', type=int, default=8742,
+                            help='Port to listen on')
+        parser.add_argument('--secret-file', action='store', default=None,
+                            help='Accept uploads signed with the secret in this file, '
+                            'rather than only uploads from localhost')
+        parser.add_argument('cachedir', action='store',
+                            help='Directory to store results in')
+
+        opts = parser.parse_args(argv)
+
+        secret = None
+        if opts.secret_file is not None:
+            secret = read_secret_file(opts.secret_file)
+        buildcache.serve(opts.cachedir, host=opts.host, port=opts.port, secret=secret)
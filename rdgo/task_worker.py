@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import argparse
+
+from .utils import fatal, read_secret_file
+from .task import Task
+from . import dispatch
+
+
+class TaskWorker(Task):
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Run builds dispatched by 'build --worker'")
+        parser.add_argument('--listen', action='store', default='localhost:8743',
+                            help='Address to accept coordinator connections on')
+        parser.add_argument('--secret-file', action='store', default=None,
+                            help='Only accept builds signed with the secret in this file; '
+                            'required unless listening on localhost')
+        parser.add_argument('--stdio', action='store_true',
+                            help='Serve a single coordinator over stdin/stdout')
+
+        opts = parser.parse_args(argv)
+
+        if opts.stdio:
+            dispatch.serve_stdio()
+        else:
+            (host, _, port) = opts.listen.rpartition(':')
+            host = host or 'localhost'
+            secret = None
+            if opts.secret_file is not None:
+                secret = read_secret_file(opts.secret_file)
+            elif not dispatch.is_local_address(host):
+                fatal("Listening on {0} requires --secret-file".format(host))
+            dispatch.serve_tcp(host, int(port), secret=secret)
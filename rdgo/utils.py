@@ -23,6 +23,9 @@ import shutil
 import errno
 import subprocess
 import os
+import fcntl
+import threading
+from multiprocessing.pool import ThreadPool
 
 from gi.repository import GLib, Gio
 
@@ -36,6 +39,19 @@ def log(msg):
     sys.stdout.write('\n')
     sys.stdout.flush()
 
+def read_secret_file(path):
+    """The shared secret in the file at @path, used to sign requests"""
+    with open(path) as f:
+        secret = f.read().strip()
+    if not secret:
+        fatal("Empty secret in {0}".format(path))
+    return secret
+
+def component_name(pdn):
+    """Given a mockchain result directory name (NAME-VERSION-RELEASE),
+    return NAME."""
+    return pdn.rsplit('-', 2)[0]
+
 def run_sync(args, **kwargs):
     """Wraps subprocess.check_call(), logging the command line too."""
     if isinstance(args, str) or isinstance(args, unicode):
@@ -67,6 +83,89 @@ def hardlink_or_copy(src, dest):
             raise
         shutil.copy(src,dest)
 
+# From linux/fs.h
+_FICLONE = 0x40049409
+# Devices on which reflinking already failed
+_noreflink_devs = set()
+_noreflink_lock = threading.Lock()
+
+def _reflink(src, dest, stbuf):
+    if stbuf.st_dev in _noreflink_devs:
+        return False
+    with open(src, 'rb') as srcf:
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(stbuf.st_mode))
+        try:
+            fcntl.ioctl(fd, _FICLONE, srcf.fileno())
+        except IOError as e:
+            os.close(fd)
+            os.unlink(dest)
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                raise
+            with _noreflink_lock:
+                _noreflink_devs.add(stbuf.st_dev)
+            return False
+        os.close(fd)
+    return True
+
+def clone_file(src, dest, stbuf=None):
+    """Like hardlink_or_copy(), but try a reflink first.  Returns the
+    number of bytes that had to be copied."""
+    if stbuf is None:
+        stbuf = os.lstat(src)
+    if _reflink(src, dest, stbuf):
+        # Keep the mtime, so createrepo_c --update sees it as unchanged
+        os.utime(dest, (stbuf.st_atime, stbuf.st_mtime))
+        return 0
+    try:
+        os.link(src, dest)
+        return 0
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+    shutil.copy2(src, dest)
+    return stbuf.st_size
+
+def clone_tree(src, dest):
+    """Recreate the tree @src at @dest (which must not exist), sharing
+    file data wherever possible.  Returns a dict with the number of bytes
+    'copied' and 'shared'."""
+    stats = {'copied': 0, 'shared': 0}
+    os.mkdir(dest)
+    shutil.copymode(src, dest)
+    for (dirpath, dirnames, filenames) in os.walk(src):
+        destdir = dest + dirpath[len(src):]
+        for name in dirnames + filenames:
+            srcpath = dirpath + '/' + name
+            destpath = destdir + '/' + name
+            stbuf = os.lstat(srcpath)
+            if stat.S_ISDIR(stbuf.st_mode):
+                os.mkdir(destpath)
+                shutil.copymode(srcpath, destpath)
+            elif stat.S_ISLNK(stbuf.st_mode):
+                os.symlink(os.readlink(srcpath), destpath)
+            elif stat.S_ISREG(stbuf.st_mode):
+                copied = clone_file(srcpath, destpath, stbuf)
+                stats['copied'] += copied
+                stats['shared'] += stbuf.st_size - copied
+    return stats
+
+def clone_trees(pairs, threads=8):
+    """Run clone_tree() for each (src, dest) in @pairs across a pool of
+    threads, and return the summed statistics."""
+    stats = {'copied': 0, 'shared': 0}
+    if len(pairs) == 0:
+        return stats
+    pool = ThreadPool(min(threads, len(pairs)))
+    try:
+        results = pool.map(lambda pair: clone_tree(*pair), pairs)
+    finally:
+        pool.close()
+        pool.join()
+    for result in results:
+        for k in stats:
+            stats[k] += result[k]
+    return stats
+
 def ensuredir(path, with_parents=False):
     try:
         os.makedirs(path)
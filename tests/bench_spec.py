@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2015 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Benchmarks of specfile.Spec editing over a generated corpus of specs,
+# from small ones to some with thousands of changelog lines.  Each
+# operation is timed on a fresh Spec per corpus entry, as
+# _generate_srpm() uses them, and runs in its own forked process so its
+# peak RSS can be reported.  Run "make bench", or directly:
+#
+#   python tests/bench_spec.py --save bench.json
+#   python tests/bench_spec.py --compare bench.json
+#
+# With --compare, exits non-zero if any operation got slower, or needs
+# more memory, than the saved results by more than --tolerance.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rdgo import specfile
+from rdgo.task_resolve import TaskResolve
+
+_BUILDREQUIRES = ['gcc', 'make', 'autoconf', 'automake', 'libtool', 'gettext',
+                  'pkgconfig(glib-2.0)', 'pkgconfig(gio-unix-2.0)', 'libcurl-devel',
+                  'openssl-devel', 'python2-devel', 'systemd', 'zlib-devel',
+                  'gpgme-devel', 'libarchive-devel >= 2.8.0', 'gtk-doc']
+_WORDS = ['Rebuilt', 'for', 'Fedora', 'mass', 'rebuild', 'Update', 'to',
+          'new', 'upstream', 'release', 'Fix', 'crash', 'in', 'handling',
+          'of', 'symlinks', 'Backport', 'patch', 'from', 'master', 'CVE']
+_DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+           'Oct', 'Nov', 'Dec']
+
+def generate_spec(rnd, n, changelog_entries):
+    """A plausible dist-git spec for package number @n, with
+    @changelog_entries entries of a few lines each."""
+    name = 'pkg{0}'.format(n)
+    version = '{0}.{1}.{2}'.format(rnd.randint(0, 9), rnd.randint(0, 30), rnd.randint(0, 9))
+    npatches = rnd.choice([0, 0, 1, 3, 10, 40])
+    nsubpackages = rnd.choice([0, 1, 2, 5])
+    git_am = rnd.random() < 0.2
+    autosetup = not git_am and rnd.random() < 0.2
+    out = []
+    if rnd.random() < 0.3:
+        out.append('%global commit0 {0:040x}'.format(rnd.getrandbits(160)))
+        out.append('%global shortcommit0 %(c=%{commit0}; echo ${c:0:7})')
+        out.append('')
+    out.append('Name:           ' + name)
+    out.append('Version:        ' + version)
+    out.append('Release:        {0}%{{?dist}}'.format(rnd.randint(1, 20)))
+    out.append('Summary:        The {0} library and tools'.format(name))
+    out.append('License:        LGPLv2+')
+    out.append('URL:            https://example.com/{0}'.format(name))
+    out.append('Source0:        https://example.com/releases/%{name}-%{version}.tar.xz')
+    if rnd.random() < 0.3:
+        out.append('Source1:        %{name}.service')
+    out.append('')
+    if git_am and npatches:
+        out.append('#')
+        out.append('# patches_base={0}'.format(version))
+        out.append('#')
+    for i in range(1, npatches + 1):
+        out.append('Patch{0:04d}: {0:04d}-fix-something-number-{0}.patch'.format(i))
+        if rnd.random() < 0.3:
+            out.append('')
+    out.append('')
+    for dep in rnd.sample(_BUILDREQUIRES, rnd.randint(2, len(_BUILDREQUIRES))):
+        out.append('BuildRequires:  ' + dep)
+    if git_am:
+        out.append('BuildRequires:  git')
+    out.append('Requires:       %{name}-libs%{?_isa} = %{version}-%{release}')
+    out.append('')
+    out.append('%description')
+    out.append('{0} does things with files.  This paragraph is long enough to'.format(name))
+    out.append('wrap over a couple of lines, like most descriptions do.')
+    out.append('')
+    for i in range(nsubpackages):
+        out.append('%package sub{0}'.format(i))
+        out.append('Summary: Subpackage {0} of %{{name}}'.format(i))
+        out.append('Requires: %{name}%{?_isa} = %{version}-%{release}')
+        out.append('')
+        out.append('%description sub{0}'.format(i))
+        out.append('Subpackage {0}.'.format(i))
+        out.append('')
+    out.append('%prep')
+    if autosetup:
+        out.append('%autosetup -p1')
+    elif git_am:
+        out.append('%setup -q -n %{name}-%{version}')
+        out.append('git init')
+        out.append('git am %{patches}')
+    else:
+        out.append('%setup -q -n %{name}-%{version}')
+        for i in range(1, npatches + 1):
+            out.append('%patch{0:04d} -p1'.format(i))
+    out.append('')
+    out.append('%build')
+    out.append('%configure --disable-silent-rules --enable-gtk-doc')
+    out.append('make %{?_smp_mflags}')
+    out.append('')
+    out.append('%install')
+    out.append('make install DESTDIR=$RPM_BUILD_ROOT INSTALL="install -p -c"')
+    out.append('find $RPM_BUILD_ROOT -name \'*.la\' -delete')
+    out.append('%find_lang %{name}')
+    out.append('')
+    out.append('%post -p /sbin/ldconfig')
+    out.append('%postun -p /sbin/ldconfig')
+    out.append('')
+    out.append('%files -f %{name}.lang')
+    out.append('%doc README COPYING')
+    out.append('%{_bindir}/' + name)
+    out.append('%{{_libdir}}/lib{0}.so.*'.format(name))
+    for i in range(nsubpackages):
+        out.append('')
+        out.append('%files sub{0}'.format(i))
+        out.append('%{{_libdir}}/{0}/sub{1}.so'.format(name, i))
+    out.append('')
+    out.append('%changelog')
+    for i in range(changelog_entries):
+        out.append('* {0} {1} {2:02d} {3} Some Body <somebody@example.com> - {4}-{5}'.format(
+            rnd.choice(_DAYS), rnd.choice(_MONTHS), rnd.randint(1, 28),
+            2015 - i // 12, version, changelog_entries - i))
+        for _ in range(rnd.randint(1, 4)):
+            out.append('- ' + ' '.join(rnd.choice(_WORDS) for _ in range(rnd.randint(3, 12))))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+def generate_corpus(count, huge, huge_changelog_lines, seed):
+    """@count specs, the last @huge of which have about
+    @huge_changelog_lines changelog lines."""
+    rnd = random.Random(seed)
+    corpus = []
+    for n in range(count):
+        if n >= count - huge:
+            entries = huge_changelog_lines // 4
+        else:
+            entries = rnd.choice([1, 5, 20, 60, 150])
+        corpus.append(generate_spec(rnd, n, entries))
+    return corpus
+
+def _bench_get_tag(spec, n):
+    spec.get_tag('Release')
+    spec.get_tag('Source0', allow_empty=True)
+
+def _bench_set_tag(spec, n):
+    spec.set_tag('Version', '2016.1')
+    spec.set_tag('Release', '1.git%{?dist}')
+
+def _bench_set_setup_dirname(spec, n):
+    spec.set_setup_dirname('pkg{0}-2016.1'.format(n))
+
+def _bench_wipe_patches(spec, n):
+    spec.wipe_patches()
+
+def _bench_set_new_patches(spec, n):
+    spec.set_new_patches(['0001-first.patch', '0002-second.patch'])
+
+def _bench_delete_changelog(spec, n):
+    spec.delete_changelog()
+
+class _EditSequence(object):
+    """What _generate_srpm() does to a spec, up to running rpmbuild"""
+    def __init__(self, tmpdir):
+        self.resolver = TaskResolve()
+        self.tmpdir = tmpdir
+
+    def __call__(self, spec, n):
+        name = 'pkg{0}'.format(n)
+        component = {'name': name, 'pkgname': name, 'distgit': {'patches': 'drop'}}
+        self.resolver._edit_spec(spec, component, name + '-v2016.1-abcdef0',
+                                 '2016.1', '1.git.abcdef0')
+        spec.save()
+        spec._txt = '# NOTE: AUTO-GENERATED by rpmdistro-gitoverlay; DO NOT EDIT\n' + spec._txt
+
+BENCHMARKS = ['get_tag', 'set_tag', 'set_setup_dirname', 'wipe_patches',
+              'set_new_patches', 'delete_changelog', 'generate_srpm_edits']
+
+def _make_op(name, tmpdir):
+    if name == 'generate_srpm_edits':
+        return _EditSequence(tmpdir)
+    return globals()['_bench_' + name]
+
+def _maxrss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_benchmark(name, corpus, repeat, tmpdir):
+    """Best of @repeat passes of operation @name over @corpus; returns
+    a dict"""
+    op = _make_op(name, tmpdir)
+    fn = tmpdir + '/bench.spec'
+    rss_before = _maxrss_kib()
+    best = None
+    for _ in range(repeat):
+        specs = [specfile.Spec(fn, txt) for txt in corpus]
+        start = time.time()
+        for n, spec in enumerate(specs):
+            op(spec, n)
+            # Edits are applied lazily; include joining the text back
+            spec.txt
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    rss = _maxrss_kib()
+    return {'ops_per_sec': len(corpus) / best,
+            'seconds': best,
+            'peak_rss_kib': rss,
+            'rss_growth_kib': rss - rss_before}
+
+def run_forked(name, corpus, repeat, tmpdir):
+    """run_benchmark() in a child process, so that peak RSS is that of
+    this benchmark alone"""
+    (r, w) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        status = 0
+        try:
+            result = run_benchmark(name, corpus, repeat, tmpdir)
+            with os.fdopen(w, 'w') as f:
+                json.dump(result, f)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        os._exit(status)
+    os.close(w)
+    with os.fdopen(r) as f:
+        data = f.read()
+    (_, status) = os.waitpid(pid, 0)
+    if status != 0:
+        raise Exception("Benchmark {0} failed".format(name))
+    return json.loads(data)
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions of @results relative to @baseline"""
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append("{0}: {1:.0f} ops/s, was {2:.0f}".format(
+                name, result['ops_per_sec'], base['ops_per_sec']))
+        if result['rss_growth_kib'] > max(base['rss_growth_kib'], 1024) * (1 + tolerance):
+            regressions.append("{0}: RSS grew by {1} KiB, was {2} KiB".format(
+                name, result['rss_growth_kib'], base['rss_growth_kib']))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark spec editing")
+    parser.add_argument('--specs', type=int, default=300, help="Number of specs in the corpus")
+    parser.add_argument('--huge', type=int, default=20, help="How many of them are huge")
+    parser.add_argument('--huge-changelog-lines', type=int, default=8000,
+                        help="Changelog length of the huge specs")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3, help="Report the best of this many passes")
+    parser.add_argument('--only', action='append', choices=BENCHMARKS,
+                        help="Run only this benchmark (may be repeated)")
+    parser.add_argument('--save', help="Write the results as JSON to this file")
+    parser.add_argument('--compare', help="Fail on regressions relative to results saved with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed relative slowdown or memory growth (default 0.2)")
+    opts = parser.parse_args(argv)
+
+    corpus = generate_corpus(opts.specs, opts.huge, opts.huge_changelog_lines, opts.seed)
+    total = sum(len(txt) for txt in corpus)
+    print("Corpus: {0} specs, {1} lines, {2} KiB".format(
+        len(corpus), sum(txt.count('\n') for txt in corpus), total // 1024))
+    print("{0:<22} {1:>12} {2:>10} {3:>14} {4:>14}".format(
+        'benchmark', 'ops/s', 'seconds', 'peak RSS KiB', 'RSS growth'))
+
+    results = {}
+    tmpdir = tempfile.mkdtemp('', 'rdgo-bench')
+    try:
+        for name in opts.only or BENCHMARKS:
+            result = run_forked(name, corpus, opts.repeat, tmpdir)
+            results[name] = result
+            print("{0:<22} {1:>12.1f} {2:>10.3f} {3:>14} {4:>14}".format(
+                name, result['ops_per_sec'], result['seconds'],
+                result['peak_rss_kib'], result['rss_growth_kib']))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    # Rates only compare over the same corpus
+    corpus_opts = dict((k, getattr(opts, k)) for k in ['specs', 'huge', 'huge_changelog_lines', 'seed'])
+    if opts.save:
+        with open(opts.save, 'w') as f:
+            json.dump({'corpus': corpus_opts, 'results': results}, f, indent=4, sort_keys=True)
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        if baseline['corpus'] != corpus_opts:
+            print("Saved results are for a different corpus: {0}".format(baseline['corpus']))
+            return 1
+        regressions = compare(results, baseline['results'], opts.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
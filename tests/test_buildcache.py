@@ -0,0 +1,137 @@
+import os
+import tarfile
+import StringIO
+import socket
+import threading
+
+import pytest
+
+buildcache = pytest.importorskip('rdgo.buildcache')
+
+KEY = 'ab' * 32
+
+
+def _resultdir(tmpdir):
+    d = tmpdir.mkdir('result')
+    d.join('foo-1.0-1.x86_64.rpm').write('rpm')
+    d.join('build.log').write('log')
+    return d
+
+
+def test_mock_config_digest(tmpdir):
+    configdir = tmpdir.mkdir('mock')
+    configdir.join('site-defaults.cfg').write('')
+    configdir.mkdir('templates').join('base.tpl').write("config_opts['a'] = 1\n")
+    cfg = tmpdir.join('target.cfg')
+    cfg.write("include('templates/base.tpl')\nconfig_opts['b'] = 2\n")
+    digest = buildcache.mock_config_digest(str(cfg), str(configdir))
+    assert buildcache.mock_config_digest(str(cfg), str(configdir)) == digest
+    configdir.join('templates', 'base.tpl').write("config_opts['a'] = 2\n")
+    assert buildcache.mock_config_digest(str(cfg), str(configdir)) != digest
+    digest = buildcache.mock_config_digest(str(cfg), str(configdir))
+    configdir.join('site-defaults.cfg').write("config_opts['c'] = 3\n")
+    assert buildcache.mock_config_digest(str(cfg), str(configdir)) != digest
+
+
+def test_filesystem_cache(tmpdir):
+    cache = buildcache.open_cache(str(tmpdir.join('cache')))
+    dest = str(tmpdir.join('out', 'foo-1.0-1'))
+    assert not cache.lookup(KEY, dest)
+    assert not os.path.exists(dest)
+    cache.store(KEY, str(_resultdir(tmpdir)))
+    assert cache.lookup(KEY, dest)
+    assert sorted(os.listdir(dest)) == ['build.log', 'foo-1.0-1.x86_64.rpm']
+    with open(dest + '/foo-1.0-1.x86_64.rpm') as f:
+        assert f.read() == 'rpm'
+
+
+def _serve(tmpdir, secret=None):
+    server = buildcache.make_server(str(tmpdir.join('served')), port=0, secret=secret)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def server(tmpdir):
+    server = _serve(tmpdir)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def signed_server(tmpdir):
+    server = _serve(tmpdir, secret='s3cret')
+    yield server
+    server.shutdown()
+
+
+def test_http_cache(tmpdir, server):
+    cache = buildcache.open_cache('http://localhost:{0}/'.format(server.server_address[1]))
+    dest = str(tmpdir.join('out', 'foo-1.0-1'))
+    assert not cache.lookup(KEY, dest)
+    cache.store(KEY, str(_resultdir(tmpdir)))
+    assert os.listdir(server.cachedir) == [KEY + '.tar']
+    assert cache.lookup(KEY, dest)
+    assert sorted(os.listdir(dest)) == ['build.log', 'foo-1.0-1.x86_64.rpm']
+
+
+def test_http_cache_invalid_member(tmpdir, server):
+    buf = StringIO.StringIO()
+    tf = tarfile.open(fileobj=buf, mode='w')
+    for name in ['good.rpm', '../evil']:
+        info = tarfile.TarInfo(name)
+        info.size = 4
+        tf.addfile(info, StringIO.StringIO('data'))
+    tf.close()
+    with open(server.cachedir + '/' + KEY + '.tar', 'wb') as f:
+        f.write(buf.getvalue())
+    cache = buildcache.open_cache('http://localhost:{0}'.format(server.server_address[1]))
+    out = tmpdir.mkdir('out')
+    assert not cache.lookup(KEY, str(out.join('foo-1.0-1')))
+    assert os.listdir(str(out)) == []
+
+
+def test_http_cache_truncated(tmpdir, server):
+    with open(server.cachedir + '/' + KEY + '.tar', 'wb') as f:
+        f.write('not a tarball')
+    cache = buildcache.open_cache('http://localhost:{0}'.format(server.server_address[1]))
+    assert not cache.lookup(KEY, str(tmpdir.join('out', 'foo-1.0-1')))
+
+
+def test_http_cache_unreachable(tmpdir):
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    cache = buildcache.open_cache('http://localhost:{0}'.format(port))
+    dest = str(tmpdir.join('out', 'foo-1.0-1'))
+    assert not cache.lookup(KEY, dest)
+    cache.store(KEY, str(_resultdir(tmpdir)))
+    assert not os.path.exists(dest)
+
+
+def test_http_cache_signed(tmpdir, signed_server):
+    url = 'http://localhost:{0}'.format(signed_server.server_address[1])
+    resultdir = str(_resultdir(tmpdir))
+    # unsigned and badly signed uploads are refused, and only logged
+    buildcache.open_cache(url).store(KEY, resultdir)
+    buildcache.open_cache(url, secret='wrong').store(KEY, resultdir)
+    assert os.listdir(signed_server.cachedir) == []
+    cache = buildcache.open_cache(url, secret='s3cret')
+    cache.store(KEY, resultdir)
+    assert os.listdir(signed_server.cachedir) == [KEY + '.tar']
+    assert buildcache.open_cache(url).lookup(KEY, str(tmpdir.join('out', 'foo-1.0-1')))
+
+
+def test_http_cache_remote_upload_refused(tmpdir, server, monkeypatch):
+    # Without a secret, only uploads from localhost are accepted
+    orig = buildcache._CacheRequestHandler.do_PUT
+    def do_PUT(handler):
+        handler.client_address = ('192.0.2.1', handler.client_address[1])
+        orig(handler)
+    monkeypatch.setattr(buildcache._CacheRequestHandler, 'do_PUT', do_PUT)
+    cache = buildcache.open_cache('http://localhost:{0}'.format(server.server_address[1]))
+    cache.store(KEY, str(_resultdir(tmpdir)))
+    assert os.listdir(server.cachedir) == []
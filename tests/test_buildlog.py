@@ -0,0 +1,60 @@
+import json
+
+from rdgo import buildlog
+
+
+STATE_LOG_BUILD_FAILED = """\
+2015-10-01 10:00:00,000 - Start: init plugins
+2015-10-01 10:00:00,001 - Finish: init plugins
+2015-10-01 10:00:01,000 - Start: build setup for foo-1.0-1.src.rpm
+2015-10-01 10:00:30,000 - Finish: build setup for foo-1.0-1.src.rpm
+2015-10-01 10:00:30,001 - Start: rpmbuild foo-1.0-1.src.rpm
+"""
+
+
+def _write_resultdir(tmpdir, statelog, buildlog_txt='', rootlog_txt=''):
+    tmpdir.join('state.log').write(statelog)
+    tmpdir.join('build.log').write(buildlog_txt)
+    tmpdir.join('root.log').write(rootlog_txt)
+    return str(tmpdir)
+
+
+def test_build_failed(tmpdir):
+    lines = ['compiling\n'] * 3 + ['error: Bad exit status from /var/tmp/rpm-tmp.x (%build)\n']
+    resdir = _write_resultdir(tmpdir, STATE_LOG_BUILD_FAILED, ''.join(lines))
+    status = buildlog.summarize_resultdir(resdir, False, duration=12.5)
+    assert status['status'] == 'build-failed'
+    assert status['phase'] == 'rpmbuild foo-1.0-1.src.rpm'
+    assert status['duration'] == 12.5
+    assert status['error_count'] == 1
+    assert status['errors'][0]['offset'] == len('compiling\n') * 3
+    assert status['errors'][0]['line'].startswith('error: Bad exit status')
+    json.dumps(status)
+
+
+def test_error_limit(tmpdir):
+    txt = 'error: oops\n' * (buildlog.MAX_ERRORS + 5)
+    resdir = _write_resultdir(tmpdir, STATE_LOG_BUILD_FAILED, txt)
+    status = buildlog.summarize_resultdir(resdir, False)
+    assert len(status['errors']) == buildlog.MAX_ERRORS
+    assert status['error_count'] == buildlog.MAX_ERRORS + 5
+    assert status['errors'][1]['offset'] == len('error: oops\n')
+
+
+def test_long_lines(tmpdir):
+    txt = 'x' * (buildlog.MAX_LINE * 2) + 'error: not at line start\nerror: real\n'
+    resdir = _write_resultdir(tmpdir, STATE_LOG_BUILD_FAILED, txt)
+    status = buildlog.summarize_resultdir(resdir, False)
+    assert status['error_count'] == 1
+    assert status['errors'][0]['line'] == 'error: real'
+
+
+def test_missing_buildrequires(tmpdir):
+    statelog = STATE_LOG_BUILD_FAILED.split('\n')[2] + '\n'
+    rootlog = ("DEBUG util.py:417:  No matching package to install: 'libfoo-devel'\n"
+               "DEBUG util.py:417:  No Package found for bar-devel\n")
+    resdir = _write_resultdir(tmpdir, statelog, rootlog_txt=rootlog)
+    status = buildlog.summarize_resultdir(resdir, False)
+    assert status['status'] == 'root-failed'
+    assert status['phase'] == 'build setup for foo-1.0-1.src.rpm'
+    assert status['missing_buildrequires'] == ['libfoo-devel', 'bar-devel']
@@ -0,0 +1,82 @@
+import sqlite3
+
+from rdgo import buildstate
+
+
+def test_fingerprint_ignores_addrepo_order():
+    a = buildstate.build_fingerprint('s', 'm', addrepos=['r1', 'r2'])
+    b = buildstate.build_fingerprint('s', 'm', addrepos=['r2', 'r1'])
+    assert a == b
+    assert a != buildstate.build_fingerprint('s', 'm2', addrepos=['r1', 'r2'])
+
+
+def test_update_commit_rollback(tmpdir):
+    path = str(tmpdir.join('buildstate.db'))
+    db = buildstate.BuildStateDB(path)
+    db.update('ostree', 'f1', 'ostree-2015.9-1', 's1', ['b.rpm', 'a.rpm'], duration=12.5)
+    db.update('etcd', 'f2', 'etcd-2.2-1', 's2', [])
+    db.commit()
+    db.update('ostree', 'f3', 'ostree-2015.10-1', 's3', [])
+    db.retain(['ostree'])
+    db.rollback()
+    state = db.lookup('ostree')
+    assert state['fingerprint'] == 'f1'
+    assert state['files'] == ['a.rpm', 'b.rpm']
+    assert state['duration'] == 12.5
+    assert len(db) == 2
+    db.retain(['ostree'])
+    db.commit()
+    db.close()
+    db = buildstate.BuildStateDB(path)
+    assert db.lookup('etcd') is None
+    assert len(db) == 1
+
+
+def test_updates_pending_until_commit(tmpdir):
+    path = str(tmpdir.join('buildstate.db'))
+    db = buildstate.BuildStateDB(path)
+    db.update('ostree', 'f1', 'ostree-2015.9-1', 's1', [])
+    db.commit()
+    other = buildstate.BuildStateDB(path)
+    db.update('ostree', 'f2', 'ostree-2015.10-1', 's2', [])
+    db.update('etcd', 'f3', 'etcd-2.2-1', 's3', [])
+    # Another connection sees the update as pending, not current, and
+    # doesn't publish it
+    assert other.lookup('ostree')['fingerprint'] == 'f1'
+    assert other.lookup('etcd') is None
+    other.commit()
+    assert db.lookup('ostree')['fingerprint'] == 'f1'
+    assert db.lookup('etcd') is None
+    db.commit()
+    assert other.lookup('ostree')['fingerprint'] == 'f2'
+    assert other.lookup('etcd')['fingerprint'] == 'f3'
+
+
+def test_aborted_updates_dropped(tmpdir):
+    path = str(tmpdir.join('buildstate.db'))
+    db = buildstate.BuildStateDB(path)
+    db.update('ostree', 'f1', 'ostree-2015.9-1', 's1', [])
+    db.commit()
+    # A run that exits without committing or rolling back
+    db.update('ostree', 'f2', 'ostree-2015.10-1', 's2', [])
+    db.close()
+    db = buildstate.BuildStateDB(path)
+    db.update('etcd', 'f3', 'etcd-2.2-1', 's3', [])
+    db.commit()
+    assert db.lookup('ostree')['fingerprint'] == 'f1'
+    assert db.lookup('etcd')['fingerprint'] == 'f3'
+
+
+def test_migrate(tmpdir):
+    path = str(tmpdir.join('buildstate.db'))
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE builds (pkgname TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, '
+                 'dirname TEXT NOT NULL, srpm_digest TEXT NOT NULL, files TEXT NOT NULL, '
+                 'duration REAL, updated REAL NOT NULL)')
+    conn.execute('INSERT INTO builds VALUES (?, ?, ?, ?, ?, ?, ?)',
+                 ('ostree', 'f1', 'ostree-2015.9-1', 's1', '[]', None, 0))
+    conn.commit()
+    conn.close()
+    db = buildstate.BuildStateDB(path)
+    assert db.lookup('ostree')['fingerprint'] == 'f1'
+    assert len(db) == 1
@@ -0,0 +1,59 @@
+import os
+import time
+
+import pytest
+
+compilercache = pytest.importorskip('rdgo.compilercache')
+
+
+def test_parse_size():
+    assert compilercache.parse_size('2G') == 2 * 1024 ** 3
+    assert compilercache.parse_size('512m') == 512 * 1024 ** 2
+    assert compilercache.parse_size('1.5K') == 1536
+    assert compilercache.parse_size(100) == 100
+    for size in ['', 'G', '2X', '-1G']:
+        with pytest.raises(ValueError):
+            compilercache.parse_size(size)
+
+
+def _write_stats(path, values):
+    with open(path, 'w') as f:
+        f.write('\n'.join(str(v) for v in values) + '\n')
+
+
+def test_read_stats(tmpdir):
+    cachedir = str(tmpdir)
+    assert compilercache.read_stats(cachedir) == {'hits': 0, 'misses': 0}
+    values = [0] * 30
+    values[compilercache._STATS_MISS] = 3
+    values[compilercache._STATS_HIT_DIRECT] = 5
+    values[compilercache._STATS_HIT_PREPROCESSED] = 2
+    for sub in ['0', '1']:
+        os.mkdir(cachedir + '/' + sub)
+        _write_stats(cachedir + '/' + sub + '/stats', values)
+    # Older ccache versions have fewer counters
+    os.mkdir(cachedir + '/2')
+    _write_stats(cachedir + '/2/stats', values[0:10])
+    os.mkdir(cachedir + '/3')
+    tmpdir.join('3', 'stats').write('garbage')
+    before = compilercache.read_stats(cachedir)
+    assert before == {'hits': 16, 'misses': 9}
+    values[compilercache._STATS_MISS] = 4
+    _write_stats(cachedir + '/0/stats', values)
+    assert compilercache.stats_delta(before, compilercache.read_stats(cachedir)) == {'hits': 0, 'misses': 1}
+
+
+def test_evict(tmpdir):
+    topdir = str(tmpdir)
+    now = time.time()
+    for (i, name) in enumerate(['old', 'kept', 'recent']):
+        path = compilercache.component_cachedir(topdir, name + '-1.0-1')
+        tmpdir.join(name, 'data').write('x' * 1000)
+        stamp = path + '/' + compilercache.STAMP
+        os.utime(stamp, (now - 100 + i, now - 100 + i))
+    os.utime(topdir + '/kept/' + compilercache.STAMP, (now - 1000, now - 1000))
+    assert compilercache.evict(topdir, 100000) == []
+    assert compilercache.evict(topdir, 2500, keep=['kept']) == ['old']
+    assert sorted(os.listdir(topdir)) == ['kept', 'recent']
+    assert compilercache.evict(topdir, 0, keep=['kept']) == ['recent']
+    assert compilercache.evict(str(tmpdir.join('nonexistent')), 0) == []
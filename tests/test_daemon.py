@@ -0,0 +1,67 @@
+import json
+import Queue
+
+import pytest
+
+task_daemon = pytest.importorskip('rdgo.task_daemon')
+
+
+class FakeRunner(object):
+    def __init__(self, fail=0):
+        self.calls = []
+        self.fail = fail
+
+    def execute(self, opts, resolver, only=None):
+        self.calls.append(only)
+        if len(self.calls) <= self.fail:
+            raise SystemExit(1)
+
+
+def _process(*queued, **kwargs):
+    jobs = Queue.Queue()
+    for pkgnames in queued:
+        jobs.put(pkgnames)
+    runner = FakeRunner(**kwargs)
+    task_daemon.TaskDaemon()._process_jobs(jobs, None, None, runner)
+    return runner.calls
+
+
+def test_process_jobs_coalesces():
+    assert _process(frozenset(['a']), frozenset(['b']), None) == [frozenset(['a', 'b'])]
+
+
+def test_process_jobs_everything():
+    # An empty set means all components
+    assert _process(frozenset(), None) == [None]
+    assert _process(frozenset(['a']), frozenset(), None) == [None]
+
+
+def test_process_jobs_failure():
+    # A failed run doesn't stop the daemon
+    jobs = Queue.Queue()
+    runner = FakeRunner(fail=1)
+    daemon = task_daemon.TaskDaemon()
+    jobs.put(frozenset(['a']))
+    jobs.put(None)
+    daemon._process_jobs(jobs, None, None, runner)
+    assert runner.calls == [frozenset(['a'])]
+    jobs.put(frozenset(['b']))
+    jobs.put(None)
+    daemon._process_jobs(jobs, None, None, runner)
+    assert runner.calls == [frozenset(['a']), frozenset(['b'])]
+
+
+def test_built_revisions(tmpdir):
+    daemon = task_daemon.TaskDaemon()
+    daemon.workdir = str(tmpdir)
+    daemon._snapshot_mtime = None
+    assert daemon._built_revisions() == {}
+    snapshot = {'components': [{'pkgname': 'foo', 'src': 'git://example.com/foo',
+                                'revision': 'a' * 40,
+                                'distgit': {'src': 'git://example.com/rpms/foo',
+                                            'revision': 'b' * 40}},
+                               {'pkgname': 'bar', 'distgit': {'src': 'git://example.com/rpms/bar',
+                                                              'revision': 'c' * 40}}]}
+    tmpdir.mkdir('snapshot').join('snapshot.json').write(json.dumps(snapshot))
+    assert daemon._built_revisions() == {'foo': ['a' * 40, 'b' * 40],
+                                         'bar': ['c' * 40]}
@@ -0,0 +1,74 @@
+from rdgo import depgraph
+
+
+def _index():
+    index = depgraph.DepIndex()
+    index.set('glib2', provides=['glib2', 'glib2-devel', 'libglib-2.0.so.0()(64bit)'],
+              buildrequires=['gettext'])
+    index.set('ostree', provides=['ostree', 'ostree-devel'],
+              buildrequires=['glib2-devel', 'libsoup-devel'])
+    index.set('rpm-ostree', provides=['rpm-ostree'],
+              buildrequires=['ostree-devel', 'glib2-devel'])
+    index.set('etcd', provides=['etcd'], buildrequires=['golang'])
+    return index
+
+
+def test_capability_name():
+    assert depgraph.capability_name('ostree-devel >= 2015.1') == 'ostree-devel'
+    assert depgraph.capability_name('pkgconfig(glib-2.0)') == 'pkgconfig(glib-2.0)'
+
+
+def test_dependencies():
+    deps = _index().dependencies(['glib2', 'ostree', 'rpm-ostree', 'etcd'])
+    assert deps == {'glib2': set(),
+                    'ostree': set(['glib2']),
+                    'rpm-ostree': set(['glib2', 'ostree']),
+                    'etcd': set()}
+
+
+def test_srpm_dependencies(monkeypatch):
+    headers = {'/s/glib2.src.rpm': {'%{NAME}\n': ['glib2'], '[%{REQUIRENAME}\n]': ['gettext']},
+               '/s/ostree.src.rpm': {'%{NAME}\n': ['ostree'],
+                                     '[%{REQUIRENAME}\n]': ['glib2-devel >= 2.40', 'rpmlib(x)']}}
+    monkeypatch.setattr(depgraph, '_rpm_query', lambda paths, qf: headers[paths[0]][qf])
+    assert depgraph.srpm_dependencies(sorted(headers)) == {'glib2.src.rpm': set(),
+                                                           'ostree.src.rpm': set(['glib2.src.rpm'])}
+
+
+def test_reverse_closure():
+    deps = _index().dependencies(['glib2', 'ostree', 'rpm-ostree', 'etcd'])
+    assert depgraph.reverse_closure(deps, ['glib2']) == set(['glib2', 'ostree', 'rpm-ostree'])
+    assert depgraph.reverse_closure(deps, ['ostree']) == set(['ostree', 'rpm-ostree'])
+    assert depgraph.reverse_closure(deps, ['etcd']) == set(['etcd'])
+
+
+def test_dependency_closure():
+    deps = _index().dependencies(['glib2', 'ostree', 'rpm-ostree', 'etcd'])
+    assert depgraph.dependency_closure(deps, 'rpm-ostree') == set(['glib2', 'ostree'])
+    assert depgraph.dependency_closure(deps, 'glib2') == set()
+    cycle = {'a': set(['b']), 'b': set(['a'])}
+    assert depgraph.dependency_closure(cycle, 'a') == set(['b'])
+
+
+def test_build_levels():
+    deps = {'a': set(), 'b': set(['a']), 'c': set(['b']), 'd': set()}
+    assert depgraph.build_levels(['c', 'b', 'a', 'd'], deps) == [['a', 'd'], ['b'], ['c']]
+    assert depgraph.toposort(['c', 'b', 'a', 'd'], deps) == ['a', 'd', 'b', 'c']
+
+
+def test_build_levels_cycle():
+    deps = {'a': set(['b']), 'b': set(['a']), 'c': set()}
+    assert depgraph.build_levels(['a', 'b', 'c'], deps) == [['c'], ['a', 'b']]
+
+
+def test_component_graph():
+    components = [{'pkgname': 'rpm-ostree', 'buildrequires': ['ostree-devel', 'gcc'],
+                   'packages': ['rpm-ostree']},
+                  {'pkgname': 'ostree', 'buildrequires': ['glib2-devel'],
+                   'packages': ['ostree', 'ostree-devel']},
+                  {'pkgname': 'glib2', 'buildrequires': [],
+                   'packages': ['glib2', 'glib2-devel']},
+                  {'pkgname': 'etcd'}]
+    graph, levels = depgraph.component_graph(components)
+    assert graph == {'rpm-ostree': ['ostree'], 'ostree': ['glib2'], 'glib2': [], 'etcd': []}
+    assert levels == [['glib2', 'etcd'], ['ostree'], ['rpm-ostree']]
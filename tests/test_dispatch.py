@@ -0,0 +1,235 @@
+import os
+import json
+import urllib2
+import threading
+
+import pytest
+
+dispatch = pytest.importorskip('rdgo.dispatch')
+
+
+class FakeBuilds(object):
+    """Stands in for mockchain on the worker side"""
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.order = []
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def __call__(self, job, tmpdir, config_cache_dir):
+        assert os.path.isdir(config_cache_dir)
+        srpm = urllib2.urlopen(job['srpm-url']).read()
+        name = dispatch.srpm_dirname(job['srpm'])
+        with self.lock:
+            self.order.append(name)
+            self.jobs.append(job)
+        resultdir = tmpdir + '/repo/' + name
+        os.makedirs(resultdir)
+        with open(resultdir + '/' + name + '.x86_64.rpm', 'w') as f:
+            f.write(srpm)
+        return name not in self.failing, resultdir
+
+
+def _pipe_worker(name, secret=None, worker_secret=None):
+    """A worker serving in a thread that requires @worker_secret,
+    whose requests are signed with @secret"""
+    (coord_r, worker_w) = os.pipe()
+    (worker_r, coord_w) = os.pipe()
+    thread = threading.Thread(target=dispatch.serve_connection,
+                              args=(os.fdopen(worker_r, 'rb'), os.fdopen(worker_w, 'wb')),
+                              kwargs={'secret': worker_secret})
+    thread.daemon = True
+    thread.start()
+    return dispatch.Worker(name, os.fdopen(coord_r, 'rb'), os.fdopen(coord_w, 'wb'),
+                           secret=secret)
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    builds = FakeBuilds()
+    monkeypatch.setattr(dispatch, '_build_one', builds)
+    monkeypatch.setattr(dispatch.mockchain, 'createrepo', lambda *args, **kwargs: ('', ''))
+    return builds
+
+
+def _srpms(tmpdir, names):
+    srpmdir = tmpdir.mkdir('srpms')
+    for name in names:
+        srpmdir.join(name + '.temp.src.rpm').write('srpm of ' + name)
+    return [str(srpmdir.join(name + '.temp.src.rpm')) for name in names]
+
+
+def test_dispatch(tmpdir, builds):
+    srpms = _srpms(tmpdir, ['a-1', 'b-1', 'c-1', 'd-1'])
+    deps = {'b-1.temp.src.rpm': set(['a-1.temp.src.rpm']),
+            'c-1.temp.src.rpm': set(['b-1.temp.src.rpm'])}
+    builddir = str(tmpdir.mkdir('build'))
+    workers = [_pipe_worker('w0'), _pipe_worker('w1')]
+    assert dispatch.dispatch_builds(srpms, workers, 'fedora-23-x86_64', builddir, deps=deps,
+                                    addrepos=['http://example.com/extra/'],
+                                    mock_options=['--with=tests']) == 0
+    assert sorted(builds.order) == ['a-1', 'b-1', 'c-1', 'd-1']
+    assert builds.order.index('a-1') < builds.order.index('b-1') < builds.order.index('c-1')
+    for name in builds.order:
+        with open(builddir + '/' + name + '/' + name + '.x86_64.rpm') as f:
+            assert f.read() == 'srpm of ' + name
+    for job in builds.jobs:
+        assert job['repos'][1:] == ['http://example.com/extra/']
+        assert job['mock-options'] == ['--with=tests']
+
+
+def test_dispatch_skips_dependents(tmpdir, builds, monkeypatch):
+    builds.failing.add('a-1')
+    srpms = _srpms(tmpdir, ['a-1', 'b-1', 'c-1'])
+    # Without deps, they are guessed from the SRPMs
+    monkeypatch.setattr(dispatch.depgraph, 'srpm_dependencies',
+                        lambda paths: {'b-1.temp.src.rpm': set(['a-1.temp.src.rpm'])})
+    builddir = str(tmpdir.mkdir('build'))
+    assert dispatch.dispatch_builds(srpms, [_pipe_worker('w0')], 'fedora-23-x86_64', builddir) == 2
+    # a-1 is retried since c-1 succeeded
+    assert builds.order == ['a-1', 'c-1', 'a-1']
+    with open(builddir + '/b-1/status.json') as f:
+        assert json.load(f)['blocked-by'] == 'a-1.temp.src.rpm'
+
+
+def test_dispatch_signed(tmpdir, builds):
+    srpms = _srpms(tmpdir, ['a-1', 'b-1'])
+    builddir = str(tmpdir.mkdir('build'))
+    workers = [_pipe_worker('w0', secret='s3cret', worker_secret='s3cret')]
+    assert dispatch.dispatch_builds(srpms, workers, 'fedora-23-x86_64', builddir, deps={}) == 0
+    assert sorted(builds.order) == ['a-1', 'b-1']
+
+
+def test_dispatch_bad_signature(tmpdir, builds):
+    srpms = _srpms(tmpdir, ['a-1'])
+    builddir = str(tmpdir.mkdir('build'))
+    workers = [_pipe_worker('w0', secret='other', worker_secret='s3cret')]
+    assert dispatch.dispatch_builds(srpms, workers, 'fedora-23-x86_64', builddir, deps={}) == 2
+    # Nothing was run
+    assert builds.order == []
+
+
+def test_worker_requires_secret(builds):
+    with pytest.raises(IOError):
+        _pipe_worker('w0', worker_secret='s3cret')
+
+
+def test_job_signature():
+    job = {'type': 'build', 'srpm': 'a-1.temp.src.rpm', 'root-cfg': "config_opts['root'] = 'a'\n"}
+    signature = dispatch.job_signature('s3cret', 'abcd', 0, job)
+    signed = dict(job, hmac=signature)
+    assert dispatch.job_signature('s3cret', 'abcd', 0, signed) == signature
+    # Not valid for another request, connection or secret
+    assert dispatch.job_signature('s3cret', 'abcd', 1, job) != signature
+    assert dispatch.job_signature('s3cret', 'abce', 0, job) != signature
+    assert dispatch.job_signature('other', 'abcd', 0, job) != signature
+    assert dispatch.job_signature('s3cret', 'abcd', 0, dict(job, root='b')) != signature
+
+
+def test_serve_tcp_requires_secret():
+    with pytest.raises(SystemExit):
+        dispatch.serve_tcp('0.0.0.0', 0)
+
+
+def _drain(scheduler, failing=()):
+    """Run everything @scheduler hands out, one at a time"""
+    order = []
+    while True:
+        pkg = scheduler.next_job()
+        if pkg is None:
+            return order
+        order.append(pkg)
+        scheduler.complete(pkg, pkg not in failing or order.count(pkg) > 1)
+
+
+def test_scheduler_serial():
+    scheduler = dispatch.BuildScheduler(['c', 'a', 'b'])
+    assert _drain(scheduler) == ['c', 'a', 'b']
+    assert scheduler.succeeded == ['c', 'a', 'b']
+    assert scheduler.failed == []
+
+
+def test_scheduler_parallel():
+    scheduler = dispatch.BuildScheduler(['a', 'b', 'c'], deps={'c': set(['a'])})
+    assert scheduler.next_job() == 'a'
+    # b doesn't have to wait for a
+    assert scheduler.next_job() == 'b'
+    scheduler.complete('b', True)
+    scheduler.complete('a', True)
+    assert scheduler.next_job() == 'c'
+    scheduler.complete('c', True)
+    assert scheduler.next_job() is None
+
+
+def test_scheduler_retry_and_skip():
+    scheduler = dispatch.BuildScheduler(['a', 'b', 'c', 'd'], deps={'b': set(['a']), 'd': set(['b'])})
+    # a fails the first time, skipping b and d; they are retried once
+    # it succeeds
+    assert _drain(scheduler, failing=['a']) == ['a', 'c', 'a', 'b', 'd']
+    assert scheduler.succeeded == ['c', 'a', 'b', 'd']
+    assert scheduler.failed == []
+    assert scheduler.skipped == {}
+
+
+def test_scheduler_skip_persistent_failure():
+    scheduler = dispatch.BuildScheduler(['a', 'b', 'c'], deps={'b': set(['a'])})
+    order = []
+    while True:
+        pkg = scheduler.next_job()
+        if pkg is None:
+            break
+        order.append(pkg)
+        scheduler.complete(pkg, pkg != 'a')
+    # b is requeued with a, and skipped again
+    assert order == ['a', 'c', 'a']
+    assert scheduler.failed == ['a', 'b']
+    assert scheduler.skipped == {'b': (['a'], 'a')}
+
+
+def test_scheduler_no_progress():
+    scheduler = dispatch.BuildScheduler(['a', 'b'], deps={'b': set(['a'])})
+    order = []
+    while True:
+        pkg = scheduler.next_job()
+        if pkg is None:
+            break
+        order.append(pkg)
+        scheduler.complete(pkg, False)
+    assert order == ['a']
+    assert scheduler.failed == ['a', 'b']
+
+
+def test_scheduler_cycle():
+    scheduler = dispatch.BuildScheduler(['a', 'b'], deps={'a': set(['b']), 'b': set(['a'])})
+    assert _drain(scheduler) == ['a', 'b']
+
+
+def test_scheduler_streaming():
+    scheduler = dispatch.BuildScheduler([], streaming=True)
+    scheduler.add('b', ['a'])
+    scheduler.add('c', [])
+    assert scheduler.next_job() == 'c'
+    # a is neither added nor provided yet, so b has to wait for it
+    done = []
+    def run():
+        done.append(scheduler.next_job())
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(0.2)
+    assert done == []
+    scheduler.provide('a')
+    thread.join(5)
+    assert done == ['b']
+    scheduler.complete('b', True)
+    scheduler.complete('c', True)
+    scheduler.close()
+    assert scheduler.next_job() is None
+    assert scheduler.succeeded == ['b', 'c']
+
+
+def test_scheduler_abort():
+    scheduler = dispatch.BuildScheduler(['a', 'b'])
+    assert scheduler.next_job() == 'a'
+    scheduler.abort()
+    assert scheduler.next_job() is None
+    assert scheduler.failed == ['b']
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+logarchive = pytest.importorskip('rdgo.logarchive')
+
+
+def _build_log():
+    lines = ['line {0}\n'.format(i) for i in range(200000)]
+    offset = sum(len(l) for l in lines)
+    lines.append('error: Bad exit status from /var/tmp/rpm-tmp.x (%build)\n')
+    lines.extend(['after {0}\n'.format(i) for i in range(20)])
+    return ''.join(lines), offset
+
+
+def test_store_dedup_and_read(tmpdir, monkeypatch):
+    monkeypatch.setattr(logarchive, 'CHUNK_SIZE', 64 * 1024)
+    text, _ = _build_log()
+    tmpdir.join('build.log').write(text)
+    archive = logarchive.LogArchive(str(tmpdir.join('archive')))
+    digest = archive.store(str(tmpdir.join('build.log')))
+    assert archive.store(str(tmpdir.join('build.log'))) == digest
+    assert archive.size(digest) == len(text)
+    assert archive.read(digest) == text
+    assert archive.read(digest, 100000, 300000) == text[100000:300000]
+
+
+def test_failing_section(tmpdir):
+    text, offset = _build_log()
+    tmpdir.join('build.log').write(text)
+    archive = logarchive.LogArchive(str(tmpdir.join('archive')))
+    status = {'status': 'build-failed',
+              'errors': [{'offset': offset, 'line': 'error: Bad exit status'}]}
+    logs = {'build.log': archive.store(str(tmpdir.join('build.log')))}
+    runid = archive.new_run_id()
+    archive.add_run(runid, {'foo-1.0-1.fc22': {'status': status, 'logs': logs}})
+    (found_runid, dname, result) = archive.find('foo')
+    assert (found_runid, dname) == (runid, 'foo-1.0-1.fc22')
+    lines = archive.failing_section(result, before=2, after=1).splitlines()
+    assert lines == ['line 199998', 'line 199999',
+                     'error: Bad exit status from /var/tmp/rpm-tmp.x (%build)',
+                     'after 0']
+    assert archive.find('bar') is None
+
+
+def test_read_after_chunk_size_change(tmpdir, monkeypatch):
+    monkeypatch.setattr(logarchive, 'CHUNK_SIZE', 64 * 1024)
+    text, _ = _build_log()
+    tmpdir.join('build.log').write(text)
+    archive = logarchive.LogArchive(str(tmpdir.join('archive')))
+    digest = archive.store(str(tmpdir.join('build.log')))
+    monkeypatch.setattr(logarchive, 'CHUNK_SIZE', 16 * 1024)
+    assert archive.read(digest, 200000, 300000) == text[200000:300000]
+    # Archives from before the chunk lengths were recorded
+    meta = archive._chunks(digest)
+    meta['chunks'] = [chunk[0:3] for chunk in meta['chunks']]
+    logarchive._write_json(archive._objpath(digest) + '.chunks', meta)
+    assert archive.read(digest, 200000, 300000) == text[200000:300000]
+    assert archive.read(digest, len(text) - 10) == text[-10:]
+
+
+def test_index_bounded(tmpdir, monkeypatch):
+    monkeypatch.setattr(logarchive, 'INDEX_RUNS', 3)
+    archive = logarchive.LogArchive(str(tmpdir))
+    for i in range(5):
+        archive.add_run('run{0}'.format(i), {'foo-1.0-{0}'.format(i): {'status': {}, 'logs': {}},
+                                             'bar-1.0-1': {'status': {}, 'logs': {}}})
+    index = archive.load_index()
+    assert index['foo'] == [['run{0}'.format(i), 'foo-1.0-{0}'.format(i)] for i in range(2, 5)]
+    assert len(index['bar']) == 3
+    assert archive.find('foo')[0:2] == ('run4', 'foo-1.0-4')
+
+
+def test_prune(tmpdir):
+    archive = logarchive.LogArchive(str(tmpdir.join('archive')), keep_runs=2)
+    digests = []
+    for i in range(4):
+        tmpdir.join('build.log').write('shared\n')
+        tmpdir.join('root.log').write('run {0}\n'.format(i))
+        logs = {'build.log': archive.store(str(tmpdir.join('build.log'))),
+                'root.log': archive.store(str(tmpdir.join('root.log')))}
+        digests.append(logs['root.log'])
+        archive.add_run('20261018.1200{0:02d}'.format(i), {'foo-1.0-{0}'.format(i): {'status': {}, 'logs': logs}})
+    assert archive.run_ids() == ['20261018.120002', '20261018.120003']
+    assert [e[0] for e in archive.load_index()['foo']] == archive.run_ids()
+    for digest in digests[0:2]:
+        assert not os.path.exists(archive._objpath(digest) + '.zst')
+        assert not os.path.exists(archive._objpath(digest) + '.chunks')
+    for digest in digests[2:]:
+        assert archive.read(digest) == 'run {0}\n'.format(digests.index(digest))
+    (runid, _, result) = archive.find('foo')
+    assert runid == '20261018.120003'
+    assert archive.read(result['logs']['build.log']) == 'shared\n'
+
+
+def test_run_ids_order(tmpdir):
+    archive = logarchive.LogArchive(str(tmpdir))
+    for runid in ['20261018.120000.10', '20261018.120000', '20261018.120000.9', '20261017.235959']:
+        archive.add_run(runid, {})
+    assert archive.run_ids() == ['20261017.235959', '20261018.120000',
+                                 '20261018.120000.9', '20261018.120000.10']
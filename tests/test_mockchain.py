@@ -0,0 +1,133 @@
+import os
+import json
+import time
+
+import pytest
+
+mockchain = pytest.importorskip('rdgo.mockchain')
+
+
+@pytest.fixture
+def configdir(tmpdir, monkeypatch):
+    configdir = tmpdir.mkdir('etc-mock')
+    for fn in mockchain.MockConfigBuilder.support_files:
+        configdir.join(fn).write(fn)
+    monkeypatch.setattr(mockchain, 'mockconfig_path', str(configdir))
+    return configdir
+
+
+def _builder(baseurl):
+    builder = mockchain.MockConfigBuilder({'chroot_name': 'fedora-23-x86_64',
+                                           'yum.conf': '[main]\n'})
+    builder.add_repo(baseurl, 'local_build_repo')
+    return builder
+
+
+def test_config_write_reuse(tmpdir, configdir):
+    topdir = str(tmpdir.join('configs'))
+    path = _builder('file:///a').write(topdir)
+    assert sorted(os.listdir(path)) == ['fedora-23-x86_64.cfg', 'logging.ini', 'site-defaults.cfg']
+    assert _builder('file:///a').write(topdir) == path
+    assert _builder('file:///b').write(topdir) != path
+    assert len(os.listdir(topdir)) == 2
+
+
+def test_evict_configs(tmpdir, configdir):
+    topdir = str(tmpdir.join('configs'))
+    old = _builder('file:///a').write(topdir)
+    current = _builder('file:///b').write(topdir)
+    stale = time.time() - mockchain.CONFIG_MAX_AGE - 60
+    os.utime(old, (stale, stale))
+    os.utime(current, (stale, stale))
+    assert mockchain.evict_configs(topdir, current) == [old]
+    assert os.listdir(topdir) == [os.path.basename(current)]
+    # Reusing a config marks it as used
+    assert _builder('file:///b').write(topdir) == current
+    assert mockchain.evict_configs(topdir, None) == []
+
+
+def test_private_dir(tmpdir):
+    path = str(tmpdir.join('private'))
+    assert mockchain.private_dir(path) == path
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    assert mockchain.private_dir(path) == path
+    os.chmod(path, 0o1777)
+    with pytest.raises(OSError):
+        mockchain.private_dir(path)
+
+
+def test_find_blockers():
+    deps = {'c.src.rpm': ['a.src.rpm', 'b.src.rpm'], 'b.src.rpm': ['a.src.rpm']}
+    assert mockchain.find_blockers(deps, '/srpms/c.src.rpm', {}) == ([], None)
+    assert mockchain.find_blockers(deps, '/srpms/a.src.rpm', {'b.src.rpm': None}) == ([], None)
+    # b was skipped because a failed
+    unavailable = {'a.src.rpm': None, 'b.src.rpm': 'a.src.rpm'}
+    assert mockchain.find_blockers(deps, '/srpms/c.src.rpm', unavailable) == (['a.src.rpm', 'b.src.rpm'],
+                                                                             'a.src.rpm')
+    assert mockchain.find_blockers(deps, '/srpms/c.src.rpm', {'b.src.rpm': 'a.src.rpm'}) == (['b.src.rpm'],
+                                                                                            'a.src.rpm')
+
+
+def test_mark_skipped(tmpdir):
+    resdir = str(tmpdir.join('c-1.0-1'))
+    mockchain.mark_skipped(resdir, ['b.src.rpm'], 'a.src.rpm')
+    with open(resdir + '/status.json') as f:
+        assert json.load(f) == {'status': 'skipped-dependency-failed',
+                                'blocked-by': 'a.src.rpm',
+                                'blocked-by-direct': ['b.src.rpm']}
+
+
+def test_createrepo(tmpdir, monkeypatch):
+    commands = []
+    class Popen(object):
+        def __init__(self, comm, **kwargs):
+            commands.append(comm)
+        def communicate(self):
+            return '', ''
+    monkeypatch.setattr(mockchain.subprocess, 'Popen', Popen)
+    repo = tmpdir.mkdir('repo')
+    mockchain.createrepo(str(repo), cachedir='/cache', options=['--workers', '4', '--zck'])
+    repo.mkdir('repodata').join('repomd.xml').write('')
+    mockchain.createrepo(str(repo), options=['--compress-type', 'xz'])
+    assert commands == [['/usr/bin/createrepo_c', '--cachedir', '/cache', '--workers', '4', '--zck', str(repo)],
+                        ['/usr/bin/createrepo_c', '--update', '--compress-type', 'xz', str(repo)]]
+
+
+def _recurse(tmpdir, monkeypatch, attempts, failing):
+    """Build a-1, b-1 (which depends on a-1) and c-1 with mockchain
+    --recurse; @failing says whether an attempt fails"""
+    def do_build(opts, cfg, pkg):
+        name = os.path.basename(pkg)
+        attempts.append(name)
+        return (0 if failing(name, attempts.count(name)) else 1), None, '', ''
+    monkeypatch.setattr(mockchain, 'do_build', do_build)
+    monkeypatch.setattr(mockchain, 'do_clean_root', lambda opts, cfg, pkg: None)
+    monkeypatch.setattr(mockchain, 'createrepo', lambda *args, **kwargs: ('', ''))
+    monkeypatch.setattr(mockchain.mockbuild.util, 'load_config',
+                        lambda *args: {'chroot_name': 'fedora-23-x86_64', 'yum.conf': '[main]\n'})
+    monkeypatch.setattr(mockchain.MockConfigBuilder, 'write', lambda self, topdir: topdir)
+    depsfile = tmpdir.join('deps.json')
+    depsfile.write(json.dumps({'b-1.temp.src.rpm': ['a-1.temp.src.rpm']}))
+    srpms = [str(tmpdir.join(name + '.temp.src.rpm')) for name in ['a-1', 'b-1', 'c-1']]
+    return mockchain.main(['mockchain', '--recurse', '-r', 'fedora-23-x86_64', '-l', str(tmpdir.join('repo')),
+                           '--tmp_prefix', 'test', '--config-cache-dir', str(tmpdir),
+                           '--deps', str(depsfile)] + srpms)
+
+
+def test_recurse_requeues_skipped(tmpdir, monkeypatch):
+    # a fails the first time only, and b is built once it succeeds
+    attempts = []
+    rc = _recurse(tmpdir, monkeypatch, attempts,
+                  lambda name, count: name == 'a-1.temp.src.rpm' and count == 1)
+    assert rc == 0
+    assert attempts == ['a-1.temp.src.rpm', 'c-1.temp.src.rpm', 'a-1.temp.src.rpm', 'b-1.temp.src.rpm']
+
+
+def test_recurse_keeps_skipped(tmpdir, monkeypatch):
+    # a always fails, so b is never attempted
+    attempts = []
+    rc = _recurse(tmpdir, monkeypatch, attempts, lambda name, count: name == 'a-1.temp.src.rpm')
+    assert rc == 2
+    assert attempts == ['a-1.temp.src.rpm', 'c-1.temp.src.rpm', 'a-1.temp.src.rpm']
+    with open(str(tmpdir.join('repo', 'b-1', 'status.json'))) as f:
+        assert json.load(f)['status'] == 'skipped-dependency-failed'
@@ -0,0 +1,96 @@
+import hmac
+import json
+import hashlib
+import urllib
+import urllib2
+
+from rdgo import push
+
+
+COMPONENTS = [
+    {'pkgname': 'rpm-ostree', 'src': 'https://github.com/projectatomic/rpm-ostree',
+     'distgit': {'src': 'git://pkgs.fedoraproject.org/rpm-ostree'}},
+    {'pkgname': 'etcd', 'src': 'https://github.com/coreos/etcd',
+     'distgit': {'src': 'git://pkgs.fedoraproject.org/etcd'}},
+    {'pkgname': 'ostree', 'spec': 'internal', 'src': 'git://git.gnome.org/ostree'},
+]
+
+
+def test_normalize_url():
+    expected = 'github.com/coreos/etcd'
+    for url in ['https://github.com/coreos/etcd', 'https://GitHub.com/coreos/etcd.git/',
+                'git://github.com/coreos/etcd.git', 'git@github.com:coreos/etcd.git',
+                'ssh://git@github.com:22/coreos/etcd']:
+        assert push.normalize_url(url) == expected
+
+
+def test_components_for_urls():
+    assert push.components_for_urls(COMPONENTS, ['git@github.com:coreos/etcd.git']) == ['etcd']
+    assert push.components_for_urls(COMPONENTS, ['ssh://pkgs.fedoraproject.org/rpm-ostree']) == ['rpm-ostree']
+    assert push.components_for_urls(COMPONENTS, ['https://example.com/other']) == []
+
+
+def _post(listener, data, headers={}):
+    req = urllib2.Request('http://{0}:{1}/'.format(*listener.address), data=data, headers=headers)
+    resp = urllib2.urlopen(req)
+    return resp.getcode(), json.load(resp)
+
+
+def test_listener():
+    received = []
+    def callback(urls):
+        received.append(urls)
+        return push.components_for_urls(COMPONENTS, urls)
+    listener = push.PushListener('localhost', 0, callback)
+    listener.start()
+    try:
+        github = {'ref': 'refs/heads/master',
+                  'repository': {'clone_url': 'https://github.com/coreos/etcd.git',
+                                 'ssh_url': 'git@github.com:coreos/etcd.git'}}
+        assert _post(listener, json.dumps(github)) == (202, {'components': ['etcd']})
+        form = urllib.urlencode({'payload': json.dumps(github)})
+        assert _post(listener, form, {'Content-Type': 'application/x-www-form-urlencoded'}) == \
+            (202, {'components': ['etcd']})
+        generic = {'url': 'git://git.gnome.org/ostree'}
+        assert _post(listener, json.dumps(generic)) == (202, {'components': ['ostree']})
+        try:
+            _post(listener, 'not json')
+            assert False
+        except urllib2.HTTPError as e:
+            assert e.code == 400
+        assert len(received) == 3
+    finally:
+        listener.stop()
+
+
+def test_verify_signature():
+    body = '{"url": "git://git.gnome.org/ostree"}'
+    sha256 = hmac.new('s3cret', body, hashlib.sha256).hexdigest()
+    sha1 = hmac.new('s3cret', body, hashlib.sha1).hexdigest()
+    assert push.verify_signature('s3cret', body, {'X-Hub-Signature-256': 'sha256=' + sha256})
+    assert push.verify_signature('s3cret', body, {'X-Hub-Signature': 'sha1=' + sha1})
+    assert push.verify_signature('s3cret', body, {'X-Gitea-Signature': sha256})
+    assert push.verify_signature('s3cret', body, {'X-Gitlab-Token': 's3cret'})
+    assert not push.verify_signature('s3cret', body + ' ', {'X-Hub-Signature-256': 'sha256=' + sha256})
+    assert not push.verify_signature('other', body, {'X-Hub-Signature': 'sha1=' + sha1})
+    assert not push.verify_signature('s3cret', body, {'X-Gitlab-Token': 'other'})
+    assert not push.verify_signature('s3cret', body, {})
+
+
+def test_listener_secret():
+    listener = push.PushListener('localhost', 0, lambda urls: push.components_for_urls(COMPONENTS, urls),
+                                 secret='s3cret')
+    listener.start()
+    try:
+        body = json.dumps({'url': 'git://git.gnome.org/ostree'})
+        signature = 'sha256=' + hmac.new('s3cret', body, hashlib.sha256).hexdigest()
+        assert _post(listener, body, {'X-Hub-Signature-256': signature}) == \
+            (202, {'components': ['ostree']})
+        for headers in [{}, {'X-Hub-Signature-256': 'sha256=' + '0' * 64}]:
+            try:
+                _post(listener, body, headers)
+                assert False
+            except urllib2.HTTPError as e:
+                assert e.code == 403
+    finally:
+        listener.stop()
@@ -0,0 +1,30 @@
+import pytest
+
+from rdgo import speccheck
+
+
+def test_check_spec():
+    specfile = pytest.importorskip('rdgo.specfile')
+    spec = specfile.Spec(fn='foo.spec', txt='''Name: foo
+BuildArch: noarch
+Patch1: fix.patch
+
+%prep
+%setup -q
+git am %{patches}
+%patch1 -p1
+%patch2 -p1
+''')
+    assert speccheck.check_spec(spec) == [
+        "No Source0 or Source tag",
+        "BuildArch comes before the Source and Patch tags, but patches are applied with git am",
+        "%patch2 has no Patch2 tag"]
+    spec = specfile.Spec(fn='foo.spec', txt='Name: foo\nSource: foo.tar.gz\n%setup -q\n')
+    assert speccheck.check_spec(spec) == []
+
+
+def test_check_patch_files():
+    metadata = {'patches': [[1, 'fix.patch'], [2, 'https://example.com/more.patch']]}
+    assert speccheck.check_patch_files(metadata, ['foo.spec', 'fix.patch', 'more.patch']) == []
+    assert speccheck.check_patch_files(metadata, ['foo.spec', 'more.patch']) == [
+        "Patch1 file fix.patch is not in the repository"]
@@ -0,0 +1,137 @@
+import re
+
+import pytest
+
+specfile = pytest.importorskip('rdgo.specfile')
+
+SPEC = '''Name: foo
+Version: 1.0
+Release:\t3%{?dist}
+Summary: Foo
+Source0: foo-1.0.tar.gz
+
+Patch0001: 0001-fix.patch
+
+Patch0002: 0002-more.patch
+
+BuildRequires: gcc
+
+%description
+Foo
+
+%prep
+%setup -q -n foo-%{version}
+%patch0001 -p1
+%patch0002 -p1
+
+%build
+make
+
+%changelog
+* Mon Jan 04 2016 Someone <someone@example.com> 1.0-3
+- Rebuilt
+'''
+
+EXPECTED = '''Name: foo
+Version: 2016.1
+Release:\t1.git%{?dist}
+Summary: Foo
+Source0: foo-2016.1.tar.gz
+
+BuildRequires: gcc
+
+%description
+Foo
+
+%prep
+%setup -q foo-%{version}  -n foo-2016.1
+
+%build
+make
+
+'''
+
+
+def test_resolve_edits():
+    spec = specfile.Spec(fn='foo.spec', txt=SPEC)
+    assert spec.get_tag('Source0', allow_empty=True) == 'foo-1.0.tar.gz'
+    spec.set_tag('Source0', 'foo-2016.1.tar.gz')
+    spec.set_tag('Version', '2016.1')
+    spec.set_setup_dirname('foo-2016.1')
+    spec.set_tag('Release', '1.git%{?dist}')
+    spec.delete_changelog()
+    spec.wipe_patches()
+    assert spec.txt == EXPECTED
+    assert spec.get_tag('Release') == '1.git%{?dist}'
+
+
+def test_missing_tag_is_prepended():
+    spec = specfile.Spec(fn='foo.spec', txt=SPEC)
+    spec.set_tag('Epoch', '1')
+    assert spec.txt == 'Epoch:1\n' + SPEC
+    assert spec.get_tag('Epoch', allow_empty=True) is None
+    spec.set_tag('Version', '2')
+    assert spec.get_tag('Version') == '2'
+
+
+def test_setup_dirname_other_source():
+    spec = specfile.Spec(fn='foo.spec', txt='%setup -q -b 0\n%setup -q -T -b 1')
+    spec.set_setup_dirname('bar', srcn=1)
+    assert spec.txt == '%setup -q -b 0\n%setup -q -T -n bar\n'
+    spec = specfile.Spec(fn='foo.spec', txt='%setup -q -b 0\n')
+    with pytest.raises(Exception):
+        spec.set_setup_dirname('baz', srcn=1)
+
+
+class FakeRpm(object):
+    def __init__(self):
+        self.parsed = []
+        self.macros = {}
+
+    def addMacro(self, name, value):
+        self.macros[name] = value
+
+    def delMacro(self, name):
+        del self.macros[name]
+
+    def spec(self, fn):
+        self.parsed.append(fn)
+        with open(fn) as f:
+            self.macros['version'] = f.read().split('Version: ')[1].split('\n')[0]
+        return object()
+
+    def expandMacro(self, macro):
+        return re.sub(r'%\{\??(\w+)\}', lambda m: self.macros.get(m.group(1), ''), macro)
+
+
+def test_parse_cache(tmpdir, monkeypatch):
+    fake = FakeRpm()
+    monkeypatch.setattr(specfile, 'rpm', fake)
+    monkeypatch.setattr(specfile, '_parse_cache', specfile.collections.OrderedDict())
+    a = tmpdir.join('a.spec')
+    a.write('Version: 1.0\nSource0: a-%{version}.tar.gz\nRelease: 1%{?dist}\n')
+    b = tmpdir.join('b.spec')
+    b.write('Version: 2.0\nSource0: b-%{version}.tar.gz\nRelease: 1%{?dist}\n')
+    tags = specfile.Spec(str(a)).get_tags(['Source0', 'Release'], expand_macros=True)
+    assert tags == {'Source0': 'a-1.0.tar.gz', 'Release': '1'}
+    assert fake.parsed == [str(a)]
+    # Same content: no parse, even through another Spec
+    assert specfile.Spec(str(a)).expand_macro('a-%{version}.tar.gz') == 'a-1.0.tar.gz'
+    assert fake.parsed == [str(a)]
+    assert specfile.Spec(str(b)).expand_macro('%{version}') == '2.0'
+    # Expanding something new needs a's macros back
+    assert specfile.Spec(str(a)).expand_macro('%{version}') == '1.0'
+    assert fake.parsed == [str(a), str(b), str(a)]
+
+
+def test_parse_cache_macro_context(tmpdir, monkeypatch):
+    fake = FakeRpm()
+    monkeypatch.setattr(specfile, 'rpm', fake)
+    monkeypatch.setattr(specfile, '_parse_cache', specfile.collections.OrderedDict())
+    monkeypatch.setattr(specfile, '_context_macros', [()])
+    a = tmpdir.join('a.spec')
+    a.write('Version: 1.0\n')
+    assert specfile.Spec(str(a), macros={'dist': '.el7'}).expand_macro('%{dist}') == '.el7'
+    assert specfile.Spec(str(a)).expand_macro('%{?dist}') == ''
+    assert 'dist' not in fake.macros
+    assert len(fake.parsed) == 2
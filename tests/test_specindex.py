@@ -0,0 +1,53 @@
+import pytest
+
+specindex = pytest.importorskip('rdgo.specindex')
+
+
+class FakeMirror(object):
+    def __init__(self, path):
+        self.mirrordir = path
+        self.tmpdir = path + '/_tmp'
+        self.shown = []
+
+    def _get_mirrordir(self, url):
+        return self.mirrordir + '/' + url.split('://', 1)[1]
+
+    def list_files(self, url, rev):
+        return ['foo.spec', 'sources', 'fix.patch']
+
+    def read_file(self, url, rev, path):
+        self.shown.append((url, rev, path))
+        return 'Name: foo\n'
+
+
+def test_parsed_once_per_revision(tmpdir, monkeypatch):
+    parsed = []
+    def spec_metadata(path, macros=None):
+        parsed.append(open(path).read())
+        return {'name': 'foo', 'buildrequires': ['gcc']}
+    monkeypatch.setattr(specindex, 'spec_metadata', spec_metadata)
+    mirror = FakeMirror(str(tmpdir))
+    tmpdir.mkdir('_tmp')
+    index = specindex.SpecIndex(mirror)
+    url = 'https://example.com/foo'
+    result = index.lookup(url, 'a' * 40)
+    assert result == {'name': 'foo', 'buildrequires': ['gcc'], 'spec': 'foo.spec'}
+    assert index.lookup(url, 'a' * 40) == result
+    # A new SpecIndex reads what was stored
+    assert specindex.SpecIndex(mirror).lookup(url, 'a' * 40) == result
+    assert parsed == ['Name: foo\n']
+    index.lookup(url, 'b' * 40)
+    assert len(parsed) == 2
+    assert tmpdir.join('_tmp').listdir() == []
+
+
+def test_parse_error_is_recorded(tmpdir, monkeypatch):
+    def spec_metadata(path, macros=None):
+        raise Exception("Error parsing spec")
+    monkeypatch.setattr(specindex, 'spec_metadata', spec_metadata)
+    mirror = FakeMirror(str(tmpdir))
+    tmpdir.mkdir('_tmp')
+    result = specindex.SpecIndex(mirror).lookup('https://example.com/foo', 'a' * 40, 'foo.spec')
+    assert result['error'] == "Error parsing spec"
+    assert specindex.SpecIndex(mirror).lookup('https://example.com/foo', 'a' * 40, 'foo.spec') == result
+    assert len(mirror.shown) == 1
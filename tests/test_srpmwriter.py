@@ -0,0 +1,185 @@
+import os
+import gzip
+import struct
+import StringIO
+import hashlib
+import subprocess
+from distutils.spawn import find_executable
+
+import pytest
+
+srpmwriter = pytest.importorskip('rdgo.srpmwriter')
+
+
+def _source_header():
+    h = srpmwriter.Header()
+    h.set(1000, srpmwriter._STRING, 'foo')
+    h.set(1001, srpmwriter._STRING, '1.0')
+    h.set(1002, srpmwriter._STRING, '1.git.abcdef')
+    h.set(1004, srpmwriter._I18NSTRING, ['Foo'])
+    h.set(1049, srpmwriter._STRING_ARRAY, ['gcc', 'glib2-devel'])
+    h.set(1048, srpmwriter._INT32, [0, 12])
+    h.set(1050, srpmwriter._STRING_ARRAY, ['', '2.40'])
+    return h
+
+
+def test_header_roundtrip():
+    h = _source_header()
+    h.set(1030, srpmwriter._INT16, [0100644, 0100755, 0])
+    blob = h.unload(srpmwriter._HEADERIMMUTABLE)
+    # An immutable region comes first
+    assert struct.unpack('!IIiI', blob[16:32]) == (63, 7, len(blob) - 16 - 16 - 16 * 9, 16)
+    loaded = srpmwriter.Header.load(blob)
+    assert loaded.entries == h.entries
+    assert loaded.get(1000) == 'foo'
+    assert loaded.get(1049) == ['gcc', 'glib2-devel']
+    assert loaded.get(1048) == [0, 12]
+    assert loaded.get(1030) == [0100644, 0100755, 0]
+
+
+class FakeSourceHeader(object):
+    def unload(self):
+        return _source_header().unload(srpmwriter._HEADERIMMUTABLE)[8:]
+
+
+class FakeRpmSpec(object):
+    sourceHeader = FakeSourceHeader()
+    sources = [('https://example.com/foo-1.0.tar.gz', 0, 1),
+               ('0001-fix.patch', 1, 2)]
+
+
+class FakeSpec(object):
+    def __init__(self, fn):
+        self.fn = fn
+        self.rpmspec = FakeRpmSpec()
+
+    def expand_macro(self, macro):
+        assert macro == '%{?_source_filedigest_algorithm}'
+        return '8'
+
+
+def _read_header(f):
+    data = f.read(16)
+    assert data[0:8] == srpmwriter._HEADER_MAGIC
+    (il, dl) = struct.unpack('!II', data[8:16])
+    data += f.read(il * 16 + dl)
+    return data, srpmwriter.Header.load(data)
+
+
+def _read_cpio(data):
+    files = {}
+    offset = 0
+    while True:
+        fields = [int(data[offset + 6 + i * 8:offset + 14 + i * 8], 16) for i in range(13)]
+        (size, namesize) = (fields[6], fields[11])
+        offset += 110
+        name = data[offset:offset + namesize - 1]
+        offset += namesize
+        offset += -offset % 4
+        if name == 'TRAILER!!!':
+            return files
+        files[name] = data[offset:offset + size]
+        offset += size
+        offset += -offset % 4
+
+
+def test_write_srpm(tmpdir, monkeypatch):
+    monkeypatch.setattr(srpmwriter, 'rpm', type('rpm', (object,), {'__version__': '4.11.3'}))
+    contents = {'foo.spec': 'Name: foo\n',
+                'foo-1.0.tar.gz': 'tarball' * 1000,
+                '0001-fix.patch': 'diff\n'}
+    for name, data in contents.items():
+        tmpdir.join(name).write(data)
+    destdir = tmpdir.mkdir('out')
+    path = srpmwriter.write_srpm(FakeSpec(str(tmpdir.join('foo.spec'))), str(destdir))
+    assert path == str(destdir) + '/foo-1.0-1.git.abcdef.src.rpm'
+    assert os.listdir(str(destdir)) == ['foo-1.0-1.git.abcdef.src.rpm']
+
+    with open(path, 'rb') as f:
+        lead = f.read(96)
+        assert lead[0:4] == srpmwriter._LEAD_MAGIC
+        assert struct.unpack('!H', lead[6:8]) == (1,)
+        assert lead[10:10 + 19] == 'foo-1.0-1.git.abcdef'[0:19]
+        sigdata, sig = _read_header(f)
+        f.read(-len(sigdata) % 8)
+        header_data, header = _read_header(f)
+        payload = f.read()
+
+    assert sig.get(1000) == [len(header_data) + len(payload)]
+    assert sig.get(1004) == hashlib.md5(header_data + payload).digest()
+    assert sig.get(269) == hashlib.sha1(header_data).hexdigest()
+    assert sig.get(273) == hashlib.sha256(header_data).hexdigest()
+    cpio = gzip.GzipFile(fileobj=StringIO.StringIO(payload)).read()
+    assert sig.get(1007) == [len(cpio)]
+    assert _read_cpio(cpio) == contents
+
+    names = sorted(contents)
+    assert header.get(1000) == 'foo'
+    assert header.get(1004) == ['Foo']
+    assert header.get(1117) == names
+    assert header.get(1118) == ['']
+    assert header.get(1028) == [len(contents[n]) for n in names]
+    assert header.get(1035) == [hashlib.sha256(contents[n]).hexdigest() for n in names]
+    assert header.get(1037) == [0, 0, 32]
+    assert header.get(5011) == [8]
+    assert header.get(1049) == ['gcc', 'glib2-devel', 'rpmlib(CompressedFileNames)',
+                                'rpmlib(FileDigests)']
+    assert header.get(1048)[0:2] == [0, 12]
+
+
+def test_write_srpm_missing_source(tmpdir, monkeypatch):
+    monkeypatch.setattr(srpmwriter, 'rpm', type('rpm', (object,), {'__version__': '4.11.3'}))
+    tmpdir.join('foo.spec').write('Name: foo\n')
+    destdir = tmpdir.mkdir('out')
+    with pytest.raises(OSError):
+        srpmwriter.write_srpm(FakeSpec(str(tmpdir.join('foo.spec'))), str(destdir))
+    assert os.listdir(str(destdir)) == []
+
+
+@pytest.mark.skipif(find_executable('rpmbuild') is None, reason="needs rpmbuild")
+def test_compare_with_rpmbuild(tmpdir):
+    """The SRPMs of the benchmark corpus are the same as rpmbuild's"""
+    bench_spec = pytest.importorskip('bench_spec')
+    specfile = pytest.importorskip('rdgo.specfile')
+    for (n, txt) in enumerate(bench_spec.generate_corpus(20, 2, 2000, 1)):
+        d = tmpdir.mkdir(str(n))
+        spec_path = str(d.join('pkg{0}.spec'.format(n)))
+        with open(spec_path, 'w') as f:
+            f.write(txt)
+        for (url, num, flags) in specfile.Spec(spec_path).rpmspec.sources:
+            d.join(os.path.basename(url)).write(url * (num + 1))
+        argv = ['rpmbuild', '-bs', spec_path]
+        for v in ['_sourcedir', '_specdir', '_builddir', '_srcrpmdir', '_rpmdir']:
+            argv[1:1] = ['--define', '%' + v + ' ' + str(d)]
+        subprocess.check_call(argv)
+        [expected] = [str(d.join(name)) for name in os.listdir(str(d)) if name.endswith('.src.rpm')]
+        written = srpmwriter.write_srpm(specfile.Spec(spec_path), str(d.mkdir('written')))
+        assert srpmwriter.compare_srpms(expected, written) == []
+
+
+def _fake_rpm2cpio(tmpdir, monkeypatch):
+    """rpm2cpio that outputs the file it is given as is"""
+    bindir = tmpdir.mkdir('bin')
+    script = bindir.join('rpm2cpio')
+    script.write('#!/bin/sh\nexec cat "$1"\n')
+    script.chmod(0755)
+    monkeypatch.setenv('PATH', str(bindir) + ':' + os.environ['PATH'])
+
+
+def test_payload_digests(tmpdir, monkeypatch):
+    _fake_rpm2cpio(tmpdir, monkeypatch)
+    cpio = (srpmwriter._cpio_header(1, 0100644, 1, 0, 5, 'foo.spec') + 'spec\n' + '\0' * 3 +
+            srpmwriter._cpio_header(0, 0, 1, 0, 0, 'TRAILER!!!'))
+    path = tmpdir.join('foo.cpio')
+    path.write(cpio)
+    assert srpmwriter._payload_digests(str(path)) == {'foo.spec': hashlib.sha256('spec\n').hexdigest()}
+    # Cut short anywhere, including in a header
+    for length in [0, 50, 115, 122, 130, 240]:
+        path.write(cpio[:length])
+        with pytest.raises(Exception) as e:
+            srpmwriter._payload_digests(str(path))
+        assert 'Truncated payload' in str(e.value)
+    path.write('x' * 200)
+    with pytest.raises(Exception) as e:
+        srpmwriter._payload_digests(str(path))
+    assert 'Bad cpio header' in str(e.value)
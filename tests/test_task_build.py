@@ -0,0 +1,278 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+import pytest
+
+task_build = pytest.importorskip('rdgo.task_build')
+
+
+class FakeMockchain(object):
+    """Stands in for mockchain: each SRPM (whose contents are those of
+    its one binary RPM) builds into its result directory, unless its
+    name is in @failing.  The commands the build runs are recorded in
+    @commands, as (argv, cwd)."""
+    def __init__(self):
+        self.failing = set()
+        self.built = []
+        self.argvs = []
+        self.commands = []
+
+    def run_sync(self, argv, cwd=None):
+        self.commands.append((argv, cwd))
+
+    def __call__(self, argv):
+        self.argvs.append(argv)
+        resultroot = argv[argv.index('-l') + 1]
+        rc = 0
+        for srpm in [a for a in argv if a.endswith('.temp.src.rpm')]:
+            name = os.path.basename(srpm)[:-len('.temp.src.rpm')]
+            self.built.append(name)
+            resultdir = resultroot + '/' + name
+            os.makedirs(resultdir)
+            success = name not in self.failing
+            if success:
+                with open(srpm) as f, open(resultdir + '/' + name + '.x86_64.rpm', 'w') as out:
+                    out.write(f.read())
+            else:
+                rc = 2
+            with open(resultdir + '/status.json', 'w') as f:
+                json.dump({'status': 'success' if success else 'failed'}, f)
+        return rc
+
+
+@pytest.fixture
+def mockchain(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('target.cfg').write("config_opts['root'] = 'target'\n")
+    mockchain = FakeMockchain()
+    monkeypatch.setattr(task_build, 'mockchain_main', mockchain)
+    monkeypatch.setattr(task_build, 'run_sync', mockchain.run_sync)
+    monkeypatch.setattr(task_build, 'srpm_content_digests',
+                        lambda paths: dict((p, hashlib.sha256(open(p).read()).hexdigest()) for p in paths))
+    # name-1.0-1 provides name-devel
+    monkeypatch.setattr(task_build, 'resultdir_provides',
+                        lambda resultdir: [os.path.basename(resultdir).rsplit('-', 2)[0] + '-devel'])
+    return mockchain
+
+
+def _snapshot(workdir, srpms, mock='target.cfg', **root):
+    """Write a snapshot of components given as name -> (nvr, contents,
+    buildrequires), and further @root options"""
+    snapshotdir = workdir.join('snapshot')
+    snapshotdir.ensure(dir=True)
+    components = []
+    for name in sorted(srpms):
+        (nvr, contents, buildrequires) = srpms[name]
+        snapshotdir.join(nvr + '.temp.src.rpm').write(contents)
+        components.append({'pkgname': name, 'srpm': nvr + '.temp.src.rpm',
+                           'buildrequires': buildrequires, 'packages': [name, name + '-devel']})
+    root['mock'] = mock
+    snapshotdir.join('snapshot.json').write(json.dumps({'root': root,
+                                                        'components': components}))
+
+
+def _build(*argv):
+    task_build.TaskBuild().run(list(argv))
+
+
+def _built(builddir):
+    return sorted(name for name in os.listdir(str(builddir))
+                  if name not in ('depindex.json', 'repodata'))
+
+
+def test_build_reuses(tmpdir, mockchain):
+    srpms = {'a': ('a-1.0-1', 'a v1', []),
+             'b': ('b-1.0-1', 'b v1', ['a-devel'])}
+    _snapshot(tmpdir, srpms)
+    _build()
+    assert mockchain.built == ['a-1.0-1', 'b-1.0-1']
+    assert _built(tmpdir.join('build')) == ['a-1.0-1', 'b-1.0-1']
+    srpms['b'] = ('b-1.1-1', 'b v2', ['a-devel'])
+    _snapshot(tmpdir, srpms)
+    _build()
+    assert mockchain.built == ['a-1.0-1', 'b-1.0-1', 'b-1.1-1']
+    assert _built(tmpdir.join('build')) == ['a-1.0-1', 'b-1.1-1']
+
+
+def test_failed_build_rolls_back(tmpdir, mockchain):
+    srpms = {'a': ('a-1.0-1', 'a v1', []),
+             'b': ('b-1.0-1', 'b v1', [])}
+    _snapshot(tmpdir, srpms)
+    _build()
+    srpms = {'a': ('a-1.1-1', 'a v2', []),
+             'b': ('b-1.1-1', 'b v2', [])}
+    _snapshot(tmpdir, srpms)
+    mockchain.failing.add('b-1.1-1')
+    with pytest.raises(SystemExit):
+        _build()
+    assert _built(tmpdir.join('build')) == ['a-1.0-1', 'b-1.0-1']
+    # a's new build was never published, so it leaves no state behind
+    conn = sqlite3.connect(str(tmpdir.join('buildstate.db')))
+    assert conn.execute('SELECT pkgname, dirname, pending FROM builds ORDER BY pkgname').fetchall() == \
+        [('a', 'a-1.0-1', 0), ('b', 'b-1.0-1', 0)]
+
+
+def test_repodata_seeded(tmpdir, mockchain, monkeypatch):
+    srpms = {'a': ('a-1.0-1', 'a v1', []),
+             'b': ('b-1.0-1', 'b v1', [])}
+    _snapshot(tmpdir, srpms)
+    _build()
+    tmpdir.join('build', 'repodata').ensure(dir=True).join('repomd.xml').write('generation 1')
+    srpms['b'] = ('b-1.1-1', 'b v2', [])
+    _snapshot(tmpdir, srpms)
+    seen = []
+    def run_sync(argv, cwd=None):
+        mockchain.run_sync(argv, cwd)
+        with open(cwd + '/repodata/repomd.xml') as f:
+            seen.append(f.read())
+    monkeypatch.setattr(task_build, 'run_sync', run_sync)
+    mockchain.commands = []
+    _build()
+    cachedir = str(tmpdir.join('createrepo-cache'))
+    newbuilddir = os.path.realpath(str(tmpdir.join('build')))
+    # The new generation starts out with the previous repodata, which
+    # createrepo_c updates
+    assert mockchain.commands == [(['createrepo_c', '--no-database', '--update',
+                                    '--cachedir', cachedir, '.'], newbuilddir)]
+    assert seen == ['generation 1']
+    assert '--createrepo-cachedir' in mockchain.argvs[-1]
+    assert mockchain.argvs[-1][mockchain.argvs[-1].index('--createrepo-cachedir') + 1] == cachedir
+
+
+def test_createrepo_options(tmpdir, mockchain):
+    _snapshot(tmpdir, {'a': ('a-1.0-1', 'a v1', [])},
+              createrepo={'compress-type': 'zstd', 'zchunk': True, 'workers': 4})
+    _build()
+    opts = ['--compress-type', 'zstd', '--zck', '--workers', '4']
+    # Both mockchain's local repo and the published one
+    assert [a for a in mockchain.argvs[0] if a.startswith('--createrepo-option=')] == \
+        ['--createrepo-option=' + o for o in opts]
+    assert mockchain.commands == [(['createrepo_c', '--no-database', '--update',
+                                    '--cachedir', str(tmpdir.join('createrepo-cache'))] + opts + ['.'],
+                                   os.path.realpath(str(tmpdir.join('build'))))]
+
+
+def test_deltarpms(tmpdir, mockchain):
+    deltarpms = {'num-deltas': 2, 'max-delta-rpm-size': 1000000}
+    srpms = {'a': ('a-1.0-1', 'a v1', []),
+             'b': ('b-1.0-1', 'b v1', [])}
+    _snapshot(tmpdir, srpms, deltarpms=deltarpms)
+    _build()
+    # Nothing to make deltas against yet
+    assert mockchain.commands[-1][0] == ['createrepo_c', '--no-database', '--update',
+                                         '--cachedir', str(tmpdir.join('createrepo-cache')), '.']
+    olddir = os.path.realpath(str(tmpdir.join('build', 'b-1.0-1')))
+    srpms['b'] = ('b-1.1-1', 'b v2', [])
+    _snapshot(tmpdir, srpms, deltarpms=deltarpms)
+    _build()
+    # Only against the packages this generation replaced
+    assert mockchain.commands[-1][0] == ['createrepo_c', '--no-database', '--update',
+                                         '--cachedir', str(tmpdir.join('createrepo-cache')),
+                                         '--deltas', '--num-deltas', '2', '--max-delta-rpm-size', '1000000',
+                                         '--oldpackagedirs', olddir, '.']
+
+
+def test_deltarpms_per_component(tmpdir, mockchain):
+    _snapshot(tmpdir, {'a': ('a-1.0-1', 'a v1', [])}, deltarpms=True, repodata='per-component')
+    with pytest.raises(SystemExit):
+        _build()
+    assert mockchain.built == []
+
+
+@pytest.fixture
+def targets(tmpdir, mockchain, monkeypatch):
+    """Builds for several targets in-process rather than in
+    subprocesses; records the argv of each target's build.  SRPMs named
+    n-* only build noarch packages."""
+    for name in ['x86', 'arm']:
+        tmpdir.join(name + '.cfg').write("config_opts['root'] = '{0}'\n".format(name))
+    runs = []
+    def run_target_builds(self, targets, argv, extra_args=None):
+        failed = []
+        for target in targets:
+            target_argv = argv + ['--target', target] + (extra_args or [])
+            runs.append(target_argv)
+            try:
+                task_build.TaskBuild().run(target_argv)
+            except SystemExit:
+                failed.append(target)
+        return failed
+    monkeypatch.setattr(task_build.TaskBuild, '_run_target_builds', run_target_builds)
+    monkeypatch.setattr(task_build, 'srpm_buildarchs',
+                        lambda path: ['noarch'] if os.path.basename(path).startswith('n-') else ['x86_64'])
+    return runs
+
+
+def test_targets_share_noarch(tmpdir, mockchain, targets):
+    _snapshot(tmpdir, {'a': ('a-1.0-1', 'a v1', []),
+                       'n': ('n-1.0-1', 'n v1', [])}, mock=['x86.cfg', 'arm.cfg'])
+    _build()
+    x86dir = str(tmpdir.join('builds', 'x86', 'build'))
+    assert targets == [['--target', 'x86.cfg'],
+                       ['--target', 'arm.cfg', '--noarch-from', x86dir]]
+    # The noarch SRPM is only built for the first target
+    assert mockchain.built == ['a-1.0-1', 'n-1.0-1', 'a-1.0-1']
+    armdir = tmpdir.join('builds', 'arm', 'build')
+    assert _built(armdir) == ['a-1.0-1', 'n-1.0-1']
+    assert armdir.join('n-1.0-1', 'n-1.0-1.x86_64.rpm').read() == 'n v1'
+    # and recorded as built, so it's reused next time
+    srpms = {'a': ('a-1.1-1', 'a v2', []),
+             'n': ('n-1.0-1', 'n v1', [])}
+    _snapshot(tmpdir, srpms, mock=['x86.cfg', 'arm.cfg'])
+    _build()
+    assert mockchain.built[3:] == ['a-1.1-1', 'a-1.1-1']
+    assert _built(armdir) == ['a-1.1-1', 'n-1.0-1']
+
+
+def test_targets_primary_failure(tmpdir, mockchain, targets):
+    srpms = {'a': ('a-1.0-1', 'a v1', []),
+             'n': ('n-1.0-1', 'n v1', [])}
+    _snapshot(tmpdir, srpms, mock=['x86.cfg', 'arm.cfg'])
+    _build()
+    srpms['a'] = ('a-1.1-1', 'a v2', [])
+    _snapshot(tmpdir, srpms, mock=['x86.cfg', 'arm.cfg'])
+    mockchain.failing.add('a-1.1-1')
+    del targets[:]
+    with pytest.raises(SystemExit):
+        _build()
+    # The other targets aren't built, and both keep their last
+    # published generation
+    assert targets == [['--target', 'x86.cfg']]
+    assert mockchain.built[3:] == ['a-1.1-1']
+    for name in ['x86', 'arm']:
+        assert _built(tmpdir.join('builds', name, 'build')) == ['a-1.0-1', 'n-1.0-1']
+
+
+def test_worker_rejects_ccache(tmpdir, mockchain, monkeypatch):
+    _snapshot(tmpdir, {'a': ('a-1.0-1', 'a v1', [])}, ccache=True)
+    def open_workers(specs, secret=None):
+        raise AssertionError("no workers should be started")
+    monkeypatch.setattr(task_build.dispatch, 'open_workers', open_workers)
+    with pytest.raises(SystemExit):
+        _build('--worker', 'local:1')
+    assert mockchain.built == []
+
+
+def test_merge_component_repos(tmpdir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(task_build, 'run_sync', lambda argv, cwd=None: calls.append((argv, cwd)))
+    builddir = tmpdir.mkdir('build-1')
+    for name in ['changed-1.0-1', 'reused-1.0-1', 'norepodata-1.0-1']:
+        builddir.mkdir(name)
+    builddir.join('reused-1.0-1').mkdir('repodata').join('repomd.xml').write('')
+    builddir.mkdir('repodata')
+    task = task_build.TaskBuild()
+    task.newbuilddir = str(builddir)
+    createrepo_opts = ['--compress-type', 'xz', '--zck', '--workers', '4']
+    task._merge_component_repos(set(['changed-1.0-1']), '/cache', createrepo_opts, ['--compress-type', 'xz', '--zck'])
+    assert calls[0:2] == [
+        (['createrepo_c', '--no-database', '--location-prefix', name + '/', '--cachedir', '/cache']
+         + createrepo_opts + ['.'], str(builddir.join(name)))
+        for name in ['changed-1.0-1', 'norepodata-1.0-1']]
+    assert calls[2][0] == ['mergerepo_c', '--no-database', '--omit-baseurl', '--all',
+                           '-o', str(builddir), '--compress-type', 'xz', '--zck'] + \
+        sum([['--repo', str(builddir.join(name))]
+             for name in ['changed-1.0-1', 'norepodata-1.0-1', 'reused-1.0-1']], [])
+    assert len(calls) == 3
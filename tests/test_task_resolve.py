@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+task_resolve = pytest.importorskip('rdgo.task_resolve')
+
+
+# As named after the descriptions of FakeMirror
+SRPM = 'foo-1.0.0-{0}.{1}.temp.src.rpm'.format('a' * 40, 'b' * 40)
+
+
+class FakeMirror(object):
+    def __init__(self):
+        self.tags = {'git://example.com/foo': 'v1.0-0'}
+
+    def describe(self, url, rev):
+        return (self.tags.get(url), rev)
+
+
+def _component():
+    return {'name': 'foo', 'pkgname': 'foo',
+            'src': 'git://example.com/foo', 'branch': 'master',
+            'distgit': {'name': 'foo', 'src': 'git://example.com/rpms/foo', 'branch': 'master'}}
+
+
+def _snapshotted():
+    component = _component()
+    component['revision'] = 'a' * 40
+    component['distgit']['revision'] = 'b' * 40
+    component['srpm'] = SRPM
+    component['buildrequires'] = ['gcc']
+    component['packages'] = ['foo']
+    return component
+
+
+@pytest.fixture
+def resolver(tmpdir):
+    resolver = task_resolve.TaskResolve()
+    resolver.snapshotdir = str(tmpdir.mkdir('snapshot'))
+    resolver.tmp_snapshotdir = str(tmpdir.mkdir('snapshot.tmp'))
+    resolver.mirror = FakeMirror()
+    resolver._old_components = {'foo': _snapshotted()}
+    resolver._old_target_macros = {'dist': '.el7'}
+    resolver.target_macros = {'dist': '.el7'}
+    tmpdir.join('snapshot', SRPM).write('srpm')
+    return resolver
+
+
+def test_pin_to_snapshot(resolver):
+    component = _component()
+    # Everything is resolved unless restricted
+    assert not resolver._pin_to_snapshot(component)
+    resolver._only = frozenset(['foo'])
+    assert not resolver._pin_to_snapshot(component)
+    resolver._only = frozenset(['bar'])
+    assert resolver._pin_to_snapshot(component)
+    assert component['revision'] == 'a' * 40
+    assert component['distgit']['revision'] == 'b' * 40
+    # Its entry in overlay.yml changed
+    component = _component()
+    component['branch'] = 'stable'
+    assert not resolver._pin_to_snapshot(component)
+    assert 'revision' not in component
+
+
+def test_reuse_srpm(resolver):
+    component = _component()
+    component['revision'] = 'a' * 40
+    component['distgit']['revision'] = 'b' * 40
+    assert resolver._reuse_srpm(component)
+    assert component['srpm'] == SRPM
+    assert component['packages'] == ['foo']
+    assert os.path.isfile(resolver.tmp_snapshotdir + '/' + SRPM)
+
+
+def test_reuse_srpm_changed(resolver):
+    component = _component()
+    component['revision'] = 'c' * 40
+    component['distgit']['revision'] = 'b' * 40
+    assert not resolver._reuse_srpm(component)
+    # The specs are parsed with the target's macros
+    component['revision'] = 'a' * 40
+    resolver.target_macros = {'dist': '.el8'}
+    assert not resolver._reuse_srpm(component)
+    assert 'srpm' not in component
+    # A new tag changes the version, but not the revisions
+    resolver.target_macros = {'dist': '.el7'}
+    assert resolver._reuse_srpm(dict(component, distgit=dict(component['distgit'])))
+    resolver.mirror.tags['git://example.com/foo'] = 'v1.1-0'
+    assert not resolver._reuse_srpm(component)
+    assert 'srpm' not in component
+
+
+def test_load_target_macros_relative_cfg(tmpdir, monkeypatch):
+    loaded = []
+    def mock_config_macros(root):
+        loaded.append(root)
+        return {'dist': '.el7'}
+    monkeypatch.setattr(task_resolve, 'mock_config_macros', mock_config_macros)
+    # overlay.yml is a symlink into a checkout that has the config
+    checkout = tmpdir.mkdir('checkout')
+    checkout.join('overlay.yml').write('')
+    checkout.join('target.cfg').write('')
+    workdir = tmpdir.mkdir('work')
+    workdir.join('overlay.yml').mksymlinkto(checkout.join('overlay.yml'))
+    resolver = task_resolve.TaskResolve()
+    resolver.workdir = str(workdir)
+    resolver._load_target_macros({'root': {'mock': 'target.cfg'}})
+    assert loaded == [str(checkout.join('target.cfg'))]
+    assert resolver.target_macros == {'dist': '.el7'}
+    # One in the working directory takes precedence
+    workdir.join('target.cfg').write('')
+    resolver._load_target_macros({'root': {'mock': 'target.cfg'}})
+    assert loaded[-1] == str(workdir.join('target.cfg'))
+    resolver._load_target_macros({'root': {'mock': 'fedora-25-x86_64'}})
+    assert loaded[-1] == 'fedora-25-x86_64'
@@ -0,0 +1,132 @@
+import os
+import hashlib
+import argparse
+
+import pytest
+
+task_run = pytest.importorskip('rdgo.task_run')
+from rdgo import task_build
+
+from test_dispatch import FakeBuilds, _pipe_worker
+
+
+class FakeResolver(object):
+    """Resolves components to SRPMs with the given contents"""
+    def __init__(self, workdir, srpms, packages=None, old_packages=None):
+        self.tmp_snapshotdir = workdir + '/snapshot.tmp'
+        self.srpms = srpms
+        # The subpackages of each component's spec, now and in the
+        # previous snapshot
+        self.packages = packages or {}
+        self.old_packages = old_packages or {}
+        self.committed = 0
+
+    def prepare(self, opts, only=None):
+        if not os.path.isdir(self.tmp_snapshotdir):
+            os.mkdir(self.tmp_snapshotdir)
+        return {'root': {'mock': 'target.cfg'},
+                'components': [{'pkgname': name} for name in sorted(self.srpms)]}
+
+    def check_or_fail(self, expanded, opts):
+        pass
+
+    def old_component(self, pkgname):
+        if pkgname not in self.old_packages:
+            return None
+        return {'pkgname': pkgname, 'packages': self.old_packages[pkgname]}
+
+    def resolve_component(self, component, opts):
+        pkgname = component['pkgname']
+        (nvr, contents, buildrequires) = self.srpms[pkgname]
+        component['srpm'] = nvr + '.temp.src.rpm'
+        component['buildrequires'] = buildrequires
+        if pkgname in self.packages:
+            component['packages'] = self.packages[pkgname]
+        with open(self.tmp_snapshotdir + '/' + component['srpm'], 'w') as f:
+            f.write(contents)
+
+    def commit(self, expanded):
+        self.committed += 1
+        return True
+
+    def abandon(self):
+        raise AssertionError("Run failed")
+
+
+@pytest.fixture
+def builds(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('target.cfg').write("config_opts['root'] = 'target'\n")
+    builds = FakeBuilds()
+    monkeypatch.setattr(task_run.dispatch, '_build_one', builds)
+    monkeypatch.setattr(task_run.dispatch, 'open_workers', lambda specs, secret=None: [_pipe_worker('w0')])
+    monkeypatch.setattr(task_run.dispatch.mockchain, 'createrepo', lambda *args, **kwargs: ('', ''))
+    monkeypatch.setattr(task_build, 'run_sync', lambda argv, cwd=None: None)
+    monkeypatch.setattr(task_build, 'resultdir_provides',
+                        lambda resultdir: [os.path.basename(resultdir).rsplit('-', 2)[0] + '-devel'])
+    monkeypatch.setattr(task_run, 'srpm_content_digest',
+                        lambda path: hashlib.sha256(open(path).read()).hexdigest())
+    return builds
+
+
+def _run(workdir, srpms, **kwargs):
+    opts = argparse.Namespace(tempdir=None, worker=[], jobs=1, dispatch_listen='localhost:0',
+                              dispatch_url=None, worker_secret_file=None, logdir=None,
+                              touch_if_changed=None)
+    resolver = FakeResolver(workdir, srpms, **kwargs)
+    task_run.TaskRun().execute(opts, resolver)
+    assert resolver.committed == 1
+    return sorted(name for name in os.listdir(workdir + '/build') if name != 'depindex.json')
+
+
+def test_run(tmpdir, builds):
+    workdir = str(tmpdir)
+    srpms = {'a': ('a-1.0-1', 'a v1', []),
+             'b': ('b-1.0-1', 'b v1', ['a'])}
+    assert _run(workdir, srpms) == ['a-1.0-1', 'b-1.0-1']
+    assert builds.order == ['a-1.0-1', 'b-1.0-1']
+    # Nothing changed
+    assert _run(workdir, srpms) == ['a-1.0-1', 'b-1.0-1']
+    assert builds.order == ['a-1.0-1', 'b-1.0-1']
+    # Only the changed component is rebuilt; b now goes by what a
+    # provides
+    srpms['a'] = ('a-1.1-1', 'a v2', [])
+    srpms['b'] = ('b-1.0-1', 'b v1', ['a-devel'])
+    assert _run(workdir, srpms) == ['a-1.1-1', 'b-1.0-1']
+    assert builds.order == ['a-1.0-1', 'b-1.0-1', 'a-1.1-1']
+    with open(workdir + '/build/a-1.1-1/a-1.1-1.x86_64.rpm') as f:
+        assert f.read() == 'a v2'
+
+
+def test_run_subpackage_provides(tmpdir, builds):
+    # Never built, but the previous snapshot lists glib2's subpackages
+    workdir = str(tmpdir)
+    srpms = {'app': ('app-1.0-1', 'app v1', ['glib2-devel']),
+             'glib2': ('glib2-2.0-1', 'glib2 v1', [])}
+    _run(workdir, srpms, old_packages={'glib2': ['glib2', 'glib2-devel']})
+    assert builds.order == ['glib2-2.0-1', 'app-1.0-1']
+
+
+def test_run_resolved_provides(tmpdir, builds, monkeypatch):
+    # Known once resolved, for the components after it
+    added = {}
+    add = task_run.dispatch.BuildScheduler.add
+    def record(self, pkg, deps):
+        added[pkg] = set(deps)
+        add(self, pkg, deps)
+    monkeypatch.setattr(task_run.dispatch.BuildScheduler, 'add', record)
+    workdir = str(tmpdir)
+    srpms = {'glib2': ('glib2-2.0-1', 'glib2 v1', []),
+             'gtk3': ('gtk3-3.0-1', 'gtk3 v1', ['glib2-devel'])}
+    _run(workdir, srpms, packages={'glib2': ['glib2', 'glib2-devel']})
+    assert added == {'glib2': set(), 'gtk3': set(['glib2'])}
+
+
+def test_run_rejects_ccache(tmpdir, builds, monkeypatch):
+    resolver = FakeResolver(str(tmpdir), {})
+    monkeypatch.setattr(resolver, 'prepare',
+                        lambda opts, only=None: {'root': {'mock': 'target.cfg', 'ccache': True},
+                                                 'components': []})
+    opts = argparse.Namespace(tempdir=None)
+    with pytest.raises(SystemExit):
+        task_run.TaskRun().execute(opts, resolver)
@@ -0,0 +1,105 @@
+import os
+import errno
+
+import pytest
+
+utils = pytest.importorskip('rdgo.utils')
+
+
+@pytest.fixture
+def noreflink(monkeypatch):
+    monkeypatch.setattr(utils, '_reflink', lambda src, dest, stbuf: False)
+
+
+def _link_fails(monkeypatch, err):
+    def link(src, dest):
+        raise OSError(err, os.strerror(err))
+    monkeypatch.setattr(utils.os, 'link', link)
+
+
+def test_clone_file_reflink(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, '_noreflink_devs', set())
+    def ioctl(fd, request, srcfd):
+        assert request == utils._FICLONE
+        os.write(fd, os.read(srcfd, 1024))
+    monkeypatch.setattr(utils.fcntl, 'ioctl', ioctl)
+    src = tmpdir.join('src')
+    src.write('data')
+    os.chmod(str(src), 0o640)
+    os.utime(str(src), (1000, 2000))
+    dest = str(tmpdir.join('dest'))
+    assert utils.clone_file(str(src), dest) == 0
+    st = os.stat(dest)
+    assert (st.st_mtime, st.st_mode & 0o777, st.st_nlink) == (2000, 0o640, 1)
+    with open(dest) as f:
+        assert f.read() == 'data'
+
+
+def test_clone_file_reflink_unsupported(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, '_noreflink_devs', set())
+    calls = []
+    def ioctl(fd, request, srcfd):
+        calls.append(fd)
+        raise IOError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+    monkeypatch.setattr(utils.fcntl, 'ioctl', ioctl)
+    src = tmpdir.join('src')
+    src.write('data')
+    for name in ['a', 'b']:
+        assert utils.clone_file(str(src), str(tmpdir.join(name))) == 0
+        assert os.stat(str(tmpdir.join(name))).st_ino == os.stat(str(src)).st_ino
+    # Not tried again on the same device
+    assert len(calls) == 1
+
+
+def test_clone_file_copy(tmpdir, monkeypatch, noreflink):
+    _link_fails(monkeypatch, errno.EXDEV)
+    src = tmpdir.join('src')
+    src.write('x' * 100)
+    dest = str(tmpdir.join('dest'))
+    assert utils.clone_file(str(src), dest) == 100
+    assert os.stat(dest).st_ino != os.stat(str(src)).st_ino
+    with open(dest) as f:
+        assert f.read() == 'x' * 100
+
+
+def test_clone_file_error(tmpdir, monkeypatch, noreflink):
+    _link_fails(monkeypatch, errno.EACCES)
+    tmpdir.join('src').write('data')
+    with pytest.raises(OSError):
+        utils.clone_file(str(tmpdir.join('src')), str(tmpdir.join('dest')))
+
+
+def _tree(tmpdir, name):
+    src = tmpdir.mkdir(name)
+    src.join('a.rpm').write('a' * 10)
+    sub = src.mkdir('repodata')
+    sub.join('repomd.xml').write('r' * 5)
+    os.chmod(str(sub), 0o700)
+    os.symlink('a.rpm', str(src.join('link')))
+    return str(src)
+
+
+def test_clone_tree(tmpdir, noreflink):
+    src = _tree(tmpdir, 'src')
+    dest = str(tmpdir.join('dest'))
+    assert utils.clone_tree(src, dest) == {'copied': 0, 'shared': 15}
+    assert sorted(os.listdir(dest)) == ['a.rpm', 'link', 'repodata']
+    assert os.readlink(dest + '/link') == 'a.rpm'
+    assert os.stat(dest + '/repodata').st_mode & 0o777 == 0o700
+    assert os.stat(dest + '/repodata/repomd.xml').st_ino == os.stat(src + '/repodata/repomd.xml').st_ino
+    with pytest.raises(OSError):
+        utils.clone_tree(src, dest)
+
+
+def test_clone_trees(tmpdir, monkeypatch, noreflink):
+    _link_fails(monkeypatch, errno.EMLINK)
+    pairs = [(_tree(tmpdir, name), str(tmpdir.join(name + '-clone'))) for name in ['x', 'y']]
+    assert utils.clone_trees(pairs) == {'copied': 30, 'shared': 0}
+    for (src, dest) in pairs:
+        with open(dest + '/a.rpm') as f:
+            assert f.read() == 'a' * 10
+    assert utils.clone_trees([]) == {'copied': 0, 'shared': 0}
+
+
+def test_component_name():
+    assert utils.component_name('foo-bar-1.0-1.fc22') == 'foo-bar'